@@ -0,0 +1,210 @@
+from collections import OrderedDict
+from datetime import date
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+from review import ReviewData, REVIEW_ID_SCHEME
+from transform import parse_html, PARSER_VERSION
+
+DEFAULT_ARCHIVE_DIR = "page_archive"
+DEFAULT_CACHE_DIR = "parse_cache"
+DEFAULT_ARCHIVE_MAX_BYTES = 2 * 1024 ** 3
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 ** 2
+
+_PAGE_FILENAME_RE = re.compile(r"page-(\d+)-([0-9a-f]{64})\.html\.gz$")
+
+
+def page_hash(html_content: str) -> str:
+    """
+    SHA-256 of a page source, used as its content key. Not to be confused with fingerprint.content_hash,
+    which hashes the normalized content of a review.
+    """
+    return hashlib.sha256(html_content.encode('utf-8')).hexdigest()
+
+
+class _LRUDirectory:
+    """
+    Directory of files whose total size is capped, evicting the least recently used files first.
+    The files and their sizes are listed once, ordered by modification time, and then kept up to date in memory,
+    so that a write costs no directory walk. The modification time is refreshed on every hit, so that the order
+    survives restarts.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._files = None
+        self._size = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _iter_files(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                yield os.path.join(dirpath, name)
+
+    def _index(self) -> OrderedDict:
+        """
+        path -> size of every file, least recently used first. Read from disk on first use.
+        """
+        if self._files is None:
+            stats = []
+            for path in self._iter_files():
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                stats.append((stat.st_mtime, path, stat.st_size))
+            self._files = OrderedDict((path, size) for _, path, size in sorted(stats))
+            self._size = sum(self._files.values())
+        return self._files
+
+    def size(self) -> int:
+        self._index()
+        return self._size
+
+    def touch(self, path: str):
+        os.utime(path)
+        files = self._index()
+        if path in files:
+            files.move_to_end(path)
+
+    def write(self, path: str, data: bytes):
+        files = self._index()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._size += len(data) - files.pop(path, 0)
+        files[path] = len(data)
+        if self._size > self.max_bytes:
+            self.evict(keep=path)
+
+    def evict(self, keep: str = None):
+        """
+        Delete least recently used files until the directory fits in max_bytes.
+        """
+        files = self._index()
+        for path in list(files):
+            if self._size <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            self._size -= files.pop(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            logging.info(f"Evicted {path} from {self.root}")
+
+
+class PageStore:
+    """
+    Local archive of raw review pages, gzip compressed and keyed by marketplace, page number and content hash.
+    """
+
+    def __init__(self, root: str = DEFAULT_ARCHIVE_DIR, max_bytes: int = DEFAULT_ARCHIVE_MAX_BYTES):
+        self._files = _LRUDirectory(root, max_bytes)
+        self.root = root
+
+    def path_for(self, marketplace: str, page_num: int, html_hash: str) -> str:
+        return os.path.join(self.root, marketplace, f"page-{page_num:04d}-{html_hash}.html.gz")
+
+    def save(self, marketplace: str, page_num: int, html_content: str, html_hash: str = None) -> str:
+        """
+        Archive a page source. Pages already stored with the same content are not written again.
+
+        :return: The content hash of the page.
+        """
+        html_hash = html_hash or page_hash(html_content)
+        path = self.path_for(marketplace, page_num, html_hash)
+        if os.path.exists(path):
+            self._files.touch(path)
+        else:
+            self._files.write(path, gzip.compress(html_content.encode('utf-8')))
+        return html_hash
+
+    def load(self, marketplace: str, page_num: int, html_hash: str) -> str:
+        with gzip.open(self.path_for(marketplace, page_num, html_hash), 'rt', encoding='utf-8') as f:
+            return f.read()
+
+    def iter_pages(self, marketplace: str = None):
+        """
+        Yield (marketplace, page_num, html_hash) for every archived page, sorted by marketplace and page number.
+        """
+        marketplaces = [marketplace] if marketplace else sorted(os.listdir(self.root))
+        for name in marketplaces:
+            directory = os.path.join(self.root, name)
+            if not os.path.isdir(directory):
+                continue
+            for filename in sorted(os.listdir(directory)):
+                match = _PAGE_FILENAME_RE.match(filename)
+                if match:
+                    yield name, int(match.group(1)), match.group(2)
+
+
+class ParseCache:
+    """
+    Cache of parsed pages keyed on (content hash, parser version, review_id scheme), with size-bounded
+    LRU eviction.
+    """
+
+    def __init__(self, root: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+                 parser_version: str = PARSER_VERSION, review_id_scheme: str = None):
+        self._files = _LRUDirectory(root, max_bytes)
+        self.root = root
+        self.parser_version = parser_version
+        self.review_id_scheme = review_id_scheme or REVIEW_ID_SCHEME
+
+    def path_for(self, html_hash: str) -> str:
+        return os.path.join(self.root, f"v{self.parser_version}-{self.review_id_scheme}", html_hash[:2],
+                            f"{html_hash}.json.gz")
+
+    def get(self, html_hash: str):
+        """
+        Return the cached reviews of a page, or None on a cache miss. Their scraped_on is today.
+        """
+        path = self.path_for(html_hash)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable parse cache entry {path}: {e}")
+            return None
+        self._files.touch(path)
+        scraped_on = date.today()
+        for item in data:
+            # Entries written by older versions still hold the date of their first parse
+            item["scraped_on"] = scraped_on
+        return [ReviewData(**item) for item in data]
+
+    def put(self, html_hash: str, reviews: list[ReviewData]):
+        # scraped_on is not cached: it is the date of each scrape, not a property of the page
+        data = [review.model_dump() for review in reviews]
+        for item in data:
+            del item["scraped_on"]
+        self._files.write(self.path_for(html_hash), gzip.compress(json.dumps(data, ensure_ascii=False).encode('utf-8')))
+
+    def parse(self, html_content: str, html_hash: str = None, backend: str = None) -> list[ReviewData]:
+        """
+        parse_html with caching: pages whose content did not change are not parsed again.
+        """
+        html_hash = html_hash or page_hash(html_content)
+        reviews = self.get(html_hash)
+        if reviews is None:
+            reviews = parse_html(html_content, backend)
+            self.put(html_hash, reviews)
+        return reviews
+
+
+def iter_archived_reviews(page_store: PageStore, parse_cache: ParseCache, marketplace: str = None):
+    """
+    Reprocess archived pages without scraping again, only parsing the pages missing from the cache.
+    """
+    for name, page_num, html_hash in page_store.iter_pages(marketplace):
+        yield from parse_cache.parse(page_store.load(name, page_num, html_hash), html_hash)
@@ -0,0 +1,127 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import argparse
+import glob
+import logging
+import os
+import time
+from review import ReviewData, save_reviews_to_json, save_reviews_to_ndjson
+from transform import parse_html, parse_mhtml
+
+# Saved captures that can be re-parsed
+CAPTURE_EXTENSIONS = ('.html', '.mhtml')
+
+# Not review.DEFAULT_STORE_FILE: that one holds the reviews of a failed upload, waiting for retry-upload
+DEFAULT_OUTPUT_FILE = "parsed_files.ndjson.gz"
+
+
+@dataclass
+class FileParseResult:
+    """
+    Outcome of parsing one saved page.
+    """
+    path: str
+    reviews: list[ReviewData] = field(default_factory=list)
+    seconds: float = 0.0
+    error: str = None
+
+
+def expand_paths(source):
+    """
+    Resolve a directory, a glob pattern, a single file, or a list of any of them into a sorted list of capture files.
+    """
+    if isinstance(source, (list, tuple)):
+        return [path for item in source for path in expand_paths(item)]
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source)]
+    else:
+        paths = glob.glob(source, recursive=True)
+    return sorted(path for path in paths if path.lower().endswith(CAPTURE_EXTENSIONS) and os.path.isfile(path))
+
+
+def parse_file(path: str, backend: str = None) -> FileParseResult:
+    """
+    Parse one .html or .mhtml capture. Errors are reported in the result instead of being raised,
+    so that one broken capture does not abort a bulk run.
+    """
+    start = time.perf_counter()
+    try:
+        if path.lower().endswith('.mhtml'):
+            with open(path, 'rb') as f:
+                reviews = parse_mhtml(f.read(), backend)
+        else:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                reviews = parse_html(f.read(), backend)
+        return FileParseResult(path, reviews, time.perf_counter() - start)
+    except Exception as e:
+        return FileParseResult(path, [], time.perf_counter() - start, f"{type(e).__name__}: {e}")
+
+
+def iter_parse_results(source, max_workers: int = None, chunksize: int = 1, backend: str = None):
+    """
+    Parse every capture of `source` on a process pool, yielding a FileParseResult per file in input order.
+
+    :param source: A directory, glob pattern, file, or list of them.
+    :param max_workers: Number of worker processes. Defaults to the number of CPUs.
+    :param chunksize: Number of files sent to a worker at once. Larger chunks amortize IPC on many small files.
+    :param backend: Parser backend passed on to parse_html.
+    """
+    paths = expand_paths(source)
+    if not paths:
+        logging.warning(f"No {'/'.join(CAPTURE_EXTENSIONS)} captures found for {source}")
+        return
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        yield from executor.map(parse_file, paths, [backend] * len(paths), chunksize=chunksize)
+
+
+def parse_files(source, max_workers: int = None, chunksize: int = 1, backend: str = None, failures: list = None):
+    """
+    Bulk re-parse saved captures in parallel, streaming the merged reviews out in input order.
+    Per-file timings are logged; failed files are logged and appended to `failures` if given.
+
+    :return: A generator of ReviewData.
+    """
+    start = time.perf_counter()
+    num_files = num_reviews = num_failed = 0
+    for result in iter_parse_results(source, max_workers, chunksize, backend):
+        num_files += 1
+        if result.error:
+            num_failed += 1
+            logging.error(f"Failed to parse {result.path} after {result.seconds:.3f}s: {result.error}")
+            if failures is not None:
+                failures.append(result)
+            continue
+        logging.info(f"Parsed {len(result.reviews)} reviews from {result.path} in {result.seconds:.3f}s")
+        num_reviews += len(result.reviews)
+        yield from result.reviews
+    elapsed = time.perf_counter() - start
+    logging.info(
+        f"Parsed {num_reviews} reviews from {num_files - num_failed}/{num_files} files in {elapsed:.2f}s "
+        f"({num_reviews / elapsed if elapsed else 0:.0f} reviews/s)"
+    )
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Re-parse saved .html/.mhtml review pages in parallel.")
+    arg_parser.add_argument('source', nargs='+', help="Directories, glob patterns or files to parse.")
+    arg_parser.add_argument('--workers', type=int, default=None, help="Number of worker processes.")
+    arg_parser.add_argument('--chunksize', type=int, default=1, help="Files sent to a worker at once.")
+    arg_parser.add_argument('--backend', default=None, help="Parser backend: bs4 or lxml.")
+    arg_parser.add_argument('--output', default=DEFAULT_OUTPUT_FILE,
+                            help="File to save the reviews to: newline-delimited JSON (.ndjson, optionally .gz), "
+                                 "or a JSON array (.json).")
+    args = arg_parser.parse_args(argv)
+
+    reviews = parse_files(args.source, args.workers, args.chunksize, args.backend)
+    if args.output.endswith(".json"):
+        reviews = list(reviews)
+        save_reviews_to_json(reviews, args.output)
+        num_saved = len(reviews)
+    else:
+        num_saved = save_reviews_to_ndjson(reviews, args.output)
+    print(f"Saved {num_saved} reviews to '{args.output}'.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,450 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from email.message import EmailMessage
+import argparse
+import copy
+from functools import lru_cache
+import json
+import logging
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from bs4 import BeautifulSoup
+import transform
+from review import ReviewData, save_reviews_to_json, load_reviews_from_json, save_reviews_to_ndjson, \
+    iter_reviews_from_ndjson
+from columnar import ReviewBatch
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SAMPLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'resources', 'sample.html')
+DEFAULT_SCALES = (1, 10, 100)
+DEFAULT_REPEAT = 3
+DEFAULT_OUTPUT = "bench_results.json"
+# A stage fails the comparison with a baseline when its throughput drops by more than this fraction
+DEFAULT_THRESHOLD = 0.25
+# Timed runs of a stage stop early once they have taken this long, so that large scales stay affordable
+TIME_BUDGET = 10.0
+
+# Representative "Review by X on D" strings: one per marketplace language, as they appear in the page source
+DATE_AND_AUTHOR_TEMPLATES = (
+    "Review by {author} on 28 October 2024",
+    "Revisado por {author} el 14 de octubre de\n                              2024",
+    "Avis de {author} le 12 août 2024",
+    "Rezension von {author} am 3. März 2024",
+    "Recensie door {author} op 1 mei 2024",
+    "Recensione di {author} il 5 maggio 2023",
+    "Recension av {author} den 7 maj 2024",
+    "Recenzja od {author} dnia 14 października 2024",
+)
+
+
+def legacy_parse_review_date_and_author(review_date_and_author: str):
+    """
+    The English-only parser used before the multilingual one, kept as the benchmark baseline.
+    """
+    if review_date_and_author == None:
+        return None, None
+    pattern = r"Review by (.+?) on (\d{1,2} \w+ \d{4})"
+    match = re.match(pattern, review_date_and_author)
+    if not match:
+        logging.warning(f"data + author string : {review_date_and_author} does not match the expected format. Did you change the website language to ENGLISH??")
+        return None, None
+    author = match.group(1).strip()
+    date_string = match.group(2).strip()
+    english_months = {
+        'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6,
+        'july': 7, 'august': 8, 'september': 9, 'october': 10, 'november': 11, 'december': 12
+    }
+    parts = date_string.split(' ')
+    try:
+        month = english_months.get(parts[1].lower())
+        if not month:
+            raise ValueError(f"Invalid month name: {parts[1]}")
+        review_date = datetime(int(parts[2]), month, int(parts[0])).date()
+    except ValueError as e:
+        logging.error(f"Error parsing date: {e}")
+        return None, None
+    return review_date, author
+
+
+def _per_call_seconds(function, strings, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for string in strings:
+            function(string)
+    return (time.perf_counter() - start) / (repeat * len(strings))
+
+
+def bench_date_parser(num_strings: int = 2000, repeat: int = 5) -> dict:
+    """
+    Per-review cost of parsing "Review by X on D" strings: the legacy English-only parser against the
+    multilingual one, both uncached (distinct strings) and cached (strings seen before, as on a re-scrape).
+
+    :return: A dict of microseconds per string, and how many strings each parser understood.
+    """
+    # Distinct authors, so that the uncached run never hits the LRU cache
+    strings = [
+        DATE_AND_AUTHOR_TEMPLATES[i % len(DATE_AND_AUTHOR_TEMPLATES)].format(author=f"Customer {i}")
+        for i in range(num_strings)
+    ]
+    english = [string for string in strings if string.startswith("Review by")]
+    parser = transform.parse_review_date_and_author
+    # Only the English strings are understood by the legacy parser; keep its warnings out of the timings
+    logging.disable(logging.ERROR)
+    try:
+        legacy = _per_call_seconds(legacy_parse_review_date_and_author, strings, repeat)
+        legacy_english = _per_call_seconds(legacy_parse_review_date_and_author, english, repeat)
+        legacy_parsed = sum(legacy_parse_review_date_and_author(string)[0] is not None for string in strings)
+        parser.cache_clear()
+        uncached = _per_call_seconds(parser.__wrapped__, strings, repeat)
+        uncached_english = _per_call_seconds(parser.__wrapped__, english, repeat)
+        parser.cache_clear()
+        for string in strings:
+            parser(string)
+        cached = _per_call_seconds(parser, strings, repeat)
+        parsed = sum(parser(string)[0] is not None for string in strings)
+    finally:
+        logging.disable(logging.NOTSET)
+    return {
+        "strings": len(strings),
+        "legacy_us": legacy * 1e6,
+        "legacy_english_us": legacy_english * 1e6,
+        "legacy_parsed": legacy_parsed,
+        "multilingual_us": uncached * 1e6,
+        "multilingual_english_us": uncached_english * 1e6,
+        "multilingual_cached_us": cached * 1e6,
+        "multilingual_parsed": parsed,
+    }
+
+
+def make_page(scale: int, sample_file: str = SAMPLE_FILE) -> str:
+    """
+    A synthetic review page holding `scale` copies of every review of the sample page.
+    """
+    with open(sample_file, 'r', encoding='utf-8') as f:
+        html_content = f.read()
+    if scale == 1:
+        return html_content
+    soup = BeautifulSoup(html_content, 'html.parser')
+    containers = soup.find_all('div', class_=transform.REVIEW_CONTAINER_CLASS)
+    parent = containers[-1].parent
+    for _ in range(scale - 1):
+        for container in containers:
+            parent.append(copy.copy(container))
+    return str(soup)
+
+
+def make_mhtml(html_content: str) -> bytes:
+    """
+    Wrap a page in a single-part .mhtml capture, like the ones saved by the browser.
+    """
+    message = EmailMessage()
+    message['Subject'] = 'Customer Reviews'
+    message.set_content(html_content, subtype='html', charset='utf-8')
+    return message.as_bytes()
+
+
+class _FakeJob:
+    total_bytes_processed = 0
+    total_bytes_billed = 0
+
+    def result(self):
+        return self
+
+
+class FakeBigQueryClient:
+    """
+    Accepts load jobs without sending them anywhere, reading the uploaded files so that the I/O is still paid.
+    """
+
+    def load_table_from_json(self, rows, table_id, job_config=None):
+        json.dumps(rows)
+        return _FakeJob()
+
+    def load_table_from_file(self, file_obj, table_id, job_config=None, rewind=False):
+        file_obj.read()
+        return _FakeJob()
+
+    def query(self, query, job_config=None):
+        return _FakeJob()
+
+    def close(self):
+        pass
+
+
+@lru_cache(maxsize=None)
+def _sample_reviews():
+    with open(SAMPLE_FILE, 'r', encoding='utf-8') as f:
+        return transform.parse_html(f.read())
+
+
+def make_reviews(scale: int) -> list[ReviewData]:
+    """
+    `scale` copies of the reviews of the sample page, without parsing a scaled page.
+    """
+    return [review.model_copy() for _ in range(scale) for review in _sample_reviews()]
+
+
+# Each stage prepares its input for a scale in a work directory, and returns (input, run, number of reviews).
+# Only run(input) is measured; it returns its output, which is kept alive while allocations are counted.
+# Stages that produce the reviews give None as their number, and are credited with the reviews of their output.
+def _stage_parse_html(scale, work_dir):
+    return make_page(scale), transform.parse_html, None
+
+
+def _stage_parse_mhtml(scale, work_dir):
+    return make_mhtml(make_page(scale)), transform.parse_mhtml, None
+
+
+def _stage_construct(scale, work_dir):
+    rows = [review.model_dump() for review in make_reviews(scale)]
+    return rows, lambda rows: [ReviewData(**row) for row in rows], len(rows)
+
+
+def _stage_model_dump(scale, work_dir):
+    reviews = make_reviews(scale)
+    return reviews, lambda reviews: [review.model_dump() for review in reviews], len(reviews)
+
+
+def _stage_save_json(scale, work_dir):
+    reviews = make_reviews(scale)
+    return reviews, lambda reviews: save_reviews_to_json(reviews, os.path.join(work_dir, 'reviews.json')), len(reviews)
+
+
+def _stage_load_json(scale, work_dir):
+    filename = os.path.join(work_dir, 'reviews.json')
+    save_reviews_to_json(make_reviews(scale), filename)
+    return filename, load_reviews_from_json, None
+
+
+def _stage_save_ndjson(scale, work_dir):
+    reviews = make_reviews(scale)
+    filename = os.path.join(work_dir, 'reviews.ndjson.gz')
+    return reviews, lambda reviews: save_reviews_to_ndjson(reviews, filename), len(reviews)
+
+
+def _stage_load_ndjson(scale, work_dir):
+    filename = os.path.join(work_dir, 'reviews.ndjson.gz')
+    save_reviews_to_ndjson(make_reviews(scale), filename)
+    return filename, lambda filename: list(iter_reviews_from_ndjson(filename)), None
+
+
+def _stage_load_ndjson_batch(scale, work_dir):
+    filename = os.path.join(work_dir, 'reviews.ndjson.gz')
+    save_reviews_to_ndjson(make_reviews(scale), filename)
+    return filename, ReviewBatch.from_ndjson, None
+
+
+def _stage_upload(scale, work_dir):
+    import load
+    load._loader_session = load.LoaderSession(client=FakeBigQueryClient())
+    reviews = make_reviews(scale)
+    return reviews, load.upload_to_staging_table, len(reviews)
+
+
+def _stage_upload_chunks(scale, work_dir):
+    import load
+    client = FakeBigQueryClient()
+    reviews = make_reviews(scale)
+    return reviews, lambda reviews: load.upload_chunks_to_staging_table(reviews, client=client, work_dir=work_dir), \
+        len(reviews)
+
+
+STAGES = {
+    "parse_html": _stage_parse_html,
+    "parse_mhtml": _stage_parse_mhtml,
+    "construct": _stage_construct,
+    "model_dump": _stage_model_dump,
+    "save_json": _stage_save_json,
+    "load_json": _stage_load_json,
+    "save_ndjson": _stage_save_ndjson,
+    "load_ndjson": _stage_load_ndjson,
+    "load_ndjson_batch": _stage_load_ndjson_batch,
+    "upload": _stage_upload,
+    "upload_chunks": _stage_upload_chunks,
+}
+
+
+@dataclass
+class StageResult:
+    stage: str
+    scale: int
+    reviews: int
+    seconds: float
+    reviews_per_s: float
+    peak_rss_mb: float = None
+    rss_growth_mb: float = None
+    alloc_peak_mb: float = None
+    alloc_blocks: int = None
+
+
+def _current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+
+
+def run_stage(stage: str, scale: int, repeat: int = DEFAULT_REPEAT, backend: str = None) -> StageResult:
+    """
+    Measure one stage on `scale` times the sample reviews: best time of `repeat` runs (fewer once
+    TIME_BUDGET is spent), then one more run under tracemalloc for the allocations. Meant to run in a
+    fresh process, so that the peak RSS is the stage's own.
+    """
+    logging.disable(logging.WARNING)
+    if backend:
+        transform.DEFAULT_PARSER_BACKEND = backend
+    with tempfile.TemporaryDirectory(prefix="bench_") as work_dir:
+        data, run, reviews = STAGES[stage](scale, work_dir)
+        rss_before = _current_rss_mb()
+        best = None
+        spent = 0.0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = run(data)
+            seconds = time.perf_counter() - start
+            if reviews is None:
+                reviews = len(output)
+            del output
+            best = seconds if best is None else min(best, seconds)
+            spent += seconds
+            if spent >= TIME_BUDGET:
+                break
+        peak_rss = _peak_rss_mb()
+
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        result = run(data)
+        after = tracemalloc.take_snapshot()
+        alloc_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # Blocks allocated by the run and still alive at its end, e.g. the models it built
+        alloc_blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+        del result
+    return StageResult(
+        stage, scale, reviews, best, reviews / best if best else 0.0,
+        peak_rss_mb=peak_rss,
+        rss_growth_mb=peak_rss - rss_before if peak_rss is not None and rss_before is not None else None,
+        alloc_peak_mb=alloc_peak / 2 ** 20,
+        alloc_blocks=alloc_blocks,
+    )
+
+
+def run_suite(stages=None, scales=DEFAULT_SCALES, repeat: int = DEFAULT_REPEAT, backend: str = None) -> dict:
+    """
+    Run every stage at every scale, each in its own process.
+
+    :return: The machine-readable results: environment and one StageResult dict per (stage, scale).
+    """
+    results = []
+    for stage in stages or STAGES:
+        for scale in scales:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(run_stage, stage, scale, repeat, backend).result()
+            print(f"{stage:>14} x{scale:<4} {result.reviews:>6} reviews  {result.reviews_per_s:>10.0f} reviews/s  "
+                  f"peak RSS {result.peak_rss_mb or 0:7.1f} MB  allocated {result.alloc_peak_mb:7.1f} MB "
+                  f"in {result.alloc_blocks} blocks")
+            results.append(asdict(result))
+    return {
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": backend or transform.DEFAULT_PARSER_BACKEND,
+        "parser_version": transform.PARSER_VERSION,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare_results(current: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> list[str]:
+    """
+    Compare the throughput of each (stage, scale) present in both runs.
+
+    :return: One message per stage that got slower than the baseline by more than `threshold` (a fraction).
+    """
+    baseline_results = {(result["stage"], result["scale"]): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        previous = baseline_results.get((result["stage"], result["scale"]))
+        if not previous or not previous["reviews_per_s"]:
+            continue
+        change = result["reviews_per_s"] / previous["reviews_per_s"] - 1
+        if change < -threshold:
+            regressions.append(
+                f"{result['stage']} x{result['scale']}: {result['reviews_per_s']:.0f} reviews/s, "
+                f"{-change:.0%} slower than the baseline ({previous['reviews_per_s']:.0f} reviews/s)"
+            )
+    return regressions
+
+
+def main(argv=None) -> int:
+    """
+    Run the benchmarks from the command line arguments.
+
+    :return: The exit status: 1 when a stage regressed against the baseline.
+    """
+    arg_parser = argparse.ArgumentParser(description="Benchmark the parse -> model -> serialize -> load path.")
+    arg_parser.add_argument('--stages', default=None, help=f"Comma separated stages. Default: {','.join(STAGES)}.")
+    arg_parser.add_argument('--scales', default=','.join(map(str, DEFAULT_SCALES)),
+                            help="Comma separated multiples of the sample page's reviews.")
+    arg_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="Timed runs per stage; the best counts.")
+    arg_parser.add_argument('--backend', default=None, help="Parser backend: bs4 or lxml.")
+    arg_parser.add_argument('--output', default=DEFAULT_OUTPUT, help="JSON file to write the results to.")
+    arg_parser.add_argument('--baseline', default=None, help="Results of an earlier run to compare with.")
+    arg_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help="Fail when a stage's throughput drops by more than this fraction of the baseline.")
+    arg_parser.add_argument('--date-parser', action='store_true',
+                            help="Only compare the legacy and multilingual date/author parsers.")
+    arg_parser.add_argument('--strings', type=int, default=2000, help="Distinct date/author strings to parse.")
+    args = arg_parser.parse_args(argv)
+
+    if args.date_parser:
+        result = bench_date_parser(args.strings, args.repeat)
+        print(f"Date/author parsing of {result['strings']} strings in 8 languages, per string:")
+        print(f"  legacy (English only):    {result['legacy_us']:.2f} us, {result['legacy_parsed']} parsed "
+              f"({result['legacy_english_us']:.2f} us on English strings)")
+        print(f"  multilingual:             {result['multilingual_us']:.2f} us, {result['multilingual_parsed']} parsed "
+              f"({result['multilingual_english_us']:.2f} us on English strings)")
+        print(f"  multilingual, cache hits: {result['multilingual_cached_us']:.2f} us")
+        return 0
+
+    stages = args.stages.split(',') if args.stages else None
+    unknown = set(stages or ()) - set(STAGES)
+    if unknown:
+        arg_parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+    current = run_suite(stages, [int(scale) for scale in args.scales.split(',')], args.repeat, args.backend)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(current, f, indent=4)
+    print(f"Results saved to '{args.output}'.")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(current, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No stage regressed by more than {args.threshold:.0%} against '{args.baseline}'.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
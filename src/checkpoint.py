@@ -0,0 +1,115 @@
+from pydantic import BaseModel, ValidationError
+import logging
+import os
+import time
+from review import ReviewData
+
+DEFAULT_CHECKPOINT_FILE = "checkpoint.ndjson"
+# Pages written between two fsyncs, and the longest time a written page may stay unsynced
+DEFAULT_FSYNC_EVERY = 8
+DEFAULT_FSYNC_INTERVAL = 5.0
+
+
+class PageCheckpoint(BaseModel):
+    """
+    One line of the checkpoint log: the reviews scraped from a page of a marketplace.
+    """
+    marketplace: str
+    page: int
+    reviews: list[ReviewData] = []
+
+
+class CheckpointLog:
+    """
+    Append-only write-ahead log of scraped pages, one PageCheckpoint per line, so that a crashed or
+    interrupted scrape can be resumed without fetching any completed page again.
+
+    Writes are flushed to the OS after every page, and fsynced every `fsync_every` pages or
+    `fsync_interval` seconds, whichever comes first. A line torn by a crash is dropped on replay.
+    """
+
+    def __init__(self, filename: str = DEFAULT_CHECKPOINT_FILE, fsync_every: int = DEFAULT_FSYNC_EVERY,
+                 fsync_interval: float = DEFAULT_FSYNC_INTERVAL):
+        self.filename = filename
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, marketplace: str, page_num: int, reviews: list[ReviewData]):
+        """
+        Append the reviews of a completed page.
+        """
+        if self._file is None:
+            self._file = open(self.filename, 'ab')
+        line = PageCheckpoint.model_construct(marketplace=marketplace, page=page_num, reviews=list(reviews))
+        self._file.write(line.model_dump_json().encode('utf-8') + b'\n')
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """
+        fsync the pages written so far.
+        """
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def replay(self) -> dict:
+        """
+        Read the log back. A page recorded several times keeps its last record.
+
+        :return: A dict (marketplace, page number) -> list of ReviewData, in log order.
+        """
+        self.close()
+        pages = {}
+        if not os.path.exists(self.filename):
+            return pages
+        with open(self.filename, 'rb') as f:
+            lines = f.readlines()
+        offset = 0
+        for line_num, line in enumerate(lines, start=1):
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError("incomplete line")
+                checkpoint = PageCheckpoint.model_validate_json(line)
+            except (ValueError, ValidationError) as e:
+                if line_num == len(lines):
+                    # The last write was cut short: drop it, so that new pages are appended after a clean line
+                    logging.warning(f"Dropping the torn last line of {self.filename}: {e}")
+                    with open(self.filename, 'r+b') as f:
+                        f.truncate(offset)
+                else:
+                    logging.warning(f"Skipping unreadable line {line_num} of {self.filename}: {e}")
+                offset += len(line)
+                continue
+            offset += len(line)
+            key = (checkpoint.marketplace, checkpoint.page)
+            pages.pop(key, None)
+            pages[key] = checkpoint.reviews
+        logging.info(f"Replayed {len(pages)} pages from {self.filename}")
+        return pages
+
+    def clear(self):
+        """
+        Delete the log, once its reviews are safely loaded.
+        """
+        self.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
@@ -0,0 +1,188 @@
+from contextlib import contextmanager
+import argparse
+import logging
+import os
+import sys
+import time
+
+# Deliberately light: every subcommand imports the modules it needs (Selenium, BeautifulSoup, the BigQuery client)
+# when it runs, so that e.g. retry-upload never loads the browser stack.
+
+
+@contextmanager
+def timed_imports(command: str):
+    """
+    Log how long the imports of the block took, and how many modules they loaded.
+    """
+    num_modules = len(sys.modules)
+    start = time.perf_counter()
+    yield
+    logging.info(f"{command}: imported {len(sys.modules) - num_modules} modules in "
+                 f"{time.perf_counter() - start:.3f}s")
+
+
+def scrape_command(args):
+    # main reads its switches from the environment when it is imported
+    if args.fetch_mode:
+        os.environ["REVIEW_FETCH_MODE"] = args.fetch_mode
+    if args.workers:
+        os.environ["REVIEW_WORKERS"] = str(args.workers)
+    if args.incremental:
+        os.environ["REVIEW_INCREMENTAL"] = "1"
+    if args.resume:
+        os.environ["REVIEW_RESUME"] = "1"
+    if args.pipeline:
+        os.environ["REVIEW_PIPELINE"] = "1"
+    with timed_imports("scrape"):
+        import main
+    main.main()
+
+
+def parse_files_command(args):
+    with timed_imports("parse-files"):
+        import batch_parse
+    batch_parse.main(args.forwarded)
+
+
+def upload_command(args):
+    with timed_imports("upload"):
+        from load import upload_saved_reviews
+    if args.file and not os.path.exists(args.file):
+        print(f"No such file: '{args.file}'")
+        return 1
+    try:
+        session = upload_saved_reviews(args.file, args.mode)
+        print(f"Data uploaded successfully. Load timings: {session.timing_summary()}")
+        print(f"Merge: {session.merge_summary()}")
+    except Exception as e:
+        print(f"Error uploading data to GBQ: {e}")
+        print("Please check the error and try again.")
+        return 1
+
+
+def retry_upload_command(args):
+    with timed_imports("retry-upload"):
+        from load import upload_saved_reviews
+    try:
+        session = upload_saved_reviews()
+        print(f"Data uploaded successfully. Load timings: {session.timing_summary()}")
+        print(f"Merge: {session.merge_summary()}")
+    except Exception as e:
+        print(f"Error uploading data to GBQ: {e}")
+        print("Please check the error and try again.")
+        return 1
+
+
+def bench_command(args):
+    with timed_imports("bench"):
+        import bench
+    return bench.main(args.forwarded)
+
+
+def query_command(args):
+    with timed_imports("query"):
+        from datetime import date
+        from warehouse import ReviewWarehouse, DEFAULT_WAREHOUSE_FILE
+    filters = {
+        "country": args.country, "asin": args.asin, "min_rating": args.min_rating, "max_rating": args.max_rating,
+        "since": date.fromisoformat(args.since) if args.since else None,
+        "until": date.fromisoformat(args.until) if args.until else None,
+    }
+    with ReviewWarehouse(args.warehouse or DEFAULT_WAREHOUSE_FILE) as warehouse:
+        if args.count:
+            print(warehouse.count(**filters))
+        elif args.search:
+            reviews = warehouse.search(args.search, args.limit, **filters)
+        else:
+            reviews = warehouse.query(limit=args.limit, **filters)
+    if not args.count:
+        for review in reviews:
+            print(review.model_dump_json())
+
+
+def mirror_command(args):
+    with timed_imports("mirror"):
+        from review import iter_saved_reviews
+        from warehouse import ReviewWarehouse, DEFAULT_WAREHOUSE_FILE
+    warehouse_file = args.warehouse or DEFAULT_WAREHOUSE_FILE
+    with ReviewWarehouse(warehouse_file) as warehouse:
+        for filename in args.files:
+            print(f"Upserted {warehouse.upsert(iter_saved_reviews(filename))} reviews from '{filename}'.")
+        print(f"'{warehouse_file}' holds {len(warehouse)} reviews.")
+
+
+def build_arg_parser():
+    arg_parser = argparse.ArgumentParser(prog="cli.py", description="Amazon Seller Central reviews scraper.")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+
+    scrape_parser = subparsers.add_parser("scrape", help="Log in, scrape every marketplace and load the reviews to GBQ.")
+    scrape_parser.add_argument('--fetch-mode', choices=("http", "browser"), default=None,
+                               help="How review pages are downloaded (REVIEW_FETCH_MODE).")
+    scrape_parser.add_argument('--workers', type=int, default=None, help="Headless browsers (REVIEW_WORKERS).")
+    scrape_parser.add_argument('--incremental', action='store_true',
+                               help="Only scrape reviews missing from the known reviews index (REVIEW_INCREMENTAL).")
+    scrape_parser.add_argument('--resume', action='store_true',
+                               help="Reuse the pages checkpointed by an interrupted run (REVIEW_RESUME).")
+    scrape_parser.add_argument('--pipeline', action='store_true',
+                               help="Fetch, parse and upload in overlapping stages (REVIEW_PIPELINE).")
+    scrape_parser.set_defaults(handler=scrape_command)
+
+    # These two forward their arguments to the module's own command line, see batch_parse.py and bench.py --help
+    parse_parser = subparsers.add_parser("parse-files", help="Re-parse saved .html/.mhtml captures in parallel.",
+                                         add_help=False)
+    parse_parser.set_defaults(handler=parse_files_command, forward=True)
+
+    upload_parser = subparsers.add_parser("upload", help="Upload and merge a file of saved reviews.")
+    upload_parser.add_argument('file', nargs='?', default=None,
+                               help="Saved reviews (.ndjson[.gz|.bz2|.xz] or legacy .json). "
+                                    "Defaults to parsed_data_store.ndjson.gz.")
+    upload_parser.add_argument('--mode', choices=("incremental", "full"), default=None,
+                               help="Merge mode (REVIEW_MERGE_MODE).")
+    upload_parser.set_defaults(handler=upload_command)
+
+    retry_parser = subparsers.add_parser("retry-upload", help="Upload the reviews saved by a failed scrape.")
+    retry_parser.set_defaults(handler=retry_upload_command)
+
+    query_parser = subparsers.add_parser("query", help="Query the local review warehouse, one JSON review per line.")
+    query_parser.add_argument('--warehouse', default=os.getenv("REVIEW_WAREHOUSE"),
+                              help="Warehouse file (REVIEW_WAREHOUSE). Defaults to warehouse.DEFAULT_WAREHOUSE_FILE.")
+    query_parser.add_argument('--country', default=None)
+    query_parser.add_argument('--asin', default=None)
+    query_parser.add_argument('--since', default=None, help="First review date, YYYY-MM-DD.")
+    query_parser.add_argument('--until', default=None, help="Last review date, YYYY-MM-DD.")
+    query_parser.add_argument('--min-rating', type=int, default=None)
+    query_parser.add_argument('--max-rating', type=int, default=None)
+    query_parser.add_argument('--search', default=None, help="Full-text query on titles and bodies.")
+    query_parser.add_argument('--limit', type=int, default=50)
+    query_parser.add_argument('--count', action='store_true', help="Only print the number of matching reviews.")
+    query_parser.set_defaults(handler=query_command)
+
+    mirror_parser = subparsers.add_parser("mirror", help="Upsert files of saved reviews into the local warehouse.")
+    mirror_parser.add_argument('files', nargs='+', help="Saved reviews (.ndjson[.gz|.bz2|.xz] or legacy .json).")
+    mirror_parser.add_argument('--warehouse', default=os.getenv("REVIEW_WAREHOUSE"),
+                               help="Warehouse file (REVIEW_WAREHOUSE). Defaults to warehouse.DEFAULT_WAREHOUSE_FILE.")
+    mirror_parser.set_defaults(handler=mirror_command)
+
+    bench_parser = subparsers.add_parser("bench", help="Benchmark the parse -> model -> serialize -> load path.",
+                                         add_help=False)
+    bench_parser.set_defaults(handler=bench_command, forward=True)
+    return arg_parser
+
+
+def run(argv=None) -> int:
+    arg_parser = build_arg_parser()
+    args, forwarded = arg_parser.parse_known_args(argv)
+    if forwarded and not getattr(args, "forward", False):
+        arg_parser.error(f"unrecognized arguments: {' '.join(forwarded)}")
+    args.forwarded = forwarded
+    try:
+        return args.handler(args) or 0
+    finally:
+        # Imported last, so that it is not counted in the imports of the subcommand
+        import telemetry
+        telemetry.export()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(run())
@@ -0,0 +1,311 @@
+from array import array
+from datetime import date
+from itertools import islice
+import json
+import sys
+from review import (ReviewData, generate_review_ids, DEFAULT_VALIDATION_BATCH, _open_reviews_file,
+                    _review_list_adapter)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Dates are stored as days since 1970-01-01, which is also Arrow's date32 representation
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Low-cardinality columns, dictionary encoded: an int32 code per row into a list of interned values
+DICTIONARY_COLUMNS = ("country", "asin", "brand")
+DATE_COLUMNS = ("review_date", "scraped_on")
+BOOL_COLUMNS = ("verified", "helpful")
+INT_COLUMNS = ("rating",)
+STRING_COLUMNS = ("review_id", "author", "title", "body", "url")
+# Column order of ReviewData and resources/schema.json
+COLUMNS = ("review_id", "country", "asin", "brand", "review_date", "author", "verified",
+           "helpful", "title", "body", "rating", "url", "scraped_on")
+
+# Exact python types of the non-null JSON values of each column, as written by review.save_reviews_to_ndjson
+_JSON_TYPES = {**{name: str for name in STRING_COLUMNS + DICTIONARY_COLUMNS + DATE_COLUMNS},
+               **{name: bool for name in BOOL_COLUMNS}, **{name: int for name in INT_COLUMNS}}
+
+# Bytes read at once when loading newline-delimited JSON
+READ_BLOCK_SIZE = 4 * 1024 ** 2
+
+_TYPECODES = {**{name: 'i' for name in DICTIONARY_COLUMNS + DATE_COLUMNS}, **{name: 'b' for name in BOOL_COLUMNS},
+              **{name: 'q' for name in INT_COLUMNS}}
+
+
+def _iter_lines(f, block_size: int = READ_BLOCK_SIZE):
+    """
+    The lines of a binary file, read in large blocks: much faster than line by line on compressed files.
+    """
+    rest = b''
+    while block := f.read(block_size):
+        lines = (rest + block).split(b'\n')
+        rest = lines.pop()
+        yield from lines
+    if rest:
+        yield rest
+
+
+class ReviewBatch:
+    """
+    Compact column store of reviews, as an alternative to a list of ReviewData models.
+
+    Numbers, booleans and dates live in typed arrays (dates as days since the epoch) with a byte-per-row
+    validity mask; country, asin and brand are interned and dictionary encoded. Rows go in and out as
+    plain dicts, so pydantic only runs at the boundaries: when pages are parsed into ReviewData, and
+    when to_reviews rebuilds models (without validating them again).
+    """
+
+    def __init__(self):
+        self._length = 0
+        self._data = {name: array(typecode) for name, typecode in _TYPECODES.items()}
+        self._valid = {name: bytearray() for name in _TYPECODES}
+        self._strings = {name: [] for name in STRING_COLUMNS}
+        self._dictionaries = {name: [] for name in DICTIONARY_COLUMNS}
+        self._codes = {name: {} for name in DICTIONARY_COLUMNS}
+
+    def __len__(self):
+        return self._length
+
+    @classmethod
+    def from_reviews(cls, reviews):
+        batch = cls()
+        batch.extend(reviews)
+        return batch
+
+    def append(self, review_id=None, country=None, asin=None, brand=None, review_date=None, author=None,
+               verified=None, helpful=None, title=None, body=None, rating=None, url=None, scraped_on=None):
+        """
+        Append one parsed row. Values must already have the ReviewData types; nothing is validated here.
+        """
+        for name, value in (("country", country), ("asin", asin), ("brand", brand)):
+            if value is None:
+                self._data[name].append(0)
+                self._valid[name].append(0)
+                continue
+            codes = self._codes[name]
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(self._dictionaries[name])
+                self._dictionaries[name].append(sys.intern(value))
+            self._data[name].append(code)
+            self._valid[name].append(1)
+        for name, value in (("review_date", review_date), ("scraped_on", scraped_on)):
+            self._data[name].append(value.toordinal() - _EPOCH_ORDINAL if value is not None else 0)
+            self._valid[name].append(value is not None)
+        for name, value in (("verified", verified), ("helpful", helpful), ("rating", rating)):
+            self._data[name].append(int(value) if value is not None else 0)
+            self._valid[name].append(value is not None)
+        strings = self._strings
+        strings["review_id"].append(review_id)
+        strings["author"].append(author)
+        strings["title"].append(title)
+        strings["body"].append(body)
+        strings["url"].append(url)
+        self._length += 1
+
+    @classmethod
+    def from_ndjson(cls, filename: str, batch_size: int = DEFAULT_VALIDATION_BATCH):
+        """
+        Load a file written by review.save_reviews_to_ndjson straight into a batch, without a model per row.
+        Lines are decoded `batch_size` at a time and checked column by column; a batch holding anything else
+        than what save_reviews_to_ndjson writes goes through ReviewData validation instead, so the result is
+        the same as with review.iter_reviews_from_ndjson.
+
+        :raises pydantic.ValidationError: On a row that is not a valid review.
+        """
+        batch = cls()
+        with _open_reviews_file(filename, 'rb') as f:
+            lines = (line for line in _iter_lines(f) if line.strip())
+            while chunk := list(islice(lines, batch_size)):
+                data = b'[' + b','.join(chunk) + b']'
+                if not batch._extend_json_rows(orjson.loads(data) if orjson is not None else json.loads(data)):
+                    batch.extend(_review_list_adapter().validate_json(data))
+        return batch
+
+    def _extend_json_rows(self, rows) -> bool:
+        """
+        Append decoded JSON rows if they hold exactly the columns of a review with the types written by
+        save_reviews_to_ndjson (_JSON_TYPES, ISO dates). Otherwise append nothing and return False.
+        """
+        if not rows:
+            return True
+        if set(map(type, rows)) != {dict} or set(map(len, rows)) != {len(COLUMNS)}:
+            return False
+        try:
+            columns = {name: [row[name] for row in rows] for name in COLUMNS}
+        except KeyError:
+            return False
+        for name, expected in _JSON_TYPES.items():
+            if not set(map(type, columns[name])) <= {expected, type(None)}:
+                return False
+        if None in columns["review_id"] or None in columns["scraped_on"]:
+            return False
+        ordinals = {None: None}
+        try:
+            for name in DATE_COLUMNS:
+                for value in set(columns[name]) - ordinals.keys():
+                    if len(value) != 10:
+                        return False
+                    ordinals[value] = date.fromisoformat(value).toordinal() - _EPOCH_ORDINAL
+        except ValueError:
+            return False
+
+        for name in DICTIONARY_COLUMNS:
+            codes, dictionary = self._codes[name], self._dictionaries[name]
+            for value in set(columns[name]) - codes.keys() - {None}:
+                codes[value] = len(dictionary)
+                dictionary.append(sys.intern(value))
+            self._data[name].extend([codes[value] if value is not None else 0 for value in columns[name]])
+        for name in DATE_COLUMNS:
+            self._data[name].extend([ordinals[value] if value is not None else 0 for value in columns[name]])
+        for name in BOOL_COLUMNS + INT_COLUMNS:
+            self._data[name].extend([int(value) if value is not None else 0 for value in columns[name]])
+        for name in _TYPECODES:
+            self._valid[name].extend([value is not None for value in columns[name]])
+        for name in STRING_COLUMNS:
+            self._strings[name].extend(columns[name])
+        self._length += len(rows)
+        return True
+
+    def append_review(self, review: ReviewData):
+        self.append(**{name: getattr(review, name) for name in COLUMNS})
+
+    def extend(self, reviews):
+        for review in reviews:
+            if isinstance(review, ReviewData):
+                self.append_review(review)
+            else:
+                self.append(**review)
+
+    def column(self, name):
+        """
+        The decoded values of a column, as a python list with None for nulls.
+        """
+        if name in STRING_COLUMNS:
+            return list(self._strings[name])
+        data, valid = self._data[name], self._valid[name]
+        if name in DICTIONARY_COLUMNS:
+            values = self._dictionaries[name]
+            return [values[code] if ok else None for code, ok in zip(data, valid)]
+        if name in DATE_COLUMNS:
+            return [date.fromordinal(days + _EPOCH_ORDINAL) if ok else None for days, ok in zip(data, valid)]
+        if name in BOOL_COLUMNS:
+            return [bool(value) if ok else None for value, ok in zip(data, valid)]
+        return [value if ok else None for value, ok in zip(data, valid)]
+
+    def iter_dicts(self):
+        """
+        Yield every row as a dict of ReviewData values.
+        """
+        columns = [self.column(name) for name in COLUMNS]
+        for values in zip(*columns):
+            yield dict(zip(COLUMNS, values))
+
+    def __iter__(self):
+        return self.to_reviews()
+
+    def to_reviews(self):
+        """
+        Yield ReviewData models. The values were validated when parsed, so models are built without validation.
+        """
+        for row in self.iter_dicts():
+            yield ReviewData.model_construct(**row)
+
+    def take(self, indices):
+        """
+        A new batch holding the given rows, in the given order.
+        """
+        batch = ReviewBatch()
+        for name, data in self._data.items():
+            valid = self._valid[name]
+            batch._data[name] = array(data.typecode, (data[i] for i in indices))
+            batch._valid[name] = bytearray(valid[i] for i in indices)
+        for name, values in self._strings.items():
+            batch._strings[name] = [values[i] for i in indices]
+        # Dictionaries are shared as they are; unused values are harmless
+        for name in DICTIONARY_COLUMNS:
+            batch._dictionaries[name] = list(self._dictionaries[name])
+            batch._codes[name] = dict(self._codes[name])
+        batch._length = len(batch._strings["review_id"])
+        return batch
+
+    def slices(self, size):
+        """
+        Yield consecutive sub-batches of at most `size` rows.
+        """
+        for start in range(0, self._length, size):
+            yield self.take(range(start, min(start + size, self._length)))
+
+    def dedupe(self):
+        """
+        Keep a single row per review_id: the most recently scraped one (the last one seen on ties),
+        in first-seen order, like review.dedupe_reviews.
+        """
+        scraped_on, valid = self._data["scraped_on"], self._valid["scraped_on"]
+        kept = {}
+        for index, review_id in enumerate(self._strings["review_id"]):
+            previous = kept.get(review_id)
+            if previous is None or (scraped_on[index] if valid[index] else -1 << 31) >= \
+                    (scraped_on[previous] if valid[previous] else -1 << 31):
+                kept[review_id] = index
+        if len(kept) == self._length:
+            return self
+        # kept is ordered by first sighting, since replacing a value keeps its key's position
+        return self.take(list(kept.values()))
+
+    def rekey(self, scheme: str = None):
+        """
+        Recompute every review_id with the given scheme (see review.REVIEW_ID_SCHEMES and review.generate_review_ids).
+        """
+        self._strings["review_id"] = generate_review_ids(
+            self._strings["author"], self._strings["title"], self.column("review_date"), scheme
+        )
+
+    def _arrow_validity(self, name):
+        valid = self._valid[name]
+        if all(valid):
+            return None
+        mask = pyarrow.Array.from_buffers(pyarrow.uint8(), self._length, [None, pyarrow.py_buffer(valid)])
+        return mask.cast(pyarrow.bool_()).buffers()[1]
+
+    def to_arrow(self):
+        """
+        Export to a pyarrow Table. Typed arrays are handed to Arrow without copying their values;
+        dictionary columns become Arrow dictionary arrays.
+        """
+        if pyarrow is None:
+            raise ImportError("Arrow export requires the pyarrow package: pip install pyarrow")
+        arrow_types = {"review_date": pyarrow.date32(), "scraped_on": pyarrow.date32(), "rating": pyarrow.int64()}
+        columns = {}
+        for name in COLUMNS:
+            if name in STRING_COLUMNS:
+                columns[name] = pyarrow.array(self._strings[name], type=pyarrow.string())
+            elif name in BOOL_COLUMNS:
+                # Arrow booleans are bit-packed, so these need a conversion
+                columns[name] = pyarrow.array(self.column(name), type=pyarrow.bool_())
+            elif name in DICTIONARY_COLUMNS:
+                indices = pyarrow.Array.from_buffers(
+                    pyarrow.int32(), self._length, [self._arrow_validity(name), pyarrow.py_buffer(self._data[name])]
+                )
+                columns[name] = pyarrow.DictionaryArray.from_arrays(
+                    indices, pyarrow.array(self._dictionaries[name], type=pyarrow.string())
+                )
+            else:
+                columns[name] = pyarrow.Array.from_buffers(
+                    arrow_types[name], self._length, [self._arrow_validity(name), pyarrow.py_buffer(self._data[name])]
+                )
+        return pyarrow.table(columns)
+
+    def to_parquet(self, filename):
+        # to_arrow() first: it raises the ImportError when pyarrow is missing
+        table = self.to_arrow()
+        pyarrow.parquet.write_table(table, filename)
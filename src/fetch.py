@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 1.0
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+def build_session(max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> requests.Session:
+    """
+    Create a keep-alive HTTP session whose connection pool can serve `max_concurrency` requests at once.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_concurrency, pool_maxsize=max_concurrency)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def sync_session_with_driver(session: requests.Session, driver) -> requests.Session:
+    """
+    Copy the cookies and user agent of the logged-in Selenium session into the HTTP session.
+    Call it again after every marketplace switch, since the selection is stored in cookies.
+    """
+    session.headers["User-Agent"] = driver.execute_script("return navigator.userAgent;")
+    session.cookies.clear()
+    for cookie in driver.get_cookies():
+        session.cookies.set(
+            cookie["name"], cookie["value"],
+            domain=cookie.get("domain"), path=cookie.get("path", "/"), secure=cookie.get("secure", False),
+        )
+    return session
+
+
+def session_from_driver(driver, max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> requests.Session:
+    """
+    Export the logged-in Selenium session into a pooled HTTP session.
+    """
+    return sync_session_with_driver(build_session(max_concurrency), driver)
+
+
+def fetch_page(session: requests.Session, url: str, timeout: float = DEFAULT_TIMEOUT,
+               retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF) -> str:
+    """
+    GET a page, retrying connection errors and RETRY_STATUS_CODES with exponential backoff and jitter.
+
+    :return: The page source.
+    """
+    for attempt in range(retries + 1):
+        try:
+            response = session.get(url, timeout=timeout)
+            if response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status()
+                return response.text
+            error = f"HTTP {response.status_code}"
+            retry_after = response.headers.get("Retry-After")
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = str(e)
+            retry_after = None
+        if attempt == retries:
+            break
+        delay = float(retry_after) if retry_after and retry_after.isdigit() else backoff * 2 ** attempt
+        delay *= random.uniform(0.5, 1.5)
+        logging.warning(f"Fetching {url} failed ({error}). Retrying in {delay:.1f}s...")
+        time.sleep(delay)
+    raise requests.RequestException(f"Could not fetch {url} after {retries + 1} attempts: {error}")
+
+
+def fetch_pages(session: requests.Session, urls, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, **fetch_kwargs):
+    """
+    Fetch the given urls concurrently, at most `max_concurrency` at a time.
+
+    :return: A generator of (url, page source or the exception raised), in the order of `urls`.
+    """
+    def fetch(url):
+        try:
+            return url, fetch_page(session, url, **fetch_kwargs)
+        except Exception as e:
+            return url, e
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        yield from executor.map(fetch, urls)
@@ -0,0 +1,326 @@
+from dataclasses import dataclass, field
+from hashlib import blake2b
+from operator import eq
+from zlib import crc32
+import logging
+import time
+from columnar import ReviewBatch
+from review import CONTENT_COLUMNS
+
+# MinHash signatures have NUM_BINS values, cut into NUM_BANDS bands for the LSH index. Two bodies with a Jaccard
+# similarity s share at least one band with probability 1 - (1 - s^4)^16: 99.98% at s=0.8, 12% at s=0.3.
+NUM_BINS = 64
+NUM_BANDS = 16
+ROWS_PER_BAND = NUM_BINS // NUM_BANDS
+SHINGLE_SIZE = 3
+DEFAULT_THRESHOLD = 0.8
+# Shorter bodies ("Great product!") are only compared exactly: near-duplicates of them mean nothing
+MIN_TOKENS = 8
+# Columns needed to fingerprint reviews: the content hash covers the same columns as the MERGE's change test
+FINGERPRINT_COLUMNS = ("review_id",) + CONTENT_COLUMNS
+
+_BIN_MASK = NUM_BINS - 1
+_BINS = range(NUM_BINS)
+_BAND_STARTS = range(0, NUM_BINS, ROWS_PER_BAND)
+_EMPTY_BAND = (None,) * ROWS_PER_BAND
+
+
+def _normalize(text) -> bytes:
+    """
+    Case-folded UTF-8 words of the text, so that case and whitespace edits are not seen as changes.
+    """
+    return b" ".join((text or "").casefold().encode('utf-8').split())
+
+
+def _tokens(body) -> list:
+    return (body or "").casefold().encode('utf-8').split()
+
+
+def _encode(value) -> bytes:
+    return b"\x00" if value is None else str(value).encode('utf-8')
+
+
+def _content_hashes(columns: dict, bodies: list):
+    """
+    The content hash of every row of the columns, the bodies being given as their tokens.
+    """
+    encoded = [
+        map(b" ".join, bodies) if name == "body" else map(_normalize if name == "title" else _encode, columns[name])
+        for name in CONTENT_COLUMNS
+    ]
+    return (blake2b(b"\x1f".join(fields), digest_size=16).hexdigest() for fields in zip(*encoded))
+
+
+def content_hash(review) -> str:
+    """
+    128-bit BLAKE2b of the review.CONTENT_COLUMNS of a review (ReviewData or dict), title and body normalized:
+    equal for reviews whose content did not change.
+    """
+    columns = _columns([review])
+    return next(_content_hashes(columns, [_tokens(columns["body"][0])]))
+
+
+def shingle_hashes(tokens: list) -> set:
+    """
+    CRC-32 of every run of SHINGLE_SIZE consecutive words.
+    """
+    if len(tokens) < SHINGLE_SIZE:
+        return {crc32(b" ".join(tokens))} if tokens else set()
+    return set(map(crc32, map(b" ".join, zip(*(tokens[offset:] for offset in range(SHINGLE_SIZE))))))
+
+
+def minhash(hashes) -> tuple:
+    """
+    One-permutation MinHash: the hashes are spread over NUM_BINS bins by their low bits, and each bin keeps its
+    smallest hash, or None when no hash fell in it. A single sort replaces NUM_BINS hash functions.
+    """
+    smallest = {}
+    # Later hashes overwrite earlier ones, so every bin ends up with its smallest hash
+    for value in sorted(hashes, reverse=True):
+        smallest[value & _BIN_MASK] = value
+    return tuple(map(smallest.get, _BINS))
+
+
+def similarity(signature, other) -> float:
+    """
+    Estimated Jaccard similarity of the shingles of two bodies: the fraction of equal bins, ignoring bins
+    empty in both.
+    """
+    both_empty = sum(1 for value, other_value in zip(signature, other) if value is None and other_value is None)
+    if both_empty == NUM_BINS:
+        return 1.0
+    return (sum(map(eq, signature, other)) - both_empty) / (NUM_BINS - both_empty)
+
+
+@dataclass
+class Fingerprint:
+    review_id: str
+    country: str
+    asin: str
+    author: str
+    content_hash: str
+    signature: tuple = field(repr=False)
+    # Whether the body is long enough for near-duplicate matching, see MIN_TOKENS
+    comparable: bool = True
+
+
+def _columns(reviews) -> dict:
+    """
+    The FINGERPRINT_COLUMNS of the reviews: a ReviewBatch, a dict of column lists, or ReviewData or dicts.
+    """
+    if isinstance(reviews, ReviewBatch):
+        return {name: reviews.column(name) for name in FINGERPRINT_COLUMNS}
+    if isinstance(reviews, dict):
+        return reviews
+    columns = {name: [] for name in FINGERPRINT_COLUMNS}
+    for review in reviews:
+        for name in FINGERPRINT_COLUMNS:
+            columns[name].append(review.get(name) if isinstance(review, dict) else getattr(review, name))
+    return columns
+
+
+def fingerprint_reviews(reviews) -> list[Fingerprint]:
+    """
+    Fingerprint a batch of reviews, column by column.
+
+    :param reviews: A ReviewBatch, a dict of column lists (see FINGERPRINT_COLUMNS), or ReviewData or dicts.
+    """
+    start = time.perf_counter()
+    columns = _columns(reviews)
+    bodies = list(map(_tokens, columns["body"]))
+    hashes = _content_hashes(columns, bodies)
+    signatures = map(minhash, map(shingle_hashes, bodies))
+    fingerprints = [
+        Fingerprint(review_id, country, asin, author, digest, signature, len(tokens) >= MIN_TOKENS)
+        for review_id, country, asin, author, digest, signature, tokens in zip(
+            columns["review_id"], columns["country"], columns["asin"], columns["author"], hashes, signatures, bodies
+        )
+    ]
+    logging.info(f"Fingerprinted {len(fingerprints)} reviews in {time.perf_counter() - start:.2f}s")
+    return fingerprints
+
+
+def _fingerprints(reviews) -> list[Fingerprint]:
+    """
+    The reviews if they are already a list of Fingerprint, otherwise their fingerprints.
+    """
+    if isinstance(reviews, list) and reviews and isinstance(reviews[0], Fingerprint):
+        return reviews
+    return fingerprint_reviews(reviews)
+
+
+class LSHIndex:
+    """
+    Banded locality-sensitive hashing of MinHash signatures: items sharing all the bins of at least one band
+    are candidates, found without comparing every pair. Bands with no value at all are not indexed.
+    """
+
+    def __init__(self):
+        self._bands = [{} for _ in _BAND_STARTS]
+
+    def _bands_of(self, signature):
+        for buckets, start in zip(self._bands, _BAND_STARTS):
+            band = signature[start:start + ROWS_PER_BAND]
+            if band != _EMPTY_BAND:
+                yield buckets, band
+
+    def add(self, key, signature: tuple):
+        for buckets, band in self._bands_of(signature):
+            buckets.setdefault(band, []).append(key)
+
+    def candidates(self, signature: tuple) -> set:
+        found = set()
+        for buckets, band in self._bands_of(signature):
+            found.update(buckets.get(band, ()))
+        return found
+
+    def buckets(self):
+        """
+        Yield every bucket holding more than one key.
+        """
+        for buckets in self._bands:
+            for keys in buckets.values():
+                if len(keys) > 1:
+                    yield keys
+
+
+def find_duplicate_groups(fingerprints: list[Fingerprint], threshold: float = DEFAULT_THRESHOLD) -> list[list]:
+    """
+    Group reviews whose bodies are identical or near-duplicates (estimated similarity >= threshold).
+    Members of an LSH bucket are checked against its first member only, so the work stays linear in the
+    number of reviews; the groups are the connected components of the matches.
+
+    :return: Lists of at least two Fingerprint.
+    """
+    parents = list(range(len(fingerprints)))
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    index = LSHIndex()
+    for position, fingerprint in enumerate(fingerprints):
+        if fingerprint.comparable:
+            index.add(position, fingerprint.signature)
+    for bucket in index.buckets():
+        anchor = fingerprints[bucket[0]]
+        for position in bucket[1:]:
+            other = fingerprints[position]
+            if other.content_hash == anchor.content_hash or \
+                    similarity(anchor.signature, other.signature) >= threshold:
+                parents[find(position)] = find(bucket[0])
+    groups = {}
+    for position, fingerprint in enumerate(fingerprints):
+        groups.setdefault(find(position), []).append(fingerprint)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def find_cross_marketplace_duplicates(reviews, threshold: float = DEFAULT_THRESHOLD) -> list[list]:
+    """
+    Groups of near-duplicate reviews found in more than one marketplace, e.g. a review Amazon shows in several
+    European stores.
+
+    :param reviews: Anything fingerprint_reviews accepts, or a list of Fingerprint.
+    """
+    return [group for group in find_duplicate_groups(_fingerprints(reviews), threshold)
+            if len({fingerprint.country for fingerprint in group}) > 1]
+
+
+@dataclass
+class ChangeReport:
+    """
+    How a batch of reviews compares with the reviews seen before.
+
+    edited maps the review_id of a review whose title was edited (a new review_id, since the title is part of it)
+    to the review_id of its previous version.
+    """
+    new: list = field(default_factory=list)
+    changed: list = field(default_factory=list)
+    edited: dict = field(default_factory=dict)
+    unchanged: list = field(default_factory=list)
+
+    @property
+    def to_update(self) -> set:
+        """
+        The review_ids worth loading: new, changed and edited reviews.
+        """
+        return set(self.new) | set(self.changed) | set(self.edited)
+
+    def summary(self) -> str:
+        return (f"{len(self.new)} new, {len(self.changed)} changed, {len(self.edited)} edited, "
+                f"{len(self.unchanged)} unchanged reviews")
+
+
+class FingerprintIndex:
+    """
+    Fingerprints of the reviews seen so far (e.g. the local warehouse), to tell apart the reviews of a new batch
+    that are new, changed, edited or unchanged.
+    """
+
+    def __init__(self):
+        self.fingerprints = {}
+        self.lsh = LSHIndex()
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    @classmethod
+    def from_reviews(cls, reviews):
+        index = cls()
+        index.add(fingerprint_reviews(reviews))
+        return index
+
+    def add(self, fingerprints: list[Fingerprint]):
+        for fingerprint in fingerprints:
+            self.fingerprints[fingerprint.review_id] = fingerprint
+            if fingerprint.comparable:
+                self.lsh.add(fingerprint.review_id, fingerprint.signature)
+
+    def find_previous_version(self, fingerprint: Fingerprint, threshold: float = DEFAULT_THRESHOLD):
+        """
+        The review_id of the most similar known review by the same author, on the same product and marketplace,
+        or None.
+        """
+        best, best_similarity = None, threshold
+        for review_id in self.lsh.candidates(fingerprint.signature):
+            known = self.fingerprints[review_id]
+            if (known.author, known.asin, known.country) != (fingerprint.author, fingerprint.asin, fingerprint.country):
+                continue
+            score = similarity(known.signature, fingerprint.signature)
+            if score >= best_similarity:
+                best, best_similarity = review_id, score
+        return best
+
+    def classify(self, reviews, threshold: float = DEFAULT_THRESHOLD) -> ChangeReport:
+        """
+        Compare a batch with the known reviews: a known review_id is changed when its content hash differs,
+        and an unknown review_id is edited when the LSH index finds a previous version of it.
+
+        :param reviews: Anything fingerprint_reviews accepts, or a list of Fingerprint.
+        """
+        report = ChangeReport()
+        for fingerprint in _fingerprints(reviews):
+            known = self.fingerprints.get(fingerprint.review_id)
+            if known is not None:
+                (report.unchanged if known.content_hash == fingerprint.content_hash else report.changed).append(
+                    fingerprint.review_id
+                )
+                continue
+            previous = self.find_previous_version(fingerprint, threshold) if fingerprint.comparable else None
+            if previous is not None:
+                report.edited[fingerprint.review_id] = previous
+            else:
+                report.new.append(fingerprint.review_id)
+        return report
+
+
+def select_reviews(reviews, review_ids: set):
+    """
+    The reviews of a ReviewBatch or list whose review_id is in review_ids, keeping the input type.
+    """
+    if isinstance(reviews, ReviewBatch):
+        return reviews.take([index for index, review_id in enumerate(reviews.column("review_id"))
+                             if review_id in review_ids])
+    return [review for review in reviews if review.review_id in review_ids]
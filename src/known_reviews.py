@@ -0,0 +1,54 @@
+import logging
+import os
+from review import ReviewData
+
+DEFAULT_INDEX_FILE = "known_reviews.txt"
+
+
+class KnownReviewIndex:
+    """
+    Local index of the review_ids already loaded to GBQ, stored as one id per line in an append-only file.
+
+    Seller Central lists reviews newest first, so once a whole page only holds known reviews,
+    every later page is known too and pagination can stop.
+    """
+
+    def __init__(self, filename: str = DEFAULT_INDEX_FILE):
+        self.filename = filename
+        self._ids = set()
+        self._pending = []
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                self._ids.update(line.strip() for line in f if line.strip())
+        logging.info(f"Loaded {len(self._ids)} known review ids from {filename}")
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, review_id: str):
+        return review_id in self._ids
+
+    def is_known(self, review: ReviewData) -> bool:
+        return review.review_id in self._ids
+
+    def filter_new(self, reviews: list[ReviewData]) -> list[ReviewData]:
+        return [review for review in reviews if review.review_id not in self._ids]
+
+    def add(self, reviews: list[ReviewData]):
+        """
+        Mark reviews as known. They are only persisted by save(), which should be called once they are loaded.
+        """
+        for review in reviews:
+            if review.review_id not in self._ids:
+                self._ids.add(review.review_id)
+                self._pending.append(review.review_id)
+
+    def save(self):
+        if not self._pending:
+            return
+        with open(self.filename, 'a', encoding='utf-8') as f:
+            f.write(''.join(f"{review_id}\n" for review_id in self._pending))
+            f.flush()
+            os.fsync(f.fileno())
+        logging.info(f"Saved {len(self._pending)} new review ids to {self.filename}")
+        self._pending = []
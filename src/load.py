@@ -1,41 +1,200 @@
 from google.cloud import bigquery
 from google.oauth2 import service_account
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
 import os
+import json
 import logging
-from review import load_reviews_from_json
+import random
+import shutil
+import tempfile
+import time
+from review import (iter_saved_reviews, dedupe_reviews, DEFAULT_STORE_FILE, LEGACY_STORE_FILE, SCHEMA_FILE,
+                    CONTENT_COLUMNS, _json_default)
+from columnar import ReviewBatch
+from telemetry import span
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+DEFAULT_CHUNK_SIZE = 10000
+DEFAULT_CHUNK_RETRIES = 3
+DEFAULT_POOL_SIZE = 10
+# Where a chunk that still fails after its retries is kept, when chunks are written to a temporary directory
+FAILED_CHUNKS_DIR = "failed_chunks"
+
+STAGING_TABLE_ID = 'testing-dashboard20211125.reviews.staging_reviews'
+REVIEWS_TABLE_ID = 'testing-dashboard20211125.reviews.reviews'
+
+# "incremental": client-side dedup and a MERGE pruned to the batch's dates, skipping unchanged rows.
+# "full": the original MERGE of the whole staging table against the whole reviews table.
+MERGE_MODE = os.getenv("REVIEW_MERGE_MODE", "incremental")
+
+@lru_cache(maxsize=None)
+def _credentials_from_file(sa_file):
+    return service_account.Credentials.from_service_account_file(sa_file)
 
 def get_gbq_credentials():
+    """
+    Service account credentials, read from disk only once per file.
+    """
     env_var = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
     sa_file = env_var if env_var else  "./gbq-serviceaccount-credentials.json"
     if not os.path.exists(sa_file):
         logging.warning(f"Service acount credentials for gbq not found at path {sa_file}")
         if not os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
             raise EnvironmentError("GOOGLE_APPLICATION_CREDENTIALS environment variable is not set.")
-    return service_account.Credentials.from_service_account_file(sa_file)
+    return _credentials_from_file(sa_file)
 
-def upload_to_staging_table(reviews_data):
-    client = bigquery.Client(credentials=get_gbq_credentials())
-    table_id = 'testing-dashboard20211125.reviews.staging_reviews'
-    rows_to_insert = [review.model_dump() for review in reviews_data]
+def upload_to_staging_table(reviews_data, append=False):
+    """
+    Load the reviews into the staging table, replacing its contents unless append=True.
+    """
+    get_loader_session().upload_json(reviews_data, append)
 
-    job = client.load_table_from_json(
-        rows_to_insert,
-        table_id,
-        job_config=bigquery.LoadJobConfig(
-            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
-        )
-    )
-    try:
-        job.result()
-        logging.info(f"Loaded {len(rows_to_insert)} rows into {table_id}.")
-    except Exception as e:
-        logging.error(f"Error loading data to BigQuery: {e}")
+def load_schema(schema_file=SCHEMA_FILE):
+    """
+    The staging table columns: review_id, followed by the ReviewData columns listed in resources/schema.json.
+    """
+    with open(schema_file, 'r', encoding='utf-8') as f:
+        fields = json.load(f)
+    return [{"name": "review_id", "type": "STRING", "mode": "NULLABLE"}] + fields
 
-def execute_merge():
-    client = bigquery.Client(credentials=get_gbq_credentials())
+def _arrow_schema(schema):
+    types = {
+        "STRING": pyarrow.string(),
+        "DATE": pyarrow.date32(),
+        "BOOLEAN": pyarrow.bool_(),
+        "INTEGER": pyarrow.int64(),
+    }
+    return pyarrow.schema([(field["name"], types[field["type"]]) for field in schema])
+
+def write_chunk(reviews, filename, file_format="ndjson", schema=None):
+    """
+    Write a chunk of reviews (ReviewData or a ReviewBatch) to a load file: newline-delimited JSON,
+    or Parquet (requires pyarrow).
+    """
+    if isinstance(reviews, ReviewBatch):
+        if file_format == "parquet":
+            reviews.to_parquet(filename)
+            return
+        rows = reviews.iter_dicts()
+    else:
+        rows = None
+    if file_format == "parquet":
+        if pyarrow is None:
+            raise ImportError("Parquet chunks require the pyarrow package: pip install pyarrow")
+        arrow_schema = _arrow_schema(schema or load_schema())
+        columns = {
+            name: pyarrow.array([getattr(review, name) for review in reviews], type=arrow_schema.field(name).type)
+            for name in arrow_schema.names
+        }
+        pyarrow.parquet.write_table(pyarrow.table(columns, schema=arrow_schema), filename)
+    elif file_format == "ndjson":
+        if rows is None:
+            rows = (review.model_dump() for review in reviews)
+        with open(filename, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False, default=_json_default))
+                f.write('\n')
+    else:
+        raise ValueError(f"Unknown chunk format '{file_format}'. Choose 'ndjson' or 'parquet'.")
+
+def load_file_to_table(client, filename, table_id, job_config, retries=DEFAULT_CHUNK_RETRIES):
+    """
+    Run a resumable load job from a local file, retrying the whole job with exponential backoff if it fails.
+
+    :return: The completed LoadJob.
+    """
+    for attempt in range(retries + 1):
+        try:
+            with open(filename, 'rb') as f:
+                job = client.load_table_from_file(f, table_id, job_config=job_config, rewind=True)
+            job.result()
+            return job
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = 2 ** attempt * random.uniform(0.5, 1.5)
+            logging.warning(f"Loading {filename} into {table_id} failed: {e}. Retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+def upload_chunks_to_staging_table(reviews_data, chunk_size=DEFAULT_CHUNK_SIZE, file_format="ndjson", append=False,
+                                   retries=DEFAULT_CHUNK_RETRIES, client=None, work_dir=None):
+    """
+    Stream the reviews into the staging table in fixed-size chunks, each one written to a load file
+    and loaded with its own resumable job. Only one chunk is held in memory at a time, and a failed
+    chunk is retried on its own instead of restarting the whole load.
 
-    merge_query = """
-    MERGE `testing-dashboard20211125.reviews.reviews` AS T
+    :param reviews_data: A ReviewBatch, or any iterable of ReviewData, e.g. a generator.
+    :param file_format: 'ndjson' or 'parquet'.
+    :param append: Append to the staging table instead of replacing its contents with the first chunk.
+                   Without any chunk to load, the staging table is then truncated.
+    :param client: A bigquery.Client. Defaults to the client of the shared LoaderSession.
+    :param work_dir: Where chunk files are written. A chunk that still fails after its retries is kept there,
+                     or moved to FAILED_CHUNKS_DIR when work_dir is not given (chunks go to a temporary directory).
+    :return: The number of rows loaded.
+    """
+    client = client or get_loader_session().client
+    schema = load_schema()
+    source_format = {
+        "ndjson": bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        "parquet": bigquery.SourceFormat.PARQUET,
+    }[file_format]
+    extension = "json" if file_format == "ndjson" else file_format
+    temp_dir = None
+    if work_dir is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix="staging_chunks_")
+        work_dir = temp_dir.name
+    os.makedirs(work_dir, exist_ok=True)
+
+    total_rows = 0
+    num_chunks = 0
+    if isinstance(reviews_data, ReviewBatch):
+        chunks = reviews_data.slices(chunk_size)
+    else:
+        reviews_iter = iter(reviews_data)
+        chunks = iter(lambda: list(islice(reviews_iter, chunk_size)), [])
+    try:
+        for chunk_num, chunk in enumerate(chunks):
+            filename = os.path.join(work_dir, f"chunk-{chunk_num:05d}.{extension}")
+            write_chunk(chunk, filename, file_format, schema)
+            job_config = bigquery.LoadJobConfig(
+                source_format=source_format,
+                write_disposition=bigquery.WriteDisposition.WRITE_APPEND if append or chunk_num
+                else bigquery.WriteDisposition.WRITE_TRUNCATE
+            )
+            start = time.perf_counter()
+            try:
+                load_file_to_table(client, filename, STAGING_TABLE_ID, job_config, retries)
+            except Exception:
+                if temp_dir is not None:
+                    os.makedirs(FAILED_CHUNKS_DIR, exist_ok=True)
+                    filename = shutil.move(filename, os.path.join(FAILED_CHUNKS_DIR, os.path.basename(filename)))
+                logging.error(f"Chunk {chunk_num} could not be loaded into {STAGING_TABLE_ID}, kept in {filename}.")
+                raise
+            os.remove(filename)
+            total_rows += len(chunk)
+            num_chunks += 1
+            logging.info(f"Loaded chunk {chunk_num} ({len(chunk)} rows) into {STAGING_TABLE_ID} in {time.perf_counter() - start:.1f}s.")
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+    if not append and not num_chunks:
+        # No WRITE_TRUNCATE chunk was loaded: empty the table so that the rows of a previous load are not merged
+        client.query(f"TRUNCATE TABLE `{STAGING_TABLE_ID}`").result()
+        logging.info(f"Nothing to load, truncated {STAGING_TABLE_ID}.")
+    logging.info(f"Loaded {total_rows} rows into {STAGING_TABLE_ID}.")
+    return total_rows
+
+MERGE_QUERY = f"""
+    MERGE `{REVIEWS_TABLE_ID}` AS T
     USING (
     WITH Deduped_S AS ( -- Deduplication subquery for staging table
         SELECT
@@ -44,7 +203,7 @@ def execute_merge():
             PARTITION BY review_id
             ORDER BY scraped_on DESC  -- or another column to determine the most relevant row
         ) AS rn
-        FROM `testing-dashboard20211125.reviews.staging_reviews`
+        FROM `{STAGING_TABLE_ID}`
     )
     SELECT
         review_id, country, asin, brand, review_date, author, verified,
@@ -74,18 +233,312 @@ def execute_merge():
         S.review_id, S.country, S.asin, S.brand, S.review_date, S.author, CAST(S.verified AS BOOL),
         CAST(S.helpful AS BOOL), S.title, S.body, S.rating, S.url, S.scraped_on
       );
+"""
+
+def _content_fingerprint(alias):
+    columns = ", ".join(f"{alias}.{column} AS {column}" for column in CONTENT_COLUMNS)
+    return f"FARM_FINGERPRINT(TO_JSON_STRING(STRUCT({columns})))"
+
+def build_incremental_merge_query(prune_dates=True, include_null_dates=False, prune_countries=False):
     """
+    MERGE of the staging table, with the target scan restricted to the batch's range.
 
-    try:
-        query_job = client.query(merge_query)
-        query_job.result()
-        logging.info("Merge operation completed successfully.")
-    except Exception as e:
-        logging.error(f"Error executing merge query: {e}")
+    The reviews are deduplicated on the client before they are staged, but the source is deduplicated again:
+    an append load job retried after an error may have committed, staging its rows twice, and a MERGE fails
+    when several source rows match the same target row.
+
+    review_date is part of the review_id hash, so a matching target row always has the same review_date,
+    and restricting the target to the batch's review_date range (partition pruning) never misses a match.
+    country is not part of review_id: pruning on it (cluster pruning) assumes a review never moves between
+    marketplaces, so it is opt-in.
+    Matched rows are only updated when their content fingerprint changed.
+
+    Query parameters: @min_date, @max_date (DATE) and @countries (ARRAY<STRING>).
+    """
+    target_filters = []
+    if prune_dates:
+        date_filter = "T.review_date BETWEEN @min_date AND @max_date"
+        if include_null_dates:
+            date_filter = f"({date_filter} OR T.review_date IS NULL)"
+        target_filters.append(date_filter)
+    if prune_countries:
+        target_filters.append("T.country IN UNNEST(@countries)")
+    on_condition = " AND ".join(["T.review_id = S.review_id"] + target_filters)
+    return f"""
+    MERGE `{REVIEWS_TABLE_ID}` AS T
+    USING (
+    WITH Deduped_S AS (
+        SELECT
+        *,
+        ROW_NUMBER() OVER (PARTITION BY review_id ORDER BY scraped_on DESC) AS rn
+        FROM `{STAGING_TABLE_ID}`
+    )
+    SELECT
+        review_id, country, asin, brand, review_date, author, verified,
+        helpful, title, body, rating, url, scraped_on
+    FROM Deduped_S
+    WHERE rn = 1
+    ) AS S
+    ON {on_condition}
+    WHEN MATCHED AND {_content_fingerprint("T")} != {_content_fingerprint("S")} THEN
+      UPDATE SET
+        T.country = S.country,
+        T.asin = S.asin,
+        T.brand = S.brand,
+        T.review_date = S.review_date,
+        T.author = S.author,
+        T.title = S.title,
+        T.body = S.body,
+        T.rating = S.rating,
+        T.url = S.url,
+        T.scraped_on = S.scraped_on
+    WHEN NOT MATCHED THEN
+      INSERT (
+        review_id, country, asin, brand, review_date, author, verified,
+        helpful, title, body, rating, url, scraped_on
+      )
+      VALUES (
+        S.review_id, S.country, S.asin, S.brand, S.review_date, S.author, CAST(S.verified AS BOOL),
+        CAST(S.helpful AS BOOL), S.title, S.body, S.rating, S.url, S.scraped_on
+      );
+    """
+
+class LoaderSession:
+    """
+    Owns one authenticated BigQuery client for the whole load phase. Its HTTP transport keeps a pool of
+    connections alive, and the OAuth token is refreshed only when it expires, so that the upload, merge
+    and verification steps do not each pay for a new client and handshake.
+    Every step is timed, see timing_summary(), and the cost of the last merge is kept, see merge_summary().
+    """
+
+    def __init__(self, credentials=None, pool_size=DEFAULT_POOL_SIZE, client=None):
+        self.timings = []
+        self.merge_stats = None
+        if client is None:
+            credentials = credentials or get_gbq_credentials()
+            http = AuthorizedSession(credentials)
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            http.mount("https://", adapter)
+            client = bigquery.Client(credentials=credentials, _http=http)
+        self.client = client
+
+    @contextmanager
+    def timed(self, step):
+        start = time.perf_counter()
+        try:
+            with span("load", step=step):
+                yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.timings.append((step, seconds))
+            logging.info(f"{step} took {seconds:.2f}s")
+
+    def timing_summary(self):
+        total = sum(seconds for _, seconds in self.timings)
+        return ", ".join(f"{step}: {seconds:.2f}s" for step, seconds in self.timings) + f" (total {total:.2f}s)"
+
+    def merge_summary(self):
+        """
+        The rows and bytes processed and billed by the last merge, for printing.
+        """
+        if self.merge_stats is None:
+            return "no merge run"
+        stats = self.merge_stats
+        rows = f"{stats['rows']} rows ({stats['duplicates_dropped']} duplicates dropped), " if "rows" in stats else ""
+        return (f"{rows}{stats['bytes_processed'] / 1024 ** 2:.1f} MiB processed, "
+                f"{stats['bytes_billed'] / 1024 ** 2:.1f} MiB billed")
+
+    def upload(self, reviews_data, **kwargs):
+        """
+        Chunked file upload to the staging table, see upload_chunks_to_staging_table.
+        """
+        with self.timed("upload"):
+            return upload_chunks_to_staging_table(reviews_data, client=self.client, **kwargs)
+
+    def upload_json(self, reviews_data, append=False):
+        """
+        Single in-memory JSON load job to the staging table, replacing its contents unless append=True.
+        """
+        with self.timed("upload_json"):
+            rows_to_insert = [review.model_dump() for review in reviews_data]
+            job = self.client.load_table_from_json(
+                rows_to_insert,
+                STAGING_TABLE_ID,
+                job_config=bigquery.LoadJobConfig(
+                    write_disposition=bigquery.WriteDisposition.WRITE_APPEND if append
+                    else bigquery.WriteDisposition.WRITE_TRUNCATE
+                )
+            )
+            try:
+                job.result()
+                logging.info(f"Loaded {len(rows_to_insert)} rows into {STAGING_TABLE_ID}.")
+            except Exception as e:
+                logging.error(f"Error loading data to BigQuery: {e}")
+
+    def truncate_staging(self):
+        """
+        Empty the staging table, before loading it in several appended batches.
+        """
+        with self.timed("truncate"):
+            try:
+                self.client.query(f"TRUNCATE TABLE `{STAGING_TABLE_ID}`").result()
+                logging.info(f"Truncated {STAGING_TABLE_ID}.")
+            except Exception as e:
+                logging.error(f"Error truncating {STAGING_TABLE_ID}: {e}")
+                raise
+
+    def merge(self):
+        """
+        Merge the deduplicated staging table into the reviews table. Errors are logged and raised, so that
+        callers only treat the reviews as loaded once the MERGE succeeded.
+        """
+        self.merge_stats = None
+        with self.timed("merge"):
+            try:
+                query_job = self.client.query(MERGE_QUERY)
+                query_job.result()
+                self.merge_stats = {"bytes_processed": query_job.total_bytes_processed or 0,
+                                    "bytes_billed": query_job.total_bytes_billed or 0}
+                logging.info(f"Merge operation completed successfully. {query_job.total_bytes_processed} bytes processed.")
+            except Exception as e:
+                logging.error(f"Error executing merge query: {e}")
+                raise
+
+    def merge_incremental(self, reviews_data, prune_countries=False, **upload_kwargs):
+        """
+        Deduplicate the reviews by review_id on the client, load them to the staging table, and merge them
+        with the target scan restricted to the batch's review_date range (see build_incremental_merge_query).
+        Unchanged reviews are not rewritten.
+
+        :return: A dict with the rows staged, the duplicates dropped, and the bytes processed and billed by the MERGE.
+                 It is also kept in merge_stats.
+        """
+        if isinstance(reviews_data, ReviewBatch):
+            num_reviews = len(reviews_data)
+            deduped = reviews_data.dedupe()
+            all_dates, all_countries = deduped.column("review_date"), deduped.column("country")
+        else:
+            reviews = list(reviews_data)
+            num_reviews = len(reviews)
+            deduped = dedupe_reviews(reviews)
+            all_dates = [review.review_date for review in deduped]
+            all_countries = [review.country for review in deduped]
+        stats = {"rows": len(deduped), "duplicates_dropped": num_reviews - len(deduped),
+                 "bytes_processed": 0, "bytes_billed": 0}
+        self.merge_stats = stats
+        if not len(deduped):
+            logging.info("No reviews to merge.")
+            return stats
+        self.upload(deduped, **upload_kwargs)
+
+        review_dates = [review_date for review_date in all_dates if review_date is not None]
+        countries = sorted({country for country in all_countries if country is not None})
+        # Pruning only applies when every row carries the column; rows with a NULL value could match anywhere
+        prune_countries = prune_countries and len(countries) > 0 and all(all_countries)
+        query = build_incremental_merge_query(
+            prune_dates=bool(review_dates),
+            include_null_dates=len(review_dates) < len(deduped),
+            prune_countries=prune_countries,
+        )
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("min_date", "DATE", min(review_dates) if review_dates else None),
+            bigquery.ScalarQueryParameter("max_date", "DATE", max(review_dates) if review_dates else None),
+            bigquery.ArrayQueryParameter("countries", "STRING", countries),
+        ])
+        with self.timed("merge_incremental"):
+            query_job = self.client.query(query, job_config=job_config)
+            query_job.result()
+        stats["bytes_processed"] = query_job.total_bytes_processed or 0
+        stats["bytes_billed"] = query_job.total_bytes_billed or 0
+        logging.info(
+            f"Incremental merge of {stats['rows']} reviews ({stats['duplicates_dropped']} duplicates dropped): "
+            f"{stats['bytes_processed']} bytes processed, {stats['bytes_billed']} bytes billed."
+        )
+        return stats
+
+    def verify(self, expected_rows=None):
+        """
+        Count the staging rows and distinct review_ids, and check them against the number of rows uploaded.
+
+        :return: A dict with 'staging_rows' and 'staging_review_ids'.
+        """
+        with self.timed("verify"):
+            row = list(self.client.query(
+                f"SELECT COUNT(*) AS staging_rows, COUNT(DISTINCT review_id) AS staging_review_ids "
+                f"FROM `{STAGING_TABLE_ID}`"
+            ).result())[0]
+            counts = {"staging_rows": row["staging_rows"], "staging_review_ids": row["staging_review_ids"]}
+        if expected_rows is not None and counts["staging_rows"] != expected_rows:
+            logging.warning(f"Expected {expected_rows} rows in {STAGING_TABLE_ID}, found {counts['staging_rows']}.")
+        else:
+            logging.info(f"Verified {STAGING_TABLE_ID}: {counts}")
+        return counts
+
+    def close(self):
+        self.client.close()
+
+_loader_session = None
+
+def get_loader_session():
+    """
+    The LoaderSession shared by the module-level load functions, created on first use.
+    """
+    global _loader_session
+    if _loader_session is None:
+        _loader_session = LoaderSession()
+    return _loader_session
+
+def upload_and_merge(reviews_data, mode=None):
+    """
+    Upload the reviews to the staging table and merge them into the reviews table with the shared LoaderSession.
+
+    :param mode: "incremental" or "full". Defaults to MERGE_MODE.
+    :return: The LoaderSession, whose timing_summary() and merge_summary() describe the load.
+    """
+    mode = mode or MERGE_MODE
+    session = get_loader_session()
+    if mode == "incremental":
+        session.merge_incremental(reviews_data)
+    elif mode == "full":
+        reviews = reviews_data if isinstance(reviews_data, ReviewBatch) else list(reviews_data)
+        session.upload(reviews)
+        session.verify(len(reviews))
+        session.merge()
+    else:
+        raise ValueError(f"Unknown merge mode '{mode}'. Choose 'incremental' or 'full'.")
+    return session
+
+def truncate_staging_table():
+    """
+    Empty the staging table, before loading it in several appended batches.
+    """
+    get_loader_session().truncate_staging()
+
+def execute_merge():
+    get_loader_session().merge()
+
+
+def upload_saved_reviews(filename=None, mode=None):
+    """
+    Load reviews saved by a failed run (see review.iter_saved_reviews) and upload and merge them.
+
+    :param filename: Defaults to DEFAULT_STORE_FILE, or to LEGACY_STORE_FILE for files saved by older versions.
+    :return: The LoaderSession, whose timing_summary() and merge_summary() describe the load.
+    """
+    if filename is None:
+        filename = DEFAULT_STORE_FILE if os.path.exists(DEFAULT_STORE_FILE) else LEGACY_STORE_FILE
+    print(f"Loading parsed data from '{filename}'...")
+    if filename.endswith(".json"):
+        parsed_data_store = ReviewBatch.from_reviews(iter_saved_reviews(filename))
+    else:
+        parsed_data_store = ReviewBatch.from_ndjson(filename)
+    print(f"Loaded {len(parsed_data_store)} reviews.")
+    print("Attempting to upload data to GBQ...")
+    return upload_and_merge(parsed_data_store, mode)
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    parsed_data_store = load_reviews_from_json('parsed_data_store.json')
-    upload_to_staging_table(parsed_data_store)
-    execute_merge()
+    session = upload_saved_reviews()
+    logging.info(f"Load timings: {session.timing_summary()}")
+    logging.info(f"Merge: {session.merge_summary()}")
@@ -1,172 +1,186 @@
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import NoSuchElementException, TimeoutException
-from seleniumbase import get_driver
-import time
-from transform import parse_html
-from review import ReviewData, save_reviews_to_json, load_reviews_from_json
-from load import upload_to_staging_table, execute_merge
-
-parsed_data_store: list[ReviewData] = []
-
-markeplace_names = {
-    "ES": "Spain",
-    "UK": "United Kingdom",
-    "FR": "France",
-    "DE": "Germany",
-    "NL": "Netherlands",
-    "IT": "Italy",
-    "SE": "Sweden",
-    "PL": "Poland",
-}
-
-def init_driver():
-    # Define Chrome arguments as a list
-    chromium_args = [
-        "--no-sandbox",
-        "--disable-dev-shm-usage",
-        "--disable-infobars",
-        # "--headless",  # Uncomment if you want to run in headless mode
-    ]
-    
-    # Initialize the driver using SeleniumBase's get_driver function with chromium_arg
-    driver = get_driver(browser="chrome", headless=False, chromium_arg=chromium_args)
-    return driver
-
-def is_logged_in(driver):
-    try:
-        driver.find_element(By.CLASS_NAME, 'partner-dropdown-button')  # Update selector as needed
-        return True
-    except NoSuchElementException:
-        return False
-    
+from selenium.common.exceptions import TimeoutException
+import os
+from pages import (markeplace_names, init_driver, select_marketplace, select_english_language, get_num_pages,
+                   build_url, parse_page)
+from streaming import iter_reviews_html
+from archive import PageStore, ParseCache
+from review import save_reviews_to_ndjson, DEFAULT_STORE_FILE
+from columnar import ReviewBatch
+from load import upload_and_merge, upload_saved_reviews
+from readiness import Readiness, PageTimer
+from known_reviews import KnownReviewIndex
+from checkpoint import CheckpointLog
+from warehouse import ReviewWarehouse, DEFAULT_WAREHOUSE_FILE
+from fingerprint import (FingerprintIndex, FINGERPRINT_COLUMNS, fingerprint_reviews, find_cross_marketplace_duplicates,
+                         select_reviews)
+import telemetry
+from workers import scrape_marketplaces
+from fetch import build_session, sync_session_with_driver, fetch_pages, DEFAULT_MAX_CONCURRENCY
+from pipeline import scrape_and_upload
 
-def select_marketplace(driver, account="Zenement", marketplace_name="España"):
-    wait = WebDriverWait(driver, 10) 
+parsed_data_store = ReviewBatch()
 
-    try:
-        # Click the marketplace dropdown
-        marketplace_dropdown = wait.until(EC.element_to_be_clickable(
-            (By.CLASS_NAME, 'dropdown-account-switcher-header-label')))
-        marketplace_dropdown.click()
-        
-        # Wait for the options container to be visible
-        wait.until(EC.visibility_of_element_located(
-            (By.CLASS_NAME, 'dropdown-account-switcher-list-scrollable')))
-        
-        # Click the account container with title=account
-        account_xpath = f'//div[@class="dropdown-account-switcher-list-item" and @title="{account}"]'
-        account_element = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, account_xpath)))
-        account_element.click()
-        
-        # Wait for the marketplace options to be visible
-        wait.until(EC.visibility_of_element_located(
-            (By.XPATH, '//div[contains(@class, "dropdown-account-switcher-list-item-indented")]')))
-        
-        # Locate and click the marketplace with title=marketplace_name
-        option_xpath = f'//div[contains(@class, "dropdown-account-switcher-list-item-indented") and @title="{marketplace_name}"]'
-        marketplace_option = wait.until(EC.element_to_be_clickable(
-            (By.XPATH, option_xpath)))
-        marketplace_option.click()
-        
-        # Optionally, wait for the page to update after selection
-        #wait.until(EC.presence_of_element_located((By.ID, 'some-unique-page-element')))  # Adjust as needed
+# "http" downloads the review pages over a pooled HTTP session with the browser cookies,
+# "browser" renders every page in Selenium.
+FETCH_MODE = os.getenv("REVIEW_FETCH_MODE", "http")
 
-    except TimeoutException:
-        print("Timed out waiting for select_marketplace elements to become available.")
-    except NoSuchElementException as e:
-        print(f"Element not found when select_marketplace: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred at select_marketplace: {e}")
+# With REVIEW_INCREMENTAL=1, only the reviews missing from the local known reviews index are scraped and loaded.
+INCREMENTAL = os.getenv("REVIEW_INCREMENTAL", "0") == "1"
 
-def select_english_language(driver):
-    wait = WebDriverWait(driver, 10) 
+# With REVIEW_RESUME=1, the pages recorded in the checkpoint log by an interrupted run are reused, not scraped again.
+RESUME = os.getenv("REVIEW_RESUME", "0") == "1"
 
-    try:
-        # Click the marketplace dropdown
-        language_dropdown_container = wait.until(EC.element_to_be_clickable(
-            (By.CLASS_NAME, 'locale-icon-wrapper')))
-        language_dropdown_container.click()
-        
-        # Wait for the flyout (dropdown) to appear
-        localeList = wait.until(EC.visibility_of_element_located(
-            (By.CLASS_NAME, 'locale-list-body')))
+# With REVIEW_WORKERS=N (N > 1), the pages are scraped by N headless browsers sharing the login cookies.
+WORKERS = int(os.getenv("REVIEW_WORKERS", "1"))
 
-        
-        # Locate and click the English language option
-        english_option_xpath = './/a[@class="locale-list-item" and .//div[@class="locale-list-item-language" and normalize-space(text())="English"]]'
-        english_option = localeList.find_element(By.XPATH, english_option_xpath)
-        english_option.click()
-
-        # Optionally, wait for the page to update after selection
-        #wait.until(EC.presence_of_element_located((By.ID, 'some-unique-page-element')))  # Adjust as needed
-
-    except TimeoutException:
-        print("Timed out waiting for Language selection elements to become available.")
-    except NoSuchElementException as e:
-        print(f"Element for language switching not found: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred when switching language: {e}")
+# Local SQLite mirror the scraped reviews are upserted into (see warehouse.py). Set REVIEW_WAREHOUSE= to disable it.
+WAREHOUSE_FILE = os.getenv("REVIEW_WAREHOUSE", DEFAULT_WAREHOUSE_FILE)
 
-def get_num_pages(driver):
-    try:
-        wait = WebDriverWait(driver, 10)
-        pagination = wait.until(EC.presence_of_element_located((By.CLASS_NAME, 'css-9ymdzb')))
-        total_pages = int(pagination.get_attribute('aria-valuemax'))
-        current_page = int(pagination.get_attribute('aria-valuenow'))    
-        return total_pages, current_page
-    except Exception as e:
-        print(f"Error getting number of pages: {e}")
-        return 1, 1  # Assume at least one page if unable to determine
+# With REVIEW_CHANGES_ONLY=1, the reviews are compared with the warehouse (see fingerprint.py), and only the new,
+# changed and edited ones are loaded to GBQ. The warehouse is only updated once they are loaded.
+CHANGES_ONLY = os.getenv("REVIEW_CHANGES_ONLY", "0") == "1"
+
+# With REVIEW_PIPELINE=1, the pages are fetched, parsed and uploaded by overlapping stages (see pipeline.py).
+# The incremental, resume, workers and warehouse switches do not apply to it.
+PIPELINE = os.getenv("REVIEW_PIPELINE", "0") == "1"
 
-def build_url(driver, page=1, page_size=50):
-    base_url = driver.current_url.split('/')[0] + '//' + driver.current_url.split('/')[2]
-    return f"{base_url}/brand-customer-reviews/ref=xx_crvws_foot_xx?pageSize={page_size}&pageNumber={page}"
 
-def paginate(driver):
-    all_reviews = []
+def iter_paginate(driver, marketplace=None, page_store=None, parse_cache=None, readiness=None, known_index=None,
+                  checkpoint=None, skip_pages=()):
+    """
+    Walk through every review page and yield each review as soon as it has been parsed,
+    so that callers can forward reviews downstream while the page is still being read.
+
+    If a page_store is given, every raw page is archived under the marketplace name.
+    If a parse_cache is given, pages whose content was already parsed are not parsed again.
+    Pages are awaited with the given Readiness, whose timeouts adapt to the marketplace's latency.
+    If a known_index is given (incremental mode), only new reviews are yielded, and pagination stops
+    at the first page that only holds known reviews.
+    If a checkpoint log is given, the reviews of every completed page are recorded in it.
+    Pages in skip_pages (already in the checkpoint when resuming) are not visited.
+    """
+    readiness = readiness or Readiness()
+    marketplace = marketplace or "unknown"
     total_pages, current_page = get_num_pages(driver)
-    for page_num in range(current_page, total_pages + 1):
+    page_nums = [page_num for page_num in range(current_page, total_pages + 1) if page_num not in skip_pages]
+    if page_nums and page_nums[0] != current_page:
+        print(f"Resuming {marketplace} at page {page_nums[0]}")
+        driver.get(build_url(driver, page_nums[0]))
+    for index, page_num in enumerate(page_nums):
         print(f"Scraping page {page_num} of {total_pages}")
+        timer = PageTimer()
         
-        # Wait for the reviews to be present
-        wait = WebDriverWait(driver, 10)
-        retries = 3
-        while retries > 0:
-            try:
-                # Wait until at least one review is present
-                wait.until(EC.presence_of_element_located((By.CLASS_NAME, 'reviewContainer')))
-                break  # Success, break out of retry loop
-            except TimeoutException as e:
-                retries -= 1
-                print(f"Error waiting for reviews to load on page {page_num}: {e}")
-                if retries > 0:
-                    print(f"Retrying... ({retries} retries left)")
-                    time.sleep(2)  # Wait before retrying
-                else:
-                    print("Failed to load reviews after retries.")
-                    return all_reviews  # Return what we've collected so far
+        # Wait until the pagination shows this page and its reviews have finished rendering
+        try:
+            readiness.wait_for_reviews(driver, marketplace, page_num, timer)
+        except TimeoutException as e:
+            print(f"Failed to load reviews of page {page_num} after retries: {e}")
+            return  # Stop here, the reviews collected so far have already been yielded
         
-        html_content = driver.page_source
-        reviews = parse_html(html_content)
-        if not reviews:
+        with timer.working():
+            html_content = driver.page_source
+            if page_store is not None or parse_cache is not None:
+                reviews = iter(parse_page(html_content, marketplace, page_num, page_store, parse_cache))
+            else:
+                reviews = iter_reviews_html(html_content)
+        num_reviews = 0
+        new_reviews = []
+        while True:
+            with timer.working():
+                review = next(reviews, None)
+            if review is None:
+                break
+            num_reviews += 1
+            if known_index is not None and known_index.is_known(review):
+                continue
+            new_reviews.append(review)
+            yield review
+        # Seller Central lists reviews newest first: past a page of known reviews, every page is known
+        stop = known_index is not None and num_reviews > 0 and not new_reviews
+        if checkpoint is not None and num_reviews and not stop:
+            # A page of known reviews is not recorded, so that resuming visits it again and stops there again
+            checkpoint.record(marketplace, page_num, new_reviews)
+        if not num_reviews:
             print(f"No reviews found on page {page_num}.")
             # Decide what to do: continue, retry, or break
             # For now, we'll continue to the next page
-        else:
-            all_reviews.extend(reviews)
+        elif stop:
+            print(f"Page {page_num} only holds known reviews. Stopping here.")
         
-        if page_num < total_pages:
+        if not stop and index + 1 < len(page_nums):
             try:
-                driver.get(build_url(driver, page_num + 1))
-                time.sleep(2)  # Adjust sleep time as needed
+                with timer.waiting():
+                    driver.get(build_url(driver, page_nums[index + 1]))
             except Exception as e:
-                print(f"Could not navigate to page {page_num + 1}: {e}")
-                break
-    return all_reviews
+                print(f"Could not navigate to page {page_nums[index + 1]}: {e}")
+                stop = True
+        print(f"Page {page_num}: {timer.summary()}")
+        telemetry.observe("page_wait", timer.waiting_seconds, marketplace=marketplace)
+        telemetry.observe("page_work", timer.working_seconds, marketplace=marketplace)
+        telemetry.increment("pages_scraped", marketplace=marketplace)
+        if stop:
+            break
+    print(f"Page load latency {readiness.tracker.summary(marketplace)}")
+
+def paginate(driver, marketplace=None, page_store=None, parse_cache=None, readiness=None, known_index=None,
+             checkpoint=None, skip_pages=()):
+    return list(iter_paginate(
+        driver, marketplace, page_store, parse_cache, readiness, known_index, checkpoint, skip_pages
+    ))
+
+def iter_paginate_http(driver, session, marketplace=None, page_store=None, parse_cache=None,
+                       max_concurrency=DEFAULT_MAX_CONCURRENCY, readiness=None, known_index=None,
+                       checkpoint=None, skip_pages=()):
+    """
+    Same as iter_paginate, but the review pages are downloaded concurrently over the pooled HTTP
+    session instead of being rendered by the browser. The driver is only used to read the number
+    of pages, and as a fallback for pages that come back without reviews.
+    In incremental mode pages are fetched max_concurrency at a time, so that fetching can stop early.
+    """
+    readiness = readiness or Readiness()
+    sync_session_with_driver(session, driver)
+    total_pages, current_page = get_num_pages(driver)
+    page_nums = [page_num for page_num in range(current_page, total_pages + 1) if page_num not in skip_pages]
+    urls = [build_url(driver, page_num) for page_num in page_nums]
+    window = max_concurrency if known_index is not None else max(1, len(page_nums))
+    for start in range(0, len(page_nums), window):
+        fetched = fetch_pages(session, urls[start:start + window], max_concurrency)
+        for page_num, (url, html_content) in zip(page_nums[start:start + window], fetched):
+            print(f"Scraping page {page_num} of {total_pages}")
+            reviews = []
+            if isinstance(html_content, Exception):
+                print(f"Could not fetch page {page_num}: {html_content}")
+            else:
+                reviews = parse_page(html_content, marketplace, page_num, page_store, parse_cache)
+            if not reviews:
+                print(f"No reviews found on page {page_num} over HTTP. Falling back to the browser...")
+                try:
+                    driver.get(url)
+                    readiness.wait_for_reviews(driver, marketplace or "unknown", page_num)
+                    reviews = parse_page(driver.page_source, marketplace, page_num, page_store, parse_cache)
+                except Exception as e:
+                    print(f"Browser fallback failed for page {page_num}: {e}")
+            if not reviews:
+                print(f"No reviews found on page {page_num}.")
+                telemetry.increment("empty_pages", marketplace=marketplace or "unknown")
+                continue
+            telemetry.increment("pages_scraped", marketplace=marketplace or "unknown")
+            new_reviews = known_index.filter_new(reviews) if known_index is not None else reviews
+            if known_index is not None and not new_reviews:
+                # Not checkpointed, so that resuming fetches it again and stops there again
+                print(f"Page {page_num} only holds known reviews. Stopping here.")
+                return
+            yield from new_reviews
+            if checkpoint is not None:
+                checkpoint.record(marketplace or "unknown", page_num, new_reviews)
+
+def paginate_http(driver, session, marketplace=None, page_store=None, parse_cache=None,
+                  max_concurrency=DEFAULT_MAX_CONCURRENCY, readiness=None, known_index=None,
+                  checkpoint=None, skip_pages=()):
+    return list(iter_paginate_http(
+        driver, session, marketplace, page_store, parse_cache, max_concurrency, readiness, known_index,
+        checkpoint, skip_pages
+    ))
 
 
 def main():
@@ -176,18 +190,66 @@ def main():
 
     select_english_language(driver)
     driver.get(build_url(driver))
+    if PIPELINE:
+        scrape_pipeline(driver)
+        return
+    page_store = PageStore()
+    parse_cache = ParseCache()
+    session = build_session() if FETCH_MODE == "http" else None
+    readiness = Readiness()
+    known_index = KnownReviewIndex() if INCREMENTAL else None
+    checkpoint = CheckpointLog()
+    if RESUME:
+        resumed_pages = checkpoint.replay()
+    else:
+        checkpoint.clear()
+        resumed_pages = {}
     extraction_confirmed = False
     reviews_to_display={}
     while not extraction_confirmed:
+        if WORKERS > 1:
+            skip_pages = {}
+            for page_marketplace, page in resumed_pages:
+                skip_pages.setdefault(page_marketplace, set()).add(page)
+            with telemetry.span("scrape_workers", {"workers": WORKERS}):
+                scraped = scrape_marketplaces(driver, markeplace_names, WORKERS, skip_pages, page_store=page_store,
+                                              parse_cache=parse_cache, checkpoint=checkpoint)
         for marketplace in markeplace_names.keys():
-            time.sleep(2)
+            done_pages = {page for (page_marketplace, page) in resumed_pages if page_marketplace == marketplace}
+            resumed_reviews = [
+                review for (page_marketplace, _), page_reviews in resumed_pages.items()
+                if page_marketplace == marketplace for review in page_reviews
+            ]
+            if done_pages:
+                print(f"Reusing {len(resumed_reviews)} reviews from {len(done_pages)} checkpointed pages of {marketplace}.")
+            if WORKERS > 1:
+                reviews = scraped.get(marketplace, [])
+                if known_index is not None:
+                    reviews = known_index.filter_new(reviews)
+                reviews = resumed_reviews + reviews
+                print(f"Scraped {len(reviews)} reviews from {marketplace}.")
+                parsed_data_store.extend(reviews)
+                if reviews:
+                    reviews_to_display[marketplace] = reviews[0]
+                continue
             select_marketplace(driver, "Zenement", markeplace_names[marketplace])
-            time.sleep(2)
+            try:
+                readiness.wait_for_marketplace(driver, marketplace, markeplace_names[marketplace])
+            except TimeoutException:
+                print(f"Could not confirm the switch to {markeplace_names[marketplace]}. Continuing anyway...")
             driver.get(build_url(driver))
-            wait = WebDriverWait(driver, 10)
             try:
-                wait.until(EC.presence_of_element_located((By.CLASS_NAME, 'reviewContainer')))
-                reviews = paginate(driver)
+                with telemetry.span("scrape_marketplace", marketplace=marketplace):
+                    readiness.wait_for_reviews(driver, marketplace)
+                    if session is not None:
+                        reviews = resumed_reviews + paginate_http(
+                            driver, session, marketplace, page_store, parse_cache, readiness=readiness,
+                            known_index=known_index, checkpoint=checkpoint, skip_pages=done_pages
+                        )
+                    else:
+                        reviews = resumed_reviews + paginate(
+                            driver, marketplace, page_store, parse_cache, readiness, known_index, checkpoint, done_pages
+                        )
                 print(f"Scraped {len(reviews)} reviews from {marketplace}.")
                 parsed_data_store.extend(reviews)
                 if reviews:
@@ -205,35 +267,103 @@ def main():
         else:
             print(f"Retrying extraction for all marketplaces...")
             reviews.clear()
+            # Scrape every page again; the new records supersede the old ones in the checkpoint log
+            resumed_pages = {}
+    checkpoint.close()
     driver.quit()
+    if session is not None:
+        session.close()
 
+    reviews_to_load = parsed_data_store
+    if WAREHOUSE_FILE and CHANGES_ONLY:
+        try:
+            with ReviewWarehouse(WAREHOUSE_FILE) as warehouse, telemetry.span("change_detection"):
+                reviews_to_load = select_changed_reviews(warehouse, parsed_data_store)
+        except Exception as e:
+            print(f"Error comparing the reviews with the local warehouse '{WAREHOUSE_FILE}': {e}. Loading them all.")
 
     # Attempt to upload data to GBQ
     try:
         print("Data extraction complete. Loading data to GBQ...")
-        upload_to_staging_table(parsed_data_store)
-        execute_merge()
-        print("Data uploaded successfully.")
+        with telemetry.span("upload_and_merge"):
+            loader = upload_and_merge(reviews_to_load)
+        print(f"Data uploaded successfully. Load timings: {loader.timing_summary()}")
+        print(f"Merge: {loader.merge_summary()}")
+        if known_index is not None:
+            known_index.add(parsed_data_store)
+            known_index.save()
+        checkpoint.clear()
     except Exception as e:
         print(f"Error uploading data to GBQ: {e}")
-        # Save the parsed data store to JSON file
-        print("Saving parsed data to JSON file...")
-        save_reviews_to_json(parsed_data_store, 'parsed_data_store.json')
-        print("Data has been saved to 'parsed_data_store.json'. You can reload it later for uploading.")
+        # Save the parsed data store to a compressed newline-delimited JSON file
+        print("Saving parsed data to file...")
+        save_reviews_to_ndjson(parsed_data_store, DEFAULT_STORE_FILE)
+        print(f"Data has been saved to '{DEFAULT_STORE_FILE}'. You can reload it later for uploading.")
+    else:
+        # Only once they are in GBQ: with REVIEW_CHANGES_ONLY=1 the reviews found in the warehouse are not loaded again
+        if WAREHOUSE_FILE:
+            update_warehouse(parsed_data_store)
+
+def scrape_pipeline(driver):
+    """
+    Scrape and load every marketplace through the pipeline. The reviews it could not upload are saved
+    to DEFAULT_STORE_FILE, for retry-upload.
+    """
+    try:
+        with telemetry.span("scrape_pipeline"):
+            stats = scrape_and_upload(driver, markeplace_names)
+        print(f"Data uploaded successfully. Pipeline: {stats.summary()}")
+        if stats.failed_batches:
+            print(f"{len(stats.failed_reviews)} reviews could not be uploaded. They have been saved to "
+                  f"'{DEFAULT_STORE_FILE}', you can reload them later for uploading.")
+    except Exception as e:
+        print(f"Error loading the reviews to GBQ: {e}")
+    finally:
+        driver.quit()
+
+def update_warehouse(reviews):
+    """
+    Upsert the reviews into the local warehouse. Errors are reported, not raised: the warehouse is only a mirror.
+    """
+    try:
+        with ReviewWarehouse(WAREHOUSE_FILE) as warehouse, telemetry.span("warehouse_upsert"):
+            print(f"Upserted {warehouse.upsert(reviews)} reviews into '{WAREHOUSE_FILE}'.")
+    except Exception as e:
+        print(f"Error updating the local warehouse '{WAREHOUSE_FILE}': {e}")
+
+def select_changed_reviews(warehouse, reviews):
+    """
+    The reviews that are new, changed or edited compared with the warehouse, which must not hold them yet.
+    Also reports the reviews duplicated across marketplaces.
+    """
+    fingerprints = fingerprint_reviews(reviews)
+    index = FingerprintIndex()
+    countries = {fingerprint.country for fingerprint in fingerprints}
+    for country in sorted(country for country in countries if country is not None):
+        index.add(fingerprint_reviews(warehouse.fetch_columns(FINGERPRINT_COLUMNS, country=country)))
+    if None in countries:
+        index.add(fingerprint_reviews(warehouse.fetch_columns(FINGERPRINT_COLUMNS, missing_country=True)))
+    report = index.classify(fingerprints)
+    print(f"Compared with {len(index)} known reviews: {report.summary()}.")
+    duplicates = find_cross_marketplace_duplicates(fingerprints)
+    if duplicates:
+        print(f"{len(duplicates)} reviews appear in several marketplaces, e.g. "
+              f"{', '.join(f'{fingerprint.country}:{fingerprint.review_id}' for fingerprint in duplicates[0])}.")
+    return select_reviews(reviews, report.to_update)
+
 
 def retry_upload():
     try:
-        print("Loading parsed data from 'parsed_data_store.json'...")
-        parsed_data_store = load_reviews_from_json('parsed_data_store.json')
-        print(f"Loaded {len(parsed_data_store)} reviews.")
-        
-        print("Attempting to upload data to GBQ...")
-        upload_to_staging_table(parsed_data_store)
-        execute_merge()
-        print("Data uploaded successfully.")
+        loader = upload_saved_reviews()
+        print(f"Data uploaded successfully. Load timings: {loader.timing_summary()}")
+        print(f"Merge: {loader.merge_summary()}")
     except Exception as e:
         print(f"Error uploading data to GBQ: {e}")
         print("Please check the error and try again.")
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # Here rather than in main(), which cli.py runs and exports itself
+        telemetry.export()
@@ -0,0 +1,141 @@
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+from transform import parse_html
+
+# Browser and page helpers of the Seller Central review pages, shared by main, workers and pipeline.
+
+markeplace_names = {
+    "ES": "Spain",
+    "UK": "United Kingdom",
+    "FR": "France",
+    "DE": "Germany",
+    "NL": "Netherlands",
+    "IT": "Italy",
+    "SE": "Sweden",
+    "PL": "Poland",
+}
+
+def init_driver(headless=False):
+    # Define Chrome arguments as a list
+    chromium_args = [
+        "--no-sandbox",
+        "--disable-dev-shm-usage",
+        "--disable-infobars",
+        # "--headless",  # Uncomment if you want to run in headless mode
+    ]
+    
+    # Imported here: only the browsers need SeleniumBase, not the helpers below
+    from seleniumbase import get_driver
+
+    # Initialize the driver using SeleniumBase's get_driver function with chromium_arg
+    driver = get_driver(browser="chrome", headless=headless, chromium_arg=chromium_args)
+    return driver
+
+def is_logged_in(driver):
+    try:
+        driver.find_element(By.CLASS_NAME, 'partner-dropdown-button')  # Update selector as needed
+        return True
+    except NoSuchElementException:
+        return False
+    
+
+def select_marketplace(driver, account="Zenement", marketplace_name="España"):
+    wait = WebDriverWait(driver, 10) 
+
+    try:
+        # Click the marketplace dropdown
+        marketplace_dropdown = wait.until(EC.element_to_be_clickable(
+            (By.CLASS_NAME, 'dropdown-account-switcher-header-label')))
+        marketplace_dropdown.click()
+        
+        # Wait for the options container to be visible
+        wait.until(EC.visibility_of_element_located(
+            (By.CLASS_NAME, 'dropdown-account-switcher-list-scrollable')))
+        
+        # Click the account container with title=account
+        account_xpath = f'//div[@class="dropdown-account-switcher-list-item" and @title="{account}"]'
+        account_element = wait.until(EC.element_to_be_clickable(
+            (By.XPATH, account_xpath)))
+        account_element.click()
+        
+        # Wait for the marketplace options to be visible
+        wait.until(EC.visibility_of_element_located(
+            (By.XPATH, '//div[contains(@class, "dropdown-account-switcher-list-item-indented")]')))
+        
+        # Locate and click the marketplace with title=marketplace_name
+        option_xpath = f'//div[contains(@class, "dropdown-account-switcher-list-item-indented") and @title="{marketplace_name}"]'
+        marketplace_option = wait.until(EC.element_to_be_clickable(
+            (By.XPATH, option_xpath)))
+        marketplace_option.click()
+        
+        # Optionally, wait for the page to update after selection
+        #wait.until(EC.presence_of_element_located((By.ID, 'some-unique-page-element')))  # Adjust as needed
+
+    except TimeoutException:
+        print("Timed out waiting for select_marketplace elements to become available.")
+    except NoSuchElementException as e:
+        print(f"Element not found when select_marketplace: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred at select_marketplace: {e}")
+
+def select_english_language(driver):
+    wait = WebDriverWait(driver, 10) 
+
+    try:
+        # Click the marketplace dropdown
+        language_dropdown_container = wait.until(EC.element_to_be_clickable(
+            (By.CLASS_NAME, 'locale-icon-wrapper')))
+        language_dropdown_container.click()
+        
+        # Wait for the flyout (dropdown) to appear
+        localeList = wait.until(EC.visibility_of_element_located(
+            (By.CLASS_NAME, 'locale-list-body')))
+
+        
+        # Locate and click the English language option
+        english_option_xpath = './/a[@class="locale-list-item" and .//div[@class="locale-list-item-language" and normalize-space(text())="English"]]'
+        english_option = localeList.find_element(By.XPATH, english_option_xpath)
+        english_option.click()
+
+        # Optionally, wait for the page to update after selection
+        #wait.until(EC.presence_of_element_located((By.ID, 'some-unique-page-element')))  # Adjust as needed
+
+    except TimeoutException:
+        print("Timed out waiting for Language selection elements to become available.")
+    except NoSuchElementException as e:
+        print(f"Element for language switching not found: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred when switching language: {e}")
+
+def get_num_pages(driver):
+    try:
+        wait = WebDriverWait(driver, 10)
+        pagination = wait.until(EC.presence_of_element_located((By.CLASS_NAME, 'css-9ymdzb')))
+        total_pages = int(pagination.get_attribute('aria-valuemax'))
+        current_page = int(pagination.get_attribute('aria-valuenow'))    
+        return total_pages, current_page
+    except Exception as e:
+        print(f"Error getting number of pages: {e}")
+        return 1, 1  # Assume at least one page if unable to determine
+
+def get_base_url(driver):
+    return driver.current_url.split('/')[0] + '//' + driver.current_url.split('/')[2]
+
+def build_page_url(base_url, page=1, page_size=50):
+    return f"{base_url}/brand-customer-reviews/ref=xx_crvws_foot_xx?pageSize={page_size}&pageNumber={page}"
+
+def build_url(driver, page=1, page_size=50):
+    return build_page_url(get_base_url(driver), page, page_size)
+
+def parse_page(html_content, marketplace, page_num, page_store=None, parse_cache=None):
+    """
+    Archive and parse a fetched page, going through the page store and parse cache when given.
+    """
+    html_hash = None
+    if page_store is not None:
+        html_hash = page_store.save(marketplace or "unknown", page_num, html_content)
+    if parse_cache is not None:
+        return parse_cache.parse(html_content, html_hash)
+    return parse_html(html_content)
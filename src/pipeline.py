@@ -0,0 +1,263 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import asyncio
+import logging
+import os
+import time
+from fetch import build_session, sync_session_with_driver, fetch_page
+from transform import parse_html
+
+DEFAULT_FETCH_CONCURRENCY = 4
+DEFAULT_PARSE_CONCURRENCY = os.cpu_count() or 1
+DEFAULT_UPLOAD_CONCURRENCY = 1
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_QUEUE_SIZE = 8
+
+# Marks the end of the stream on a queue
+_DONE = object()
+
+
+@dataclass
+class PageJob:
+    """
+    A review page to fetch, with the HTTP session holding the cookies of its marketplace.
+    """
+    marketplace: str
+    page_num: int
+    url: str
+    session: object = None
+
+
+@dataclass
+class StageStats:
+    items: int = 0
+    errors: int = 0
+    busy_seconds: float = 0.0
+
+
+@dataclass
+class PipelineStats:
+    """
+    Per-stage counters. busy_seconds adds up the time spent inside each stage's function,
+    so comparing it with `elapsed` shows which stage bounds the run. The batches whose upload
+    failed are kept in failed_batches.
+    """
+    fetch: StageStats = field(default_factory=StageStats)
+    parse: StageStats = field(default_factory=StageStats)
+    upload: StageStats = field(default_factory=StageStats)
+    reviews: int = 0
+    elapsed: float = 0.0
+    failed_batches: list = field(default_factory=list, repr=False)
+
+    @property
+    def failed_reviews(self) -> list:
+        return [review for batch in self.failed_batches for review in batch]
+
+    def summary(self) -> str:
+        return (
+            f"{self.reviews} reviews in {self.elapsed:.1f}s | "
+            + " | ".join(
+                f"{name}: {stage.items} ok, {stage.errors} failed, {stage.busy_seconds:.1f}s busy"
+                for name, stage in (("fetch", self.fetch), ("parse", self.parse), ("upload", self.upload))
+            )
+        )
+
+
+def fetch_job(job: PageJob) -> str:
+    return fetch_page(job.session, job.url)
+
+
+async def _timed(stats: StageStats, awaitable):
+    start = time.perf_counter()
+    try:
+        result = await awaitable
+        stats.items += 1
+        return result
+    except Exception:
+        stats.errors += 1
+        raise
+    finally:
+        stats.busy_seconds += time.perf_counter() - start
+
+
+async def run_pipeline(jobs, fetch=fetch_job, parse=parse_html, upload=None,
+                       fetch_concurrency: int = DEFAULT_FETCH_CONCURRENCY,
+                       parse_concurrency: int = DEFAULT_PARSE_CONCURRENCY,
+                       upload_concurrency: int = DEFAULT_UPLOAD_CONCURRENCY,
+                       batch_size: int = DEFAULT_BATCH_SIZE,
+                       queue_size: int = DEFAULT_QUEUE_SIZE,
+                       parse_executor=None) -> PipelineStats:
+    """
+    Run page fetch -> parse -> batch accumulate -> upload as concurrent stages linked by bounded queues,
+    so that a slow stage applies backpressure upstream instead of letting work pile up in memory.
+
+    :param jobs: An iterable or async iterable of PageJob (or of anything `fetch` accepts).
+    :param fetch: Blocking function job -> page source, run in threads.
+    :param parse: Picklable function page source -> list of reviews, run in a process pool.
+    :param upload: Blocking function list of reviews -> None, run in threads. Batches are dropped if None,
+                   and kept in the stats' failed_batches if it raises.
+    :param parse_executor: Executor for `parse`. Defaults to a ProcessPoolExecutor of parse_concurrency workers.
+    :return: PipelineStats of the run.
+    """
+    stats = PipelineStats()
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    fetch_queue = asyncio.Queue(queue_size)
+    parse_queue = asyncio.Queue(queue_size)
+    review_queue = asyncio.Queue(queue_size)
+    upload_queue = asyncio.Queue(max(1, queue_size // 4))
+    own_executor = parse_executor is None
+    if own_executor:
+        parse_executor = ProcessPoolExecutor(max_workers=parse_concurrency)
+
+    async def produce():
+        if hasattr(jobs, '__aiter__'):
+            async for job in jobs:
+                await fetch_queue.put(job)
+        else:
+            for job in jobs:
+                await fetch_queue.put(job)
+
+    async def fetch_worker():
+        while (job := await fetch_queue.get()) is not _DONE:
+            try:
+                html_content = await _timed(stats.fetch, asyncio.to_thread(fetch, job))
+            except Exception as e:
+                logging.error(f"Fetch failed for {job}: {e}")
+                continue
+            await parse_queue.put((job, html_content))
+
+    async def parse_worker():
+        while (item := await parse_queue.get()) is not _DONE:
+            job, html_content = item
+            try:
+                reviews = await _timed(stats.parse, loop.run_in_executor(parse_executor, parse, html_content))
+            except Exception as e:
+                logging.error(f"Parse failed for {job}: {e}")
+                continue
+            if not reviews:
+                logging.warning(f"No reviews found for {job}")
+            await review_queue.put(reviews)
+
+    async def accumulate():
+        batch = []
+        while (reviews := await review_queue.get()) is not _DONE:
+            batch.extend(reviews)
+            stats.reviews += len(reviews)
+            while len(batch) >= batch_size:
+                await upload_queue.put(batch[:batch_size])
+                batch = batch[batch_size:]
+        if batch:
+            await upload_queue.put(batch)
+
+    async def upload_worker():
+        while (batch := await upload_queue.get()) is not _DONE:
+            if upload is None:
+                continue
+            try:
+                await _timed(stats.upload, asyncio.to_thread(upload, batch))
+            except Exception as e:
+                logging.error(f"Upload of {len(batch)} reviews failed: {e}")
+                stats.failed_batches.append(batch)
+
+    fetchers = [asyncio.create_task(fetch_worker()) for _ in range(fetch_concurrency)]
+    parsers = [asyncio.create_task(parse_worker()) for _ in range(parse_concurrency)]
+    accumulator = asyncio.create_task(accumulate())
+    uploaders = [asyncio.create_task(upload_worker()) for _ in range(upload_concurrency)]
+    try:
+        # Shut each stage down in order once the one before it has drained
+        await produce()
+        for stage_queue, workers in ((fetch_queue, fetchers), (parse_queue, parsers), (review_queue, [accumulator]),
+                                     (upload_queue, uploaders)):
+            for _ in workers:
+                await stage_queue.put(_DONE)
+            await asyncio.gather(*workers)
+    finally:
+        for task in fetchers + parsers + [accumulator] + uploaders:
+            task.cancel()
+        if own_executor:
+            parse_executor.shutdown(cancel_futures=True)
+    stats.elapsed = time.perf_counter() - start
+    logging.info(f"Pipeline finished: {stats.summary()}")
+    return stats
+
+
+async def iter_marketplace_jobs(driver, marketplaces: dict, account: str = "Zenement",
+                                max_concurrency: int = DEFAULT_FETCH_CONCURRENCY, readiness=None):
+    """
+    Switch the browser to each marketplace in turn and yield the PageJob of all its review pages.
+    Every marketplace gets its own HTTP session, so the fetches of one marketplace can still be running
+    while the browser has already switched to the next one.
+    The session takes its cookies only once the switch has been confirmed: marketplaces whose switch cannot
+    be confirmed, or whose review pages do not load, are logged and skipped.
+    """
+    # Imported here: pages and readiness pull in Selenium, which the pipeline itself does not need
+    from pages import select_marketplace, build_url, get_num_pages
+    from readiness import Readiness
+
+    readiness = readiness or Readiness()
+
+    def prepare(marketplace):
+        select_marketplace(driver, account, marketplaces[marketplace])
+        readiness.wait_for_marketplace(driver, marketplace, marketplaces[marketplace])
+        driver.get(build_url(driver))
+        readiness.wait_for_reviews(driver, marketplace)
+        session = sync_session_with_driver(build_session(max_concurrency), driver)
+        total_pages, current_page = get_num_pages(driver)
+        return [
+            PageJob(marketplace, page_num, build_url(driver, page_num), session)
+            for page_num in range(current_page, total_pages + 1)
+        ]
+
+    for marketplace in marketplaces:
+        try:
+            page_jobs = await asyncio.to_thread(prepare, marketplace)
+        except Exception as e:
+            logging.error(f"Error preparing the pages of marketplace {marketplace}, skipping it: {e}")
+            continue
+        logging.info(f"Queued {len(page_jobs)} pages from {marketplace}.")
+        for job in page_jobs:
+            yield job
+
+
+def scrape_and_upload(driver, marketplaces: dict, **pipeline_kwargs) -> PipelineStats:
+    """
+    Scrape every marketplace through the pipeline, appending batches to the staging table as they fill up,
+    and merge them into the reviews table at the end. The reviews of the batches that could not be uploaded
+    are saved to DEFAULT_STORE_FILE, to be loaded later with retry-upload.
+    """
+    from load import get_loader_session
+    from review import save_reviews_to_ndjson, DEFAULT_STORE_FILE
+
+    loader = get_loader_session()
+    loader.truncate_staging()
+    stats = asyncio.run(run_pipeline(
+        iter_marketplace_jobs(driver, marketplaces),
+        upload=lambda batch: loader.upload(batch, append=True),
+        **pipeline_kwargs,
+    ))
+    failed_reviews = stats.failed_reviews
+    if failed_reviews:
+        save_reviews_to_ndjson(failed_reviews, DEFAULT_STORE_FILE)
+        logging.warning(f"{len(failed_reviews)} reviews could not be uploaded. They have been saved to "
+                        f"'{DEFAULT_STORE_FILE}', you can reload them later for uploading.")
+    loader.verify(stats.reviews - len(failed_reviews))
+    loader.merge()
+    logging.info(f"Load timings: {loader.timing_summary()}")
+    logging.info(f"Merge: {loader.merge_summary()}")
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from pages import init_driver, select_english_language, build_url, markeplace_names
+
+    driver = init_driver()
+    driver.get("https://sellercentral.amazon.com/")
+    input("\n\nPlease log in, and select any Marketplace. Then press Enter to continue...")
+    select_english_language(driver)
+    driver.get(build_url(driver))
+    try:
+        print(scrape_and_upload(driver, markeplace_names).summary())
+    finally:
+        driver.quit()
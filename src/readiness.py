@@ -0,0 +1,219 @@
+from collections import defaultdict, deque
+from contextlib import contextmanager, nullcontext
+import logging
+import random
+import time
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.common.by import By
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException
+from telemetry import span, increment
+from transform import country_code_from_text
+
+REVIEW_CONTAINER_CLASS = 'reviewContainer'
+PAGINATION_CLASS = 'css-9ymdzb'
+PARTNER_BUTTON_CLASS = 'partner-dropdown-button'
+
+DEFAULT_TIMEOUT = 10.0
+MIN_TIMEOUT = 2.0
+MAX_TIMEOUT = 30.0
+POLL_FREQUENCY = 0.1
+# Latencies kept per marketplace, and how many are needed before trusting the percentiles
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 5
+
+
+class LatencyTracker:
+    """
+    Learns how long pages take to become ready on each marketplace, and derives adaptive timeouts from it.
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW, timeout_factor: float = 3.0):
+        self.timeout_factor = timeout_factor
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, marketplace: str, seconds: float):
+        self._latencies[marketplace].append(seconds)
+
+    def percentile(self, marketplace: str, p: float):
+        """
+        The p-th percentile (0-100) of the recorded latencies, or None without enough samples.
+        """
+        samples = sorted(self._latencies[marketplace])
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+    def timeout_for(self, marketplace: str) -> float:
+        """
+        timeout_factor times the p95 latency, clamped to [MIN_TIMEOUT, MAX_TIMEOUT].
+        Falls back to DEFAULT_TIMEOUT until enough pages have been observed.
+        """
+        p95 = self.percentile(marketplace, 95)
+        if p95 is None:
+            return DEFAULT_TIMEOUT
+        return min(MAX_TIMEOUT, max(MIN_TIMEOUT, p95 * self.timeout_factor))
+
+    def summary(self, marketplace: str) -> str:
+        p50, p95 = self.percentile(marketplace, 50), self.percentile(marketplace, 95)
+        if p50 is None:
+            return f"{marketplace}: {len(self._latencies[marketplace])} samples"
+        return f"{marketplace}: p50={p50:.2f}s p95={p95:.2f}s timeout={self.timeout_for(marketplace):.1f}s"
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """
+    Exponential backoff with full jitter: a random delay in [0, min(cap, base * 2**attempt)].
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class PageTimer:
+    """
+    Splits the time spent on a page between waiting on the browser and doing work, for logging.
+    """
+
+    def __init__(self):
+        self.waiting_seconds = 0.0
+        self.working_seconds = 0.0
+
+    @contextmanager
+    def waiting(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.waiting_seconds += time.perf_counter() - start
+
+    @contextmanager
+    def working(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.working_seconds += time.perf_counter() - start
+
+    def summary(self) -> str:
+        return f"waited {self.waiting_seconds:.2f}s, worked {self.working_seconds:.2f}s"
+
+
+class reviews_settled:
+    """
+    Condition met once at least one review container is present and their count has not changed
+    for `stable_for` seconds, i.e. the page has finished rendering its list.
+    """
+
+    def __init__(self, stable_for: float = 0.3):
+        self.stable_for = stable_for
+        self._count = None
+        self._since = None
+
+    def __call__(self, driver):
+        count = len(driver.find_elements(By.CLASS_NAME, REVIEW_CONTAINER_CLASS))
+        now = time.monotonic()
+        if count != self._count:
+            self._count, self._since = count, now
+            return False
+        return count > 0 and now - self._since >= self.stable_for
+
+
+class pagination_at:
+    """
+    Condition met once the pagination input reports the given page number in aria-valuenow.
+    """
+
+    def __init__(self, page_num: int):
+        self.page_num = str(page_num)
+
+    def __call__(self, driver):
+        try:
+            elements = driver.find_elements(By.CLASS_NAME, PAGINATION_CLASS)
+            return bool(elements) and elements[0].get_attribute('aria-valuenow') == self.page_num
+        except StaleElementReferenceException:
+            return False
+
+
+class marketplace_selected:
+    """
+    Condition met once the header partner button shows the given marketplace (a country code), whatever the
+    language of the page.
+    """
+
+    def __init__(self, marketplace: str):
+        self.marketplace = marketplace
+
+    def __call__(self, driver):
+        try:
+            buttons = driver.find_elements(By.CLASS_NAME, PARTNER_BUTTON_CLASS)
+            return bool(buttons) and country_code_from_text(buttons[0].text) == self.marketplace
+        except StaleElementReferenceException:
+            return False
+
+
+class all_of:
+    """
+    Condition met once every given condition is met, each one being polled until it is.
+    """
+
+    def __init__(self, *conditions):
+        self.conditions = conditions
+        self._met = set()
+
+    def __call__(self, driver):
+        for index, condition in enumerate(self.conditions):
+            if index not in self._met:
+                if not condition(driver):
+                    return False
+                self._met.add(index)
+        return True
+
+
+class Readiness:
+    """
+    Waits on concrete DOM conditions instead of fixed sleeps, with per-marketplace adaptive timeouts.
+    """
+
+    def __init__(self, tracker: LatencyTracker = None, retries: int = 3):
+        self.tracker = tracker or LatencyTracker()
+        self.retries = retries
+
+    def wait(self, driver, condition, marketplace: str, description: str = "page", timer: PageTimer = None):
+        """
+        Wait until condition(driver) is truthy, retrying with exponential backoff and jitter on timeouts.
+
+        :return: The condition's value.
+        :raises TimeoutException: If the condition is still not met after all retries.
+        """
+        for attempt in range(self.retries):
+            timeout = self.tracker.timeout_for(marketplace)
+            start = time.perf_counter()
+            try:
+                with (timer.waiting() if timer else nullcontext()), \
+                        span("webdriver_wait", {"description": description}, marketplace=marketplace):
+                    result = WebDriverWait(driver, timeout, poll_frequency=POLL_FREQUENCY).until(condition)
+                self.tracker.record(marketplace, time.perf_counter() - start)
+                return result
+            except TimeoutException:
+                increment("wait_timeouts", marketplace=marketplace)
+                if attempt == self.retries - 1:
+                    raise
+                delay = backoff_delay(attempt)
+                logging.warning(
+                    f"Timed out after {timeout:.1f}s waiting for {description} on {marketplace}. "
+                    f"Retrying in {delay:.1f}s ({self.retries - attempt - 1} retries left)"
+                )
+                with (timer.waiting() if timer else nullcontext()), span("backoff_sleep", marketplace=marketplace):
+                    time.sleep(delay)
+
+    def wait_for_reviews(self, driver, marketplace: str, page_num: int = None, timer: PageTimer = None):
+        """
+        Wait for a review page to be ready: the pagination shows page_num (if given) and the review list has settled.
+        """
+        condition = reviews_settled() if page_num is None else all_of(pagination_at(page_num), reviews_settled())
+        return self.wait(driver, condition, marketplace, f"reviews of page {page_num or ''}".strip(), timer)
+
+    def wait_for_marketplace(self, driver, marketplace: str, marketplace_name: str):
+        """
+        Wait for the header to show the newly selected marketplace. Switch latencies are tracked apart from page loads.
+        """
+        return self.wait(driver, marketplace_selected(marketplace), f"{marketplace} switch",
+                         f"marketplace {marketplace_name}")
@@ -1,16 +1,100 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, TypeAdapter
 from datetime import date
+from functools import lru_cache, partial
+from itertools import islice
+import bz2
+import gzip
 import json
 import hashlib
+import lzma
+import os
 from typing import Union
 
-def generate_review_id(author, title, review_date):
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# BigQuery schema of the review columns after review_id, shared by the staging table and the local warehouse
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'resources', 'schema.json')
+# Columns whose change means the review itself changed. scraped_on is left out on purpose:
+# re-scraping an unchanged review must not rewrite its row.
+CONTENT_COLUMNS = ("country", "asin", "brand", "review_date", "author", "title", "body", "rating", "url")
+
+# File the scraped reviews are saved to when they could not be loaded to GBQ
+DEFAULT_STORE_FILE = "parsed_data_store.ndjson.gz"
+LEGACY_STORE_FILE = "parsed_data_store.json"
+# Rows validated per pydantic call when loading newline-delimited JSON
+DEFAULT_VALIDATION_BATCH = 10000
+# gzip defaults to its slowest level 9; level 1 writes several times faster, for files ~15% larger
+_COMPRESSED_OPENERS = {".gz": partial(gzip.open, compresslevel=1), ".bz2": bz2.open, ".xz": lzma.open}
+
+# review_id schemes, all hashing the UTF-8 string f"{author}_{title}_{review_date}" into lowercase hex:
+#  - "sha256-v1": SHA-256, 64 hex chars. The original scheme, and the one of every review_id already in BigQuery.
+#  - "blake2b128-v1": BLAKE2b with a 16 byte digest, 32 hex chars. Standard library only.
+#  - "xxh3-128-v1": xxHash XXH3 128-bit, 32 hex chars, several times faster. Requires the xxhash package.
+# Ids of different schemes never match, so a table must be re-keyed as a whole (see rekey_review_ids) before the
+# scheme is switched. SHA-256 ids are 64 chars long and the 128-bit ones 32, so they cannot collide during a migration.
+# With 128-bit ids the chance of any collision among a billion reviews is about 1e-21.
+REVIEW_ID_SCHEMES = ("sha256-v1", "blake2b128-v1", "xxh3-128-v1")
+REVIEW_ID_SCHEME = os.getenv("REVIEW_ID_SCHEME", "sha256-v1")
+
+
+@lru_cache(maxsize=None)
+def _review_id_hasher(scheme: str):
+    """
+    The function bytes -> hex id of a review_id scheme.
+    """
+    if scheme == "sha256-v1":
+        sha256 = hashlib.sha256
+        return lambda data: sha256(data).hexdigest()
+    if scheme == "blake2b128-v1":
+        blake2b = hashlib.blake2b
+        return lambda data: blake2b(data, digest_size=16).hexdigest()
+    if scheme == "xxh3-128-v1":
+        if xxhash is None:
+            raise ImportError("The xxh3-128-v1 review_id scheme requires the xxhash package: pip install xxhash")
+        return xxhash.xxh3_128_hexdigest
+    raise ValueError(f"Unknown review_id scheme '{scheme}'. Choose one of {', '.join(REVIEW_ID_SCHEMES)}.")
+
+
+def generate_review_id(author, title, review_date, scheme: str = None):
     unique_string = f"{author}_{title}_{review_date}"
-    return hashlib.sha256(unique_string.encode('utf-8')).hexdigest()
+    return _review_id_hasher(scheme or REVIEW_ID_SCHEME)(unique_string.encode('utf-8'))
+
+
+def generate_review_ids(authors, titles, review_dates, scheme: str = None) -> list[str]:
+    """
+    generate_review_id over columns of authors, titles and review dates (dates or None), e.g. the columns
+    of a ReviewBatch. Still one hash call per row, in a list comprehension; only the lookup of the scheme's
+    hash function is shared by the whole column.
+    """
+    hasher = _review_id_hasher(scheme or REVIEW_ID_SCHEME)
+    return [
+        hasher(f"{author}_{title}_{review_date}".encode('utf-8'))
+        for author, title, review_date in zip(authors, titles, review_dates)
+    ]
+
+
+def rekey_review_ids(authors, titles, review_dates, from_scheme: str = "sha256-v1", to_scheme: str = None):
+    """
+    Pairs (old review_id, new review_id) for migrating stored reviews from one scheme to another,
+    e.g. loaded to a mapping table and applied with an UPDATE ... FROM in BigQuery.
+    """
+    return list(zip(
+        generate_review_ids(authors, titles, review_dates, from_scheme),
+        generate_review_ids(authors, titles, review_dates, to_scheme),
+    ))
 
 # The review data model defaults to "None" for most fields
 class ReviewData(BaseModel):
-    review_id:   str  = generate_review_id(None, None, None)
+    # Defaults are evaluated per instance: the review_id scheme and the date may change after import
+    review_id:   str  = Field(default_factory=lambda: generate_review_id(None, None, None))
     country:     Union[str,None] = None
     asin:        Union[str,None] = None
     brand:       Union[str,None] = None
@@ -22,7 +106,7 @@ class ReviewData(BaseModel):
     body:        Union[str,None] = None
     rating:      Union[int,None] = None
     url:         Union[str,None] = None 
-    scraped_on: date = date.today()
+    scraped_on: date = Field(default_factory=date.today)
 
     model_config = {
         "json_encoders": {date: lambda v: v.isoformat()},
@@ -39,6 +123,18 @@ class ReviewData(BaseModel):
             data['scraped_on'] = self.scraped_on.isoformat()
         return data
 
+def dedupe_reviews(reviews: list[ReviewData]) -> list[ReviewData]:
+    """
+    Keep a single row per review_id: the most recently scraped one (the last one seen on ties),
+    like the ROW_NUMBER() deduplication of the staging table. First-seen order is preserved.
+    """
+    latest = {}
+    for review in reviews:
+        kept = latest.get(review.review_id)
+        if kept is None or (review.scraped_on or date.min) >= (kept.scraped_on or date.min):
+            latest[review.review_id] = review
+    return list(latest.values())
+
 def save_reviews_to_json(reviews: list[ReviewData], filename: str):
     """
     Save the list of ReviewData objects to a JSON file.
@@ -53,5 +149,68 @@ def load_reviews_from_json(filename: str) -> list[ReviewData]:
     """
     with open(filename, 'r', encoding='utf-8') as f:
         data = json.load(f)
-    reviews = [ReviewData(**item) for item in data]
-    return reviews
+    return _review_list_adapter().validate_python(data)
+
+@lru_cache(maxsize=None)
+def _review_list_adapter():
+    # Built once, on first use: validating a whole list in one call is much faster than a model per row
+    return TypeAdapter(list[ReviewData])
+
+def _open_reviews_file(filename: str, mode: str):
+    """
+    Open a file in binary mode, compressed if its name ends in .gz, .bz2 or .xz.
+    """
+    for suffix, opener in _COMPRESSED_OPENERS.items():
+        if filename.endswith(suffix):
+            return opener(filename, mode)
+    return open(filename, mode)
+
+def _json_default(value):
+    # ReviewBatch rows hold date objects, where ReviewData.model_dump already gives iso strings
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _dumps(row: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(row)
+    return json.dumps(row, ensure_ascii=False, default=_json_default).encode('utf-8')
+
+def save_reviews_to_ndjson(reviews, filename: str) -> int:
+    """
+    Stream reviews to a newline-delimited JSON file, one review per line, compressed if the name ends in
+    .gz, .bz2 or .xz. Accepts any iterable of ReviewData, or a columnar.ReviewBatch.
+
+    :return: The number of reviews written.
+    """
+    count = 0
+    with _open_reviews_file(filename, 'wb') as f:
+        if hasattr(reviews, "iter_dicts"):
+            # A ReviewBatch: serialize its rows without building models
+            lines = (_dumps(row) for row in reviews.iter_dicts())
+        else:
+            lines = (review.model_dump_json().encode('utf-8') for review in reviews)
+        for line in lines:
+            f.write(line)
+            f.write(b'\n')
+            count += 1
+    return count
+
+def iter_reviews_from_ndjson(filename: str, batch_size: int = DEFAULT_VALIDATION_BATCH):
+    """
+    Lazily load ReviewData from a newline-delimited JSON file written by save_reviews_to_ndjson.
+    Lines are validated `batch_size` at a time in a single pydantic call, so memory stays bounded by one batch.
+    """
+    adapter = _review_list_adapter()
+    with _open_reviews_file(filename, 'rb') as f:
+        lines = (line for line in f if line.strip())
+        while batch := list(islice(lines, batch_size)):
+            yield from adapter.validate_json(b'[' + b','.join(batch) + b']')
+
+def iter_saved_reviews(filename: str, batch_size: int = DEFAULT_VALIDATION_BATCH):
+    """
+    Lazily load reviews saved by save_reviews_to_ndjson, or by save_reviews_to_json for .json files.
+    """
+    if filename.endswith(".json"):
+        return iter(load_reviews_from_json(filename))
+    return iter_reviews_from_ndjson(filename, batch_size)
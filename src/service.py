@@ -0,0 +1,306 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass, field
+import asyncio
+import logging
+import os
+import time
+import uuid
+import aiofiles
+from fastapi import FastAPI, HTTPException, Request
+from batch_parse import CAPTURE_EXTENSIONS, parse_file
+from columnar import ReviewBatch
+from telemetry import Histogram
+
+UPLOAD_DIR = os.getenv("REVIEW_UPLOAD_DIR", "uploads")
+PARSE_WORKERS = int(os.getenv("REVIEW_PARSE_WORKERS", os.cpu_count() or 1))
+# A load runs every LOAD_INTERVAL seconds, or as soon as LOAD_BATCH_SIZE reviews are waiting
+LOAD_INTERVAL = float(os.getenv("REVIEW_LOAD_INTERVAL", 30))
+LOAD_BATCH_SIZE = int(os.getenv("REVIEW_LOAD_BATCH_SIZE", 10000))
+MAX_UPLOAD_BYTES = 64 * 1024 * 1024
+# Steps whose latencies are reported by /metrics
+LATENCY_STEPS = ("upload", "parse", "load", "end_to_end")
+# Finished jobs kept for GET /jobs
+MAX_FINISHED_JOBS = 10000
+
+
+class UploadTooLarge(ValueError):
+    """
+    Raised by IngestionService.receive for captures over MAX_UPLOAD_BYTES.
+    """
+
+
+@dataclass
+class IngestJob:
+    """
+    One uploaded capture, from upload to load. Status goes received -> parsed -> loaded, or failed.
+    """
+    id: str
+    filename: str
+    path: str
+    bytes: int = 0
+    status: str = "received"
+    reviews: int = 0
+    error: str = None
+    received_at: float = field(default_factory=time.time)
+    parsed_at: float = None
+    loaded_at: float = None
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in
+                ("id", "filename", "bytes", "status", "reviews", "error", "received_at", "parsed_at", "loaded_at")}
+
+
+def load_reviews(batch: ReviewBatch):
+    # Imported here: load pulls in the BigQuery client, which starts with the first load
+    from load import upload_and_merge
+    upload_and_merge(batch)
+
+
+class IngestionService:
+    """
+    Parses uploaded captures on a process pool and coalesces their reviews into periodic loads.
+
+    The event loop only streams uploads to disk and hands paths to the pool, so uploads keep being
+    accepted while pages are parsed. Parsed reviews accumulate in a ReviewBatch that a background task
+    loads with `load` (by default load.upload_and_merge) in a thread, one load at a time since they
+    share the staging table. A failed load keeps its reviews for the next round. Captures stay in
+    upload_dir until their reviews are loaded, and are parsed again when the service restarts.
+    """
+
+    def __init__(self, upload_dir: str = UPLOAD_DIR, parse_workers: int = PARSE_WORKERS, backend: str = None,
+                 load=load_reviews, load_interval: float = LOAD_INTERVAL, load_batch_size: int = LOAD_BATCH_SIZE):
+        self.upload_dir = upload_dir
+        self.parse_workers = parse_workers
+        self.backend = backend
+        self.load = load
+        self.load_interval = load_interval
+        self.load_batch_size = load_batch_size
+        self.jobs = {}
+        self.latencies = {step: Histogram() for step in LATENCY_STEPS}
+        self.counters = {"uploads": 0, "bytes": 0, "parsed": 0, "parse_failures": 0, "reviews_parsed": 0,
+                         "loads": 0, "load_failures": 0, "reviews_loaded": 0}
+        self.started_at = time.time()
+        self._pending = ReviewBatch()
+        self._pending_jobs = []
+        self._executor = None
+        self._loader = None
+        self._load_now = None
+        self._load_lock = None
+        self._tasks = set()
+
+    async def start(self):
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self._executor = ProcessPoolExecutor(max_workers=self.parse_workers)
+        self._load_now = asyncio.Event()
+        self._load_lock = asyncio.Lock()
+        self._loader = asyncio.create_task(self._load_periodically())
+        for name in sorted(os.listdir(self.upload_dir)):
+            path = os.path.join(self.upload_dir, name)
+            if name.lower().endswith(CAPTURE_EXTENSIONS) and os.path.isfile(path):
+                # Left over by a previous run before its reviews were loaded
+                job_id, _, filename = name.partition("-")
+                self._submit(IngestJob(job_id, filename, path, os.path.getsize(path)))
+
+    async def stop(self):
+        """
+        Finish the parses in progress and load everything parsed before shutting down.
+        """
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._loader.cancel()
+        await asyncio.gather(self._loader, return_exceptions=True)
+        await self.flush()
+        self._executor.shutdown()
+
+    async def receive(self, filename: str, chunks) -> IngestJob:
+        """
+        Stream an uploaded capture to disk and queue it for parsing.
+
+        :param chunks: Async iterable of the bytes of the upload.
+        """
+        filename = os.path.basename(filename)
+        if not filename.lower().endswith(CAPTURE_EXTENSIONS):
+            raise ValueError(f"Expected a {'/'.join(CAPTURE_EXTENSIONS)} capture, got '{filename}'")
+        job_id = uuid.uuid4().hex
+        job = IngestJob(job_id, filename, os.path.join(self.upload_dir, f"{job_id}-{filename}"))
+        start = time.perf_counter()
+        try:
+            async with aiofiles.open(job.path, 'wb') as f:
+                async for chunk in chunks:
+                    job.bytes += len(chunk)
+                    if job.bytes > MAX_UPLOAD_BYTES:
+                        raise UploadTooLarge(f"Capture larger than {MAX_UPLOAD_BYTES} bytes")
+                    await f.write(chunk)
+        except BaseException:
+            # Nothing was written if the file could not be opened
+            with suppress(FileNotFoundError):
+                os.remove(job.path)
+            raise
+        self.latencies["upload"].observe(time.perf_counter() - start)
+        self.counters["uploads"] += 1
+        self.counters["bytes"] += job.bytes
+        self._submit(job)
+        return job
+
+    def _submit(self, job: IngestJob):
+        self.jobs[job.id] = job
+        task = asyncio.create_task(self._parse(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _parse(self, job: IngestJob):
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self._executor, parse_file, job.path, self.backend)
+        job.parsed_at = time.time()
+        self.latencies["parse"].observe(result.seconds)
+        if result.error:
+            job.status, job.error = "failed", result.error
+            self.counters["parse_failures"] += 1
+            logging.error(f"Failed to parse {job.filename} ({job.id}): {result.error}")
+            self._finish(job)
+            return
+        job.status, job.reviews = "parsed", len(result.reviews)
+        self.counters["parsed"] += 1
+        self.counters["reviews_parsed"] += job.reviews
+        self._pending.extend(result.reviews)
+        self._pending_jobs.append(job)
+        if len(self._pending) >= self.load_batch_size:
+            self._load_now.set()
+
+    async def _load_periodically(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._load_now.wait(), self.load_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._load_now.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """
+        Load the reviews parsed so far in one batch.
+
+        :return: The number of reviews loaded.
+        """
+        async with self._load_lock:
+            return await self._flush()
+
+    async def _flush(self) -> int:
+        if not self._pending_jobs:
+            return 0
+        batch, jobs = self._pending, self._pending_jobs
+        self._pending, self._pending_jobs = ReviewBatch(), []
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(self.load, batch)
+        except Exception as e:
+            self.counters["load_failures"] += 1
+            logging.error(f"Load of {len(batch)} reviews from {len(jobs)} captures failed, retrying later: {e}")
+            # Put them back in front of whatever was parsed meanwhile
+            batch.extend(self._pending.iter_dicts())
+            self._pending, self._pending_jobs = batch, jobs + self._pending_jobs
+            for job in jobs:
+                job.error = f"Load failed: {type(e).__name__}: {e}"
+            return 0
+        self.latencies["load"].observe(time.perf_counter() - start)
+        self.counters["loads"] += 1
+        self.counters["reviews_loaded"] += len(batch)
+        loaded_at = time.time()
+        for job in jobs:
+            job.status, job.loaded_at, job.error = "loaded", loaded_at, None
+            self.latencies["end_to_end"].observe(loaded_at - job.received_at)
+            self._finish(job)
+        logging.info(f"Loaded {len(batch)} reviews from {len(jobs)} captures in {time.perf_counter() - start:.2f}s")
+        return len(batch)
+
+    def _finish(self, job: IngestJob):
+        if os.path.exists(job.path):
+            os.remove(job.path)
+        if len(self.jobs) > MAX_FINISHED_JOBS:
+            # Forget the oldest finished jobs; jobs are kept in insertion order
+            finished = [job_id for job_id, old in self.jobs.items() if old.status in ("loaded", "failed")]
+            for job_id in finished[:len(self.jobs) - MAX_FINISHED_JOBS]:
+                del self.jobs[job_id]
+
+    def metrics(self) -> dict:
+        """
+        Counters, rates per second since start, queue depths and latency percentiles (seconds) of each step.
+        """
+        elapsed = time.time() - self.started_at
+        return {
+            "uptime": elapsed,
+            **self.counters,
+            "uploads_per_second": self.counters["uploads"] / elapsed if elapsed else 0,
+            "reviews_per_second": self.counters["reviews_parsed"] / elapsed if elapsed else 0,
+            "parsing": len(self._tasks),
+            "pending_reviews": len(self._pending),
+            "latency": {
+                step: {f"p{p}": histogram.quantile(p / 100) for p in (50, 95, 99)}
+                for step, histogram in self.latencies.items()
+            },
+        }
+
+
+service = IngestionService()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await service.start()
+    try:
+        yield
+    finally:
+        await service.stop()
+
+
+app = FastAPI(title="Review ingestion", lifespan=lifespan)
+
+
+@app.post("/captures/{filename}", status_code=202)
+async def upload_capture(filename: str, request: Request):
+    """
+    Upload a capture as the raw request body, e.g. `curl --data-binary @sample.html localhost:8000/captures/sample.html`.
+    The body is streamed to disk as it arrives, without being spooled in memory or a temporary file first.
+    """
+    try:
+        job = await service.receive(filename, request.stream())
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = service.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job.to_dict()
+
+
+@app.get("/jobs")
+async def list_jobs(status: str = None, limit: int = 100):
+    jobs = [job for job in reversed(service.jobs.values()) if status is None or job.status == status]
+    return [job.to_dict() for job in jobs[:limit]]
+
+
+@app.post("/flush")
+async def flush():
+    """
+    Load the reviews parsed so far without waiting for the next periodic load.
+    """
+    return {"reviews_loaded": await service.flush()}
+
+
+@app.get("/metrics")
+async def metrics():
+    return service.metrics()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO)
+    uvicorn.run(app, host=os.getenv("REVIEW_SERVICE_HOST", "127.0.0.1"), port=int(os.getenv("REVIEW_SERVICE_PORT", 8000)))
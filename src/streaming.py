@@ -0,0 +1,239 @@
+from html.parser import HTMLParser
+from transform import (
+    COUNTRY_BUTTON_CLASS, REVIEW_CONTAINER_CLASS, BRAND_DIV_CLASS, DATE_AND_AUTHOR_CLASS,
+    TITLE_DIV_CLASS, BODY_DIV_CLASS, STAR_RATING_CLASS, URL_LINK_CLASS,
+    country_code_from_text, parse_rating, build_review_data,
+)
+
+# Feed size used when a whole page source string is streamed through the parser.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Tags that never have children nor an end tag, as in BeautifulSoup's html.parser tree builder.
+VOID_ELEMENTS = frozenset({
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+    'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame',
+    'image', 'isindex', 'nextid', 'spacer',
+})
+
+# BeautifulSoup's get_text() skips strings under these tags.
+SKIPPED_TEXT_TAGS = frozenset({'template', 'script', 'style', 'rt', 'rp'})
+
+
+def _class_matches(classes, class_):
+    """
+    Reproduce BeautifulSoup's `class_` matching: multi-word values match the whole attribute,
+    single words match any of its classes.
+    """
+    if ' ' in class_:
+        return classes == class_.split()
+    return class_ in classes
+
+
+class _Node:
+    """
+    Minimal element of a captured subtree. Only lives until its review container has been extracted.
+    """
+    __slots__ = ('tag', 'attrs', 'classes', 'children')
+
+    def __init__(self, tag, attrs):
+        self.tag = tag
+        self.attrs = attrs
+        self.classes = (attrs.get('class') or '').split()
+        self.children = []
+
+    def iter_descendants(self):
+        for child in self.children:
+            if isinstance(child, _Node):
+                yield child
+                yield from child.iter_descendants()
+
+    def find_all(self, tag, class_=None):
+        return [
+            node for node in self.iter_descendants()
+            if node.tag == tag and (class_ is None or _class_matches(node.classes, class_))
+        ]
+
+    def find(self, tag, class_=None, has_attr=None):
+        for node in self.iter_descendants():
+            if node.tag == tag and (class_ is None or _class_matches(node.classes, class_)) \
+                    and (has_attr is None or has_attr in node.attrs):
+                return node
+        return None
+
+    def get_text(self):
+        """
+        Equivalent of BeautifulSoup's `tag.get_text(strip=True)`.
+        """
+        parts = []
+        self._collect_strings(parts)
+        return ''.join(stripped for stripped in (part.strip() for part in parts) if stripped)
+
+    def _collect_strings(self, parts):
+        for child in self.children:
+            if isinstance(child, _Node):
+                if child.tag not in SKIPPED_TEXT_TAGS:
+                    child._collect_strings(parts)
+            else:
+                parts.append(child)
+
+
+class ReviewStreamParser(HTMLParser):
+    """
+    Incremental (feed-style) review extractor.
+
+    Only the names of the currently open tags are kept for the document. Elements are materialised
+    just for the header country button and for the review container being read; each container's
+    subtree is turned into a ReviewData as soon as it closes, and then dropped.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.country_code = None
+        self._open_tags = []
+        self._capture = None  # (kind, root node, depth of the root in self._open_tags)
+        self._capture_stack = []
+        self._ready = []
+        self._continues_data = False
+
+    def pop_reviews(self):
+        """
+        Return the reviews extracted since the previous call.
+        """
+        reviews, self._ready = self._ready, []
+        return reviews
+
+    def handle_starttag(self, tag, attrs):
+        self._continues_data = False
+        attrs = {name: value if value is not None else '' for name, value in attrs}
+        if self._capture is None:
+            classes = (attrs.get('class') or '').split()
+            if tag == 'div' and _class_matches(classes, REVIEW_CONTAINER_CLASS):
+                self._start_capture('review', tag, attrs)
+            elif tag == 'button' and self.country_code is None and _class_matches(classes, COUNTRY_BUTTON_CLASS):
+                self._start_capture('country', tag, attrs)
+            elif tag not in VOID_ELEMENTS:
+                self._open_tags.append(tag)
+            return
+
+        node = _Node(tag, attrs)
+        self._capture_stack[-1].children.append(node)
+        if tag not in VOID_ELEMENTS:
+            self._open_tags.append(tag)
+            self._capture_stack.append(node)
+
+    def handle_startendtag(self, tag, attrs):
+        # <tag/> in HTML is a start tag; only void elements are really self-closing.
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        self._continues_data = False
+        if tag in VOID_ELEMENTS:
+            return
+        # Like BeautifulSoup, close the most recent open tag with this name (and everything
+        # opened after it). End tags without a matching open tag are ignored.
+        for index in range(len(self._open_tags) - 1, -1, -1):
+            if self._open_tags[index] == tag:
+                break
+        else:
+            return
+        del self._open_tags[index:]
+        if self._capture is None:
+            return
+        kind, root, root_depth = self._capture
+        if index <= root_depth:
+            self._finish_capture(kind, root)
+        else:
+            del self._capture_stack[index - root_depth:]
+
+    def handle_data(self, data):
+        if self._capture is not None:
+            children = self._capture_stack[-1].children
+            # Text split across feeds arrives in pieces; keep it as one string, like BeautifulSoup does.
+            if self._continues_data:
+                children[-1] += data
+            else:
+                children.append(data)
+            self._continues_data = True
+
+    def handle_comment(self, data):
+        self._continues_data = False
+
+    def handle_decl(self, decl):
+        self._continues_data = False
+
+    def handle_pi(self, data):
+        self._continues_data = False
+
+    def _start_capture(self, kind, tag, attrs):
+        root = _Node(tag, attrs)
+        self._capture = (kind, root, len(self._open_tags))
+        self._capture_stack = [root]
+        self._open_tags.append(tag)
+
+    def _finish_capture(self, kind, root):
+        self._capture = None
+        self._capture_stack = []
+        if kind == 'country':
+            self.country_code = country_code_from_text(root.get_text())
+        else:
+            self._ready.append(self._extract_review(root))
+
+    def _extract_review(self, review):
+        h5_tag = review.find('h5', has_attr='id')
+        asin = h5_tag.attrs['id'].split('-')[0]
+
+        brand = None
+        divs = review.find_all('div', class_=BRAND_DIV_CLASS)
+        if len(divs) >= 4:
+            brand = divs[3].find_all('div')[1].get_text()
+
+        review_date_and_author_span = review.find('span', class_=DATE_AND_AUTHOR_CLASS)
+        review_date_and_author = review_date_and_author_span.get_text() if review_date_and_author_span else None
+
+        title_div = review.find('div', class_=TITLE_DIV_CLASS)
+        title_b = title_div.find('b') if title_div else None
+        title = title_b.get_text() if title_b else None
+
+        body_div = review.find('div', class_=BODY_DIV_CLASS)
+        body = body_div.get_text() if body_div else None
+
+        star_rating = review.find('kat-star-rating', class_=STAR_RATING_CLASS)
+        rating_value = None
+        if star_rating and 'value' in star_rating.attrs:
+            rating_value = parse_rating(star_rating.attrs['value'])
+
+        url_link = review.find('kat-link', class_=URL_LINK_CLASS)
+        url = url_link.attrs.get('href') if url_link else None
+
+        return build_review_data(
+            self.country_code, asin, brand, review_date_and_author, title, body, rating_value, url
+        )
+
+
+def iter_reviews_html(html_chunks, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Yield ReviewData objects one by one, as soon as each review container closes.
+
+    :param html_chunks: A page source string, or any iterable of string chunks (e.g. a file being read).
+    :param chunk_size: Feed size used when html_chunks is a single string.
+    :return: A generator of ReviewData, in document order.
+    """
+    if isinstance(html_chunks, str):
+        html_content = html_chunks
+        html_chunks = (html_content[i:i + chunk_size] for i in range(0, len(html_content), chunk_size))
+    parser = ReviewStreamParser()
+    for chunk in html_chunks:
+        parser.feed(chunk)
+        yield from parser.pop_reviews()
+    parser.close()
+    yield from parser.pop_reviews()
+
+
+def iter_reviews_from_file(filename: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Stream the reviews of a saved .html page without loading the whole file in memory.
+    """
+    with open(filename, 'r', encoding='utf-8', errors='replace') as f:
+        yield from iter_reviews_html(iter(lambda: f.read(chunk_size), ''), chunk_size)
@@ -0,0 +1,341 @@
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+import atexit
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+
+# With REVIEW_TELEMETRY=<file>, spans, histograms and counters are recorded and exported to that file when the run ends:
+# Prometheus text format for .prom/.txt files, JSON otherwise (loadable in chrome://tracing or ui.perfetto.dev).
+TELEMETRY_FILE = os.getenv("REVIEW_TELEMETRY", "")
+# With REVIEW_PROFILE=1 (and telemetry on), the code in profiled() blocks, i.e. the parse hot path, is sampled
+PROFILE = os.getenv("REVIEW_PROFILE", "0") == "1"
+PROFILE_INTERVAL = 0.005
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, math.inf)
+# Spans kept for the trace; histograms keep counting past it
+MAX_SPANS = 100000
+METRIC_PREFIX = "review_"
+
+_current_span = ContextVar("current_span", default=None)
+
+
+class Histogram:
+    """
+    Count of observations per bucket, with their sum, min and max. Quantiles are interpolated within buckets.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = min(self.buckets[index], self.max)
+                lower = max(lower, self.min)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    def to_dict(self):
+        return {"count": self.count, "sum": self.sum, "min": self.min if self.count else None,
+                "max": self.max if self.count else None, "p50": self.quantile(0.5), "p95": self.quantile(0.95),
+                "p99": self.quantile(0.99)}
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the threads inside profiled() blocks every `interval` seconds from a background thread,
+    and counts them as folded stacks ("module:function;module:function ..."), the input of flame graph tools.
+    Only the current process is sampled: code running in process pools is not seen.
+    The sampler thread runs until stop(); read the samples with snapshot() while it may be running.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = {}
+        self._threads = Counter()
+        self._names = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = None
+
+    @contextmanager
+    def profiled(self, name: str):
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._threads[thread_id] += 1
+            self._names.setdefault(thread_id, name)
+            if self._thread is None:
+                self._stop = threading.Event()
+                self._thread = threading.Thread(target=self._run, args=(self._stop,), name="sampling-profiler",
+                                                daemon=True)
+                self._thread.start()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._threads[thread_id] -= 1
+                if not self._threads[thread_id]:
+                    del self._threads[thread_id]
+                    del self._names[thread_id]
+
+    def _run(self, stop: threading.Event):
+        while not stop.wait(self.interval):
+            with self._lock:
+                targets = dict(self._names)
+            if not targets:
+                continue
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id, name in targets.items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    stacks.append((name, ";".join(reversed(stack))))
+            with self._lock:
+                for name, stack in stacks:
+                    self.samples.setdefault(name, Counter())[stack] += 1
+
+    def stop(self):
+        """
+        Stop the sampler thread and wait for it. A later profiled() block starts it again.
+        """
+        with self._lock:
+            thread, stop = self._thread, self._stop
+            self._thread = self._stop = None
+        if thread is not None:
+            stop.set()
+            thread.join()
+
+    def snapshot(self) -> dict:
+        """
+        A copy of the samples, name -> Counter of folded stacks.
+        """
+        with self._lock:
+            return {name: Counter(counts) for name, counts in self.samples.items()}
+
+    def folded(self) -> str:
+        return "".join(
+            f"{name};{stack} {count}\n"
+            for name, counts in self.snapshot().items() for stack, count in counts.most_common()
+        )
+
+
+class Telemetry:
+    """
+    Spans, histograms and counters labelled by marketplace, page, stage... Disabled, every call returns right away.
+
+    A span times a block: its duration goes to the histogram of its name and labels, and the span itself to the
+    trace (nested spans keep their parent). Keep labels low-cardinality (marketplace, stage); per-span details
+    such as page numbers go in `attributes`, which only the trace records. Thread safe.
+    """
+
+    def __init__(self, enabled: bool = True, profile: bool = False, max_spans: int = MAX_SPANS):
+        self.enabled = enabled
+        self.max_spans = max_spans
+        self.profiler = SamplingProfiler() if enabled and profile else None
+        if self.profiler is not None:
+            atexit.register(self.profiler.stop)
+        self.counters = Counter()
+        self.histograms = {}
+        self.spans = []
+        self.dropped_spans = 0
+        self._lock = threading.Lock()
+        self._next_span_id = 0
+        self._origin = time.perf_counter()
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] += amount
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        Add a duration, in seconds, to a histogram.
+        """
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, name: str, attributes: dict = None, **labels):
+        if not self.enabled:
+            yield
+            return
+        with self._lock:
+            self._next_span_id += 1
+            span_id = self._next_span_id
+        parent = _current_span.get()
+        token = _current_span.set(span_id)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            _current_span.reset(token)
+            self.observe(name, seconds, **labels)
+            with self._lock:
+                if len(self.spans) < self.max_spans:
+                    self.spans.append((span_id, parent, name, {**labels, **(attributes or {})}, start, seconds,
+                                       threading.get_ident()))
+                else:
+                    self.dropped_spans += 1
+
+    def profiled(self, name: str):
+        """
+        Sample the stacks of the block when profiling is on. Meant for hot paths, e.g. parsing.
+        """
+        if self.profiler is None:
+            return _NO_PROFILE
+        return self.profiler.profiled(name)
+
+    def to_dict(self):
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            histograms = [{"name": name, "labels": dict(labels), **histogram.to_dict()}
+                          for (name, labels), histogram in sorted(self.histograms.items())]
+            trace = [
+                {"name": name, "ph": "X", "pid": os.getpid(), "tid": thread_id,
+                 "ts": (start - self._origin) * 1e6, "dur": seconds * 1e6,
+                 "args": {**labels, "id": span_id, "parent": parent}}
+                for span_id, parent, name, labels, start, seconds, thread_id in self.spans
+            ]
+        result = {"counters": counters, "histograms": histograms, "traceEvents": trace,
+                  "dropped_spans": self.dropped_spans}
+        if self.profiler is not None:
+            result["profile"] = {name: dict(counts.most_common()) for name, counts in self.profiler.snapshot().items()}
+        return result
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name}_total counter")
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{METRIC_PREFIX}{name}_total{_prometheus_labels(labels)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                metric = f"{METRIC_PREFIX}{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for (histogram_name, labels), histogram in sorted(self.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else repr(bound)
+                        lines.append(f"{metric}_bucket{_prometheus_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{metric}_sum{_prometheus_labels(labels)} {histogram.sum}")
+                    lines.append(f"{metric}_count{_prometheus_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, filename: str):
+        """
+        Write everything recorded so far, as Prometheus text (.prom or .txt) or JSON. Profiles also go to
+        <filename>.folded, once the profiler has been stopped.
+        """
+        if self.profiler is not None:
+            self.profiler.stop()
+        if filename.endswith((".prom", ".txt")):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), default=str)
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(content)
+        if self.profiler is not None and self.profiler.snapshot():
+            with open(f"{filename}.folded", 'w', encoding='utf-8') as f:
+                f.write(self.profiler.folded())
+        logging.info(f"Telemetry exported to {filename}")
+
+
+_NO_PROFILE = nullcontext()
+
+
+def _label_key(labels: dict) -> tuple:
+    # Label values are kept as strings so that keys stay sortable, e.g. country=None next to country="ES"
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _prometheus_labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+_telemetry = None
+
+
+def get_telemetry() -> Telemetry:
+    """
+    The Telemetry shared by the module-level functions, enabled when REVIEW_TELEMETRY is set.
+    """
+    global _telemetry
+    if _telemetry is None:
+        _telemetry = Telemetry(enabled=bool(TELEMETRY_FILE), profile=PROFILE)
+    return _telemetry
+
+
+def span(name: str, attributes: dict = None, **labels):
+    return get_telemetry().span(name, attributes, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    get_telemetry().observe(name, value, **labels)
+
+
+def increment(name: str, amount: float = 1, **labels):
+    get_telemetry().increment(name, amount, **labels)
+
+
+def profiled(name: str):
+    return get_telemetry().profiled(name)
+
+
+def export(filename: str = None):
+    """
+    Export the shared Telemetry to `filename`, by default REVIEW_TELEMETRY, if it is enabled.
+    """
+    telemetry = get_telemetry()
+    filename = filename or TELEMETRY_FILE
+    if telemetry.enabled and filename:
+        telemetry.export(filename)
@@ -1,10 +1,18 @@
 from datetime import datetime, date
 from review import ReviewData, generate_review_id
-from bs4 import BeautifulSoup
+from telemetry import get_telemetry, span, profiled
 import email
+from functools import lru_cache
 from email.policy import default
 import logging
+import os
 import re
+import time
+
+try:
+    from lxml import etree as lxml_etree, html as lxml_html
+except ImportError:
+    lxml_etree = lxml_html = None
 
 
 
@@ -25,56 +33,87 @@ def convert_datetime_to_string(data):
         return data
     
 
+# Month names of the marketplace languages, in month order. Polish dates use the genitive ("14 października").
+MONTH_NAMES = {
+    'en': ('january', 'february', 'march', 'april', 'may', 'june', 'july', 'august', 'september', 'october',
+           'november', 'december'),
+    'es': ('enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 'julio', 'agosto', 'septiembre', 'octubre',
+           'noviembre', 'diciembre'),
+    'fr': ('janvier', 'février', 'mars', 'avril', 'mai', 'juin', 'juillet', 'août', 'septembre', 'octobre',
+           'novembre', 'décembre'),
+    'de': ('januar', 'februar', 'märz', 'april', 'mai', 'juni', 'juli', 'august', 'september', 'oktober',
+           'november', 'dezember'),
+    'nl': ('januari', 'februari', 'maart', 'april', 'mei', 'juni', 'juli', 'augustus', 'september', 'oktober',
+           'november', 'december'),
+    'it': ('gennaio', 'febbraio', 'marzo', 'aprile', 'maggio', 'giugno', 'luglio', 'agosto', 'settembre', 'ottobre',
+           'novembre', 'dicembre'),
+    'sv': ('januari', 'februari', 'mars', 'april', 'maj', 'juni', 'juli', 'augusti', 'september', 'oktober',
+           'november', 'december'),
+    'pl': ('stycznia', 'lutego', 'marca', 'kwietnia', 'maja', 'czerwca', 'lipca', 'sierpnia', 'września',
+           'października', 'listopada', 'grudnia'),
+}
+
+
+def _build_month_table(month_names):
+    """
+    Merge the month names of all languages into one name -> month number table, adding the 3 and 4 letter
+    abbreviations ("oct", "sept", "okt") that do not map to different months in different languages.
+    """
+    months = {}
+    abbreviations = {}
+    for names in month_names.values():
+        for month, name in enumerate(names, start=1):
+            months[name] = month
+            for length in (3, 4):
+                abbreviations.setdefault(name[:length], set()).add(month)
+    for abbreviation, candidates in abbreviations.items():
+        if len(candidates) == 1 and abbreviation not in months:
+            months[abbreviation] = candidates.pop()
+    return months
+
+
+MONTHS = _build_month_table(MONTH_NAMES)
+
+# "Review by {author} on {date}" in every marketplace language, e.g. "Revisado por {author} el 14 de octubre de 2024",
+# "Rezension von {author} am 14. Oktober 2024" or "Review by {author} on October 14, 2024".
+# The author is whatever lies between the "by" word (after one to three leading words) and the connector right before
+# the date. Matching word by word rather than character by character keeps backtracking short.
+_AUTHOR_PREFIX = r"(?:by|por|de|par|von|door|di|da|av|od|przez)"
+_DATE_CONNECTOR = r"(?:on|el|le|am|il|op|den|dnia|w\s+dniu)"
+_DATE_AND_AUTHOR_PATTERN = re.compile(
+    rf"^\S+\s+(?:\S+\s+){{0,2}}?{_AUTHOR_PREFIX}\s+(?P<author>\S+(?:\s+\S+)*?)\s+{_DATE_CONNECTOR}\s+"
+    r"(?:(?P<day>\d{1,2})\.?\s+(?:de\s+)?(?P<month>[^\W\d_]+)\.?"
+    r"|(?P<month_first>[^\W\d_]+)\.?\s+(?P<day_second>\d{1,2}),?)"
+    r"\s+(?:de\s+)?(?P<year>\d{4})$",
+    re.IGNORECASE,
+)
+
+
+@lru_cache(maxsize=4096)
 def parse_review_date_and_author(review_date_and_author: str):
     """
-    Parse the author name and review date from the given string.
+    Parse the author name and review date from the given string, in any of the marketplace languages.
+    Any run of whitespace, including the line breaks of the page source, separates words.
+    Results are cached, since the same strings come back on every re-scrape.
     
     :param review_date_and_author: The string containing the author and date.
-    :return: A tuple containing the author name and review date.
+    :return: A tuple containing the review date and the author name, or (None, None) if it cannot be parsed.
     """
     if review_date_and_author == None:
         return None, None
-    # Regular expression to match the pattern "Review by {author} on {date_string}"
-    pattern = r"Review by (.+?) on (\d{1,2} \w+ \d{4})"
-    match = re.match(pattern, review_date_and_author)
+    match = _DATE_AND_AUTHOR_PATTERN.match(review_date_and_author.strip())
     
     if not match:
-        logging.warning(f"data + author string : {review_date_and_author} does not match the expected format. Did you change the website language to ENGLISH??")
+        logging.warning(f"data + author string : {review_date_and_author} does not match the expected format of any marketplace language.")
         return None, None
     
-    author = match.group(1).strip()
-    date_string = match.group(2).strip()
-    
-    # Mapping English month names to month numbers
-    english_months = {
-        'january': 1,
-        'february': 2,
-        'march': 3,
-        'april': 4,
-        'may': 5,
-        'june': 6,
-        'july': 7,
-        'august': 8,
-        'september': 9,
-        'october': 10,
-        'november': 11,
-        'december': 12
-    }
-
-    # Parse the date string
-    parts = date_string.split(' ')
-    if len(parts) != 3:
-        logging.warning(f"date string \'{date_string}\' does not have three parts separated by a whitespace: .")
-    
+    author = ' '.join(match.group('author').split())
+    month_name = match.group('month') or match.group('month_first')
+    month = MONTHS.get(month_name.lower())
     try:
-        day = int(parts[0])
-        month_name = parts[1].lower()
-        month = english_months.get(month_name)
         if not month:
             raise ValueError(f"Invalid month name: {month_name}")
-        year = int(parts[2])
-        review_datetime = datetime(year, month, day)
-        review_date = review_datetime.date()
+        review_date = date(int(match.group('year')), month, int(match.group('day') or match.group('day_second')))
     except ValueError as e:
         logging.error(f"Error parsing date: {e}")
         return None, None
@@ -82,7 +121,7 @@ def parse_review_date_and_author(review_date_and_author: str):
     return review_date, author
 
 
-def parse_mhtml(contents: bytes):
+def parse_mhtml(contents: bytes, backend: str = None):
     """
     Parse .mhtml contents and extract data from the <div class="reviewContainer css-1d1jdxb eihx8d30"> elements.
     """
@@ -98,42 +137,124 @@ def parse_mhtml(contents: bytes):
 
     if not html_content:
         raise ValueError("No HTML content found in the .mhtml file.")
-    return parse_html(html_content)
+    return parse_html(html_content, backend)
+
+# Bump whenever a change to the parsing rules alters the extracted ReviewData, to invalidate cached parses.
+PARSER_VERSION = "3"
+
+# Header button text -> country code, in every language of the Seller Central UI whose review dates we parse
+# (EN, ES, FR, DE, IT, NL, SV, PL), so that the country is known even if switching to English failed.
+# Names already listed for a previous language (e.g. Italian 'Italia') are not repeated.
+COUNTRY_CODE_MAPPING = {
+    # English
+    'Spain': 'ES', 'United Kingdom': 'UK', 'France': 'FR', 'Germany': 'DE',
+    'Netherlands': 'NL', 'Italy': 'IT', 'Sweden': 'SE', 'Poland': 'PL',
+    # Spanish
+    'España': 'ES', 'Reino Unido': 'UK', 'Francia': 'FR', 'Alemania': 'DE',
+    'Países Bajos': 'NL', 'Italia': 'IT', 'Suecia': 'SE', 'Polonia': 'PL',
+    # French
+    'Espagne': 'ES', 'Royaume-Uni': 'UK', 'Allemagne': 'DE',
+    'Pays-Bas': 'NL', 'Italie': 'IT', 'Suède': 'SE', 'Pologne': 'PL',
+    # German
+    'Spanien': 'ES', 'Vereinigtes Königreich': 'UK', 'Frankreich': 'FR', 'Deutschland': 'DE',
+    'Niederlande': 'NL', 'Italien': 'IT', 'Schweden': 'SE', 'Polen': 'PL',
+    # Italian
+    'Spagna': 'ES', 'Regno Unito': 'UK', 'Germania': 'DE',
+    'Paesi Bassi': 'NL', 'Svezia': 'SE',
+    # Dutch
+    'Spanje': 'ES', 'Verenigd Koninkrijk': 'UK', 'Frankrijk': 'FR', 'Duitsland': 'DE',
+    'Nederland': 'NL', 'Italië': 'IT', 'Zweden': 'SE',
+    # Swedish
+    'Storbritannien': 'UK', 'Frankrike': 'FR', 'Tyskland': 'DE',
+    'Nederländerna': 'NL', 'Sverige': 'SE',
+    # Polish
+    'Hiszpania': 'ES', 'Wielka Brytania': 'UK', 'Francja': 'FR', 'Niemcy': 'DE',
+    'Holandia': 'NL', 'Włochy': 'IT', 'Szwecja': 'SE', 'Polska': 'PL',
+}
+
+# Class attributes of the review elements, as matched by BeautifulSoup's `class_` argument.
+# Multi-word values must match the whole class attribute, single words any of its classes.
+COUNTRY_BUTTON_CLASS = 'partner-dropdown-button'
+REVIEW_CONTAINER_CLASS = 'reviewContainer css-1d1jdxb eihx8d30'
+BRAND_DIV_CLASS = 'css-yyccc7 e1d0wyfb3'
+DATE_AND_AUTHOR_CLASS = 'css-g7g1lz'
+TITLE_DIV_CLASS = 'css-bf47do eihx8d31'
+BODY_DIV_CLASS = 'css-tks6au eihx8d34'
+STAR_RATING_CLASS = 'reviewRating'
+URL_LINK_CLASS = 'css-1sowyjy'
 
-def parse_html(html_content: str):
+
+def country_code_from_text(country_text: str):
     """
-    Parse the HTML content and extract review data from the <div class="reviewContainer css-1d1jdxb eihx8d30"> elements.
+    Map the partner dropdown button text to a country code.
+
+    :param country_text: The stripped button text, formatted as "<b>Brand</b> | Country".
+    :return: The country code, or None if the country is unknown.
+    """
+    country_string = country_text.split('|')[-1].strip()
+    return COUNTRY_CODE_MAPPING.get(country_string)
+
+
+def parse_rating(value):
+    """
+    Convert the `value` attribute of a <kat-star-rating> tag to an int, or None if it is not a number.
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def build_review_data(country_code, asin, brand, review_date_and_author, title, body, rating_value, url):
+    """
+    Build a ReviewData from the raw fields extracted from a review container.
+    Shared by every parser backend, so that all of them produce identical output.
     """
+    review_date, author = parse_review_date_and_author(review_date_and_author)
+    telemetry = get_telemetry()
+    if telemetry.enabled:
+        telemetry.increment("reviews_parsed", country=country_code)
+        if review_date is None:
+            telemetry.increment("date_author_misses", country=country_code)
+        start = time.perf_counter()
+    review = ReviewData(
+        review_id=generate_review_id(author, title, review_date),
+        country=country_code,
+        asin=asin,
+        brand=brand,
+        review_date=review_date,
+        author=author,
+        verified=None,
+        helpful=None,
+        title=title,
+        body=body,
+        rating=rating_value,
+        url=url,
+        scraped_on=date.today()
+    )
+    if telemetry.enabled:
+        telemetry.observe("review_validation", time.perf_counter() - start)
+    return review
+
+
+def _parse_html_bs4(html_content: str):
+    """
+    Reference parser backend: builds a full BeautifulSoup tree with python's 'html.parser'.
+    """
+    # Imported here: the lxml backend and the rest of the module do not need bs4
+    from bs4 import BeautifulSoup
+
     # Parse the HTML content with BeautifulSoup
     soup = BeautifulSoup(html_content, 'html.parser')
     
     # Retrieve the country from the header button
-    country_button = soup.find('button', class_='partner-dropdown-button')
+    country_button = soup.find('button', class_=COUNTRY_BUTTON_CLASS)
     country_code = None
     if country_button:
-        country_text = country_button.get_text(strip=True)
-        # Assuming the format is "<b>Brand</b> | Country"
-        country_string = country_text.split('|')[-1].strip()
-        # We also support spanish language, just in case.
-        country_code_mapping = {
-            'España': 'ES',
-            'Italia': 'IT',
-            'Francia': 'FR',
-            'Alemania': 'DE',
-            'Reino Unido': 'UK',
-            'Países Bajos': 'NL',
-            'Spain': 'ES',
-            'Italy': 'IT',
-            'France': 'FR',
-            'Germany': 'DE',
-            'United Kingdom': 'UK',
-            'Netherlands': 'NL',
-        }
-
-        country_code = country_code_mapping.get(country_string)
+        country_code = country_code_from_text(country_button.get_text(strip=True))
 
     # Find all review containers
-    reviews = soup.find_all('div', class_='reviewContainer css-1d1jdxb eihx8d30')
+    reviews = soup.find_all('div', class_=REVIEW_CONTAINER_CLASS)
     
     # Extract relevant information from each review container
     extracted_reviews = []
@@ -147,7 +268,7 @@ def parse_html(html_content: str):
         # Extract Brand from the list of four divs next to the picture, nanely,
         # Parent ASIn, Child ASIN, Product's star rating, and *Brand*
         brand = None
-        divs = review.find_all('div', class_='css-yyccc7 e1d0wyfb3')
+        divs = review.find_all('div', class_=BRAND_DIV_CLASS)
         if len(divs) >= 4:
             # Get the fourth div and its second child div
             brand_div = divs[3].find_all('div')[1]
@@ -155,50 +276,154 @@ def parse_html(html_content: str):
 
 
         # Extract Review date and author (from the div with class 'css-g7g1lz')
-        review_date_and_author_div = review.find('span', class_='css-g7g1lz')
+        review_date_and_author_div = review.find('span', class_=DATE_AND_AUTHOR_CLASS)
         review_date_and_author = review_date_and_author_div.get_text(strip=True) if review_date_and_author_div else None
-        review_date, author = parse_review_date_and_author(review_date_and_author)
 
         # Extract Title (content inside <b> tag inside div with class 'css-bf47do eihx8d31')
-        title_div = review.find('div', class_='css-bf47do eihx8d31')
+        title_div = review.find('div', class_=TITLE_DIV_CLASS)
         title = title_div.find('b').get_text(strip=True) if title_div and title_div.find('b') else None
         
         # Extract Body (content inside div with class 'css-tks6au eihx8d34')
-        body_div = review.find('div', class_='css-tks6au eihx8d34')
+        body_div = review.find('div', class_=BODY_DIV_CLASS)
         body = body_div.get_text(strip=True) if body_div else None
         
         # Extract Rating
-        star_rating = review.find('kat-star-rating', class_='reviewRating')
+        star_rating = review.find('kat-star-rating', class_=STAR_RATING_CLASS)
         rating_value = None
         if star_rating and star_rating.has_attr('value'):
-            try:
-                rating_value = int(star_rating['value'])
-            except ValueError:
-                rating_value = None
+            rating_value = parse_rating(star_rating['value'])
 
         # Extract URL
-        url_div = review.find('kat-link', class_='css-1sowyjy')
+        url_div = review.find('kat-link', class_=URL_LINK_CLASS)
         url = url_div['href'] if url_div and url_div.has_attr('href') else None
 
-        # Set scraped_on date
-        scraped_on = date.today()
-
-        # Set scraped_on date
-        review_data = ReviewData(
-            review_id=generate_review_id(author, title, review_date),
-            country=country_code,
-            asin=asin,
-            brand=brand,
-            review_date=review_date,
-            author=author,
-            verified=None,
-            helpful=None,
-            title=title,
-            body=body,
-            rating=rating_value,
-            url=url,
-            scraped_on=scraped_on
-        )
-        extracted_reviews.append(review_data)
+        extracted_reviews.append(build_review_data(
+            country_code, asin, brand, review_date_and_author, title, body, rating_value, url
+        ))
     
     return extracted_reviews
+
+
+def _xpath_class_predicate(class_):
+    """
+    XPath predicate reproducing BeautifulSoup's `class_` matching for the given value.
+    """
+    if ' ' in class_:
+        return f"normalize-space(@class)='{class_}'"
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {class_} ')"
+
+
+if lxml_etree is not None:
+    # Parsing from utf-8 bytes avoids lxml's complaints about encoding declarations in str input.
+    # Comments are dropped at parse time, since BeautifulSoup's get_text() ignores them anyway.
+    _LXML_PARSER = lxml_html.HTMLParser(encoding='utf-8', remove_comments=True, remove_pis=True)
+    _XPATH_COUNTRY_BUTTON = lxml_etree.XPath(f"(//button[{_xpath_class_predicate(COUNTRY_BUTTON_CLASS)}])[1]")
+    _XPATH_REVIEW_CONTAINERS = lxml_etree.XPath(f"//div[{_xpath_class_predicate(REVIEW_CONTAINER_CLASS)}]")
+    _XPATH_ASIN_H5 = lxml_etree.XPath("(.//h5[@id])[1]")
+    _XPATH_BRAND_DIVS = lxml_etree.XPath(f".//div[{_xpath_class_predicate(BRAND_DIV_CLASS)}]")
+    _XPATH_DIVS = lxml_etree.XPath(".//div")
+    _XPATH_DATE_AND_AUTHOR = lxml_etree.XPath(f"(.//span[{_xpath_class_predicate(DATE_AND_AUTHOR_CLASS)}])[1]")
+    _XPATH_TITLE_DIV = lxml_etree.XPath(f"(.//div[{_xpath_class_predicate(TITLE_DIV_CLASS)}])[1]")
+    _XPATH_B = lxml_etree.XPath("(.//b)[1]")
+    _XPATH_BODY_DIV = lxml_etree.XPath(f"(.//div[{_xpath_class_predicate(BODY_DIV_CLASS)}])[1]")
+    _XPATH_STAR_RATING = lxml_etree.XPath(f"(.//kat-star-rating[{_xpath_class_predicate(STAR_RATING_CLASS)}])[1]")
+    _XPATH_URL_LINK = lxml_etree.XPath(f"(.//kat-link[{_xpath_class_predicate(URL_LINK_CLASS)}])[1]")
+
+# BeautifulSoup stores strings under these tags with special string classes, which get_text() skips.
+_SKIPPED_TEXT_TAGS = frozenset({'template', 'script', 'style', 'rt', 'rp'})
+
+
+def _lxml_get_text(element):
+    """
+    Equivalent of BeautifulSoup's `tag.get_text(strip=True)` for an lxml element.
+    """
+    parts = []
+
+    def collect(el):
+        if el.text:
+            parts.append(el.text)
+        for child in el:
+            if child.tag not in _SKIPPED_TEXT_TAGS:
+                collect(child)
+            if child.tail:
+                parts.append(child.tail)
+
+    collect(element)
+    return ''.join(stripped for stripped in (part.strip() for part in parts) if stripped)
+
+
+def _first(xpath, element):
+    matches = xpath(element)
+    return matches[0] if matches else None
+
+
+def _parse_html_lxml(html_content: str):
+    """
+    Fast parser backend: libxml2 builds the tree in C and every lookup is a precompiled XPath.
+    Produces the same ReviewData as the 'bs4' backend.
+    """
+    if lxml_etree is None:
+        raise ImportError("The 'lxml' parser backend requires the lxml package: pip install lxml")
+    root = lxml_html.fromstring(html_content.encode('utf-8'), parser=_LXML_PARSER)
+
+    country_button = _first(_XPATH_COUNTRY_BUTTON, root)
+    country_code = None
+    if country_button is not None:
+        country_code = country_code_from_text(_lxml_get_text(country_button))
+
+    extracted_reviews = []
+    for review in _XPATH_REVIEW_CONTAINERS(root):
+        asin = _first(_XPATH_ASIN_H5, review).get('id').split('-')[0]
+
+        brand = None
+        divs = _XPATH_BRAND_DIVS(review)
+        if len(divs) >= 4:
+            brand = _lxml_get_text(_XPATH_DIVS(divs[3])[1])
+
+        review_date_and_author_span = _first(_XPATH_DATE_AND_AUTHOR, review)
+        review_date_and_author = _lxml_get_text(review_date_and_author_span) if review_date_and_author_span is not None else None
+
+        title_div = _first(_XPATH_TITLE_DIV, review)
+        title_b = _first(_XPATH_B, title_div) if title_div is not None else None
+        title = _lxml_get_text(title_b) if title_b is not None else None
+
+        body_div = _first(_XPATH_BODY_DIV, review)
+        body = _lxml_get_text(body_div) if body_div is not None else None
+
+        star_rating = _first(_XPATH_STAR_RATING, review)
+        rating_value = None
+        if star_rating is not None and 'value' in star_rating.attrib:
+            rating_value = parse_rating(star_rating.get('value'))
+
+        url_link = _first(_XPATH_URL_LINK, review)
+        url = url_link.get('href') if url_link is not None else None
+
+        extracted_reviews.append(build_review_data(
+            country_code, asin, brand, review_date_and_author, title, body, rating_value, url
+        ))
+
+    return extracted_reviews
+
+
+PARSER_BACKENDS = {
+    'bs4': _parse_html_bs4,
+    'lxml': _parse_html_lxml,
+}
+
+# The backend can be switched per call, or globally with the REVIEW_PARSER_BACKEND environment variable.
+DEFAULT_PARSER_BACKEND = os.getenv("REVIEW_PARSER_BACKEND", "bs4")
+
+
+def parse_html(html_content: str, backend: str = None):
+    """
+    Parse the HTML content and extract review data from the <div class="reviewContainer css-1d1jdxb eihx8d30"> elements.
+
+    :param html_content: The page source.
+    :param backend: One of PARSER_BACKENDS ('bs4' or 'lxml'). Defaults to DEFAULT_PARSER_BACKEND.
+    :return: A list of ReviewData.
+    """
+    backend = backend or DEFAULT_PARSER_BACKEND
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown parser backend '{backend}'. Choose one of {list(PARSER_BACKENDS)}.")
+    with span("parse_html", backend=backend), profiled("parse_html"):
+        return PARSER_BACKENDS[backend](html_content)
@@ -0,0 +1,234 @@
+from datetime import date
+import json
+import logging
+import sqlite3
+import time
+from columnar import ReviewBatch, COLUMNS
+from review import ReviewData, SCHEMA_FILE, CONTENT_COLUMNS
+
+DEFAULT_WAREHOUSE_FILE = "reviews.sqlite"
+DEFAULT_UPSERT_BATCH = 10000
+# Page cache per connection, in KiB (negative values are KiB for SQLite)
+CACHE_SIZE_KIB = 64 * 1024
+
+_SQLITE_TYPES = {"STRING": "TEXT", "DATE": "TEXT", "BOOLEAN": "INTEGER", "INTEGER": "INTEGER"}
+# Columns compared to decide whether a stored review is rewritten: the content columns, plus verified and helpful,
+# which the upsert updates too (the BigQuery MERGE only sets them on insert)
+UPSERT_COMPARED_COLUMNS = CONTENT_COLUMNS + ("verified", "helpful")
+
+
+def build_schema(schema_file: str = SCHEMA_FILE) -> str:
+    """
+    DDL of the reviews table, following the BigQuery schema of resources/schema.json with review_id as primary key,
+    its indexes, and the full-text index on title and body (kept in sync by triggers).
+    Dates are stored as ISO strings, which sort like dates, and booleans as 0/1.
+    """
+    with open(schema_file, 'r', encoding='utf-8') as f:
+        fields = json.load(f)
+    columns = ",\n    ".join(
+        f"{field['name']} {_SQLITE_TYPES[field['type']]}" + (" NOT NULL" if field.get("mode") == "REQUIRED" else "")
+        for field in fields
+    )
+    return f"""
+CREATE TABLE IF NOT EXISTS reviews (
+    review_id TEXT PRIMARY KEY,
+    {columns}
+);
+CREATE INDEX IF NOT EXISTS reviews_country_asin_date ON reviews (country, asin, review_date);
+CREATE INDEX IF NOT EXISTS reviews_rating ON reviews (rating, review_date);
+CREATE VIRTUAL TABLE IF NOT EXISTS reviews_fts USING fts5(
+    title, body, content='reviews', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS reviews_fts_insert AFTER INSERT ON reviews BEGIN
+    INSERT INTO reviews_fts (rowid, title, body) VALUES (new.rowid, new.title, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS reviews_fts_delete AFTER DELETE ON reviews BEGIN
+    INSERT INTO reviews_fts (reviews_fts, rowid, title, body) VALUES ('delete', old.rowid, old.title, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS reviews_fts_update AFTER UPDATE OF title, body ON reviews BEGIN
+    INSERT INTO reviews_fts (reviews_fts, rowid, title, body) VALUES ('delete', old.rowid, old.title, old.body);
+    INSERT INTO reviews_fts (rowid, title, body) VALUES (new.rowid, new.title, new.body);
+END;
+"""
+
+
+# The most recently scraped version of a review wins, and unchanged rows are not rewritten,
+# like the incremental MERGE into the BigQuery table (load.build_incremental_merge_query)
+UPSERT_QUERY = f"""
+INSERT INTO reviews ({", ".join(COLUMNS)}) VALUES ({", ".join("?" for _ in COLUMNS)})
+ON CONFLICT (review_id) DO UPDATE SET {", ".join(f"{name} = excluded.{name}" for name in COLUMNS[1:])}
+WHERE coalesce(excluded.scraped_on, '') >= coalesce(reviews.scraped_on, '')
+  AND ({" OR ".join(f"excluded.{name} IS NOT reviews.{name}" for name in UPSERT_COMPARED_COLUMNS)})
+"""
+
+
+def _iter_rows(reviews):
+    """
+    Yield the reviews (ReviewData, dicts, or a ReviewBatch) as tuples of SQLite values in COLUMNS order.
+    """
+    if isinstance(reviews, ReviewBatch):
+        columns = [reviews.column(name) for name in COLUMNS]
+        rows = zip(*columns)
+    else:
+        rows = (
+            tuple(review.get(name) for name in COLUMNS) if isinstance(review, dict)
+            else tuple(getattr(review, name) for name in COLUMNS)
+            for review in reviews
+        )
+    for row in rows:
+        yield tuple(
+            value.isoformat() if isinstance(value, date) else int(value) if isinstance(value, bool) else value
+            for value in row
+        )
+
+
+def _to_review(row) -> ReviewData:
+    values = dict(zip(COLUMNS, row))
+    for name in ("review_date", "scraped_on"):
+        if values[name] is not None:
+            values[name] = date.fromisoformat(values[name])
+    for name in ("verified", "helpful"):
+        if values[name] is not None:
+            values[name] = bool(values[name])
+    return ReviewData.model_construct(**values)
+
+
+class ReviewWarehouse:
+    """
+    Local SQLite mirror of the reviews table, to answer questions offline in milliseconds instead of querying
+    BigQuery. Filled with bulk upserts after every scrape; see query(), search() and known_ids().
+    """
+
+    def __init__(self, filename: str = DEFAULT_WAREHOUSE_FILE, schema_file: str = SCHEMA_FILE):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+        self.connection.executescript(build_schema(schema_file))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM reviews").fetchone()[0]
+
+    def __contains__(self, review_id: str):
+        return self.connection.execute("SELECT 1 FROM reviews WHERE review_id = ?", (review_id,)).fetchone() is not None
+
+    def upsert(self, reviews, batch_size: int = DEFAULT_UPSERT_BATCH) -> int:
+        """
+        Insert new reviews and update the stored ones whose content changed in a newer scrape, in one transaction.
+
+        :param reviews: ReviewData, dicts of ReviewData values, or a ReviewBatch.
+        :return: The number of rows inserted or updated.
+        """
+        start = time.perf_counter()
+        rows = _iter_rows(reviews)
+        changed = 0
+        with self.connection:
+            while batch := [row for _, row in zip(range(batch_size), rows)]:
+                # rowcount adds up the rows each statement changed, leaving out the FTS rows written by the triggers
+                changed += self.connection.executemany(UPSERT_QUERY, batch).rowcount
+        logging.info(f"Upserted {changed} reviews into {self.filename} in {time.perf_counter() - start:.2f}s")
+        return changed
+
+    def get(self, review_id: str):
+        row = self.connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM reviews WHERE review_id = ?", (review_id,)
+        ).fetchone()
+        return _to_review(row) if row is not None else None
+
+    def known_ids(self, review_ids) -> set:
+        """
+        The given review_ids that are already stored.
+        """
+        review_ids = list(review_ids)
+        known = set()
+        # Stay under SQLite's limit on the number of parameters of a statement
+        for start in range(0, len(review_ids), 900):
+            chunk = review_ids[start:start + 900]
+            known.update(review_id for review_id, in self.connection.execute(
+                f"SELECT review_id FROM reviews WHERE review_id IN ({', '.join('?' for _ in chunk)})", chunk
+            ))
+        return known
+
+    def fetch_columns(self, names, **filters) -> dict:
+        """
+        Columns of the reviews matching the filters of query(), as lists of raw SQLite values, without building
+        a ReviewData per row. E.g. `fetch_columns(fingerprint.FINGERPRINT_COLUMNS, country="DE")`, or
+        `missing_country=True` for the reviews whose country is NULL.
+        """
+        names = list(names)
+        unknown = set(names) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+        conditions, params = self._filters(**filters)
+        rows = self.connection.execute(
+            f"SELECT {', '.join(names)} FROM reviews" + (f" WHERE {' AND '.join(conditions)}" if conditions else ""),
+            params,
+        ).fetchall()
+        if not rows:
+            return {name: [] for name in names}
+        return {name: list(values) for name, values in zip(names, zip(*rows))}
+
+    @staticmethod
+    def _filters(country=None, asin=None, since=None, until=None, min_rating=None, max_rating=None,
+                 missing_country=False):
+        conditions, params = [], []
+        if missing_country:
+            conditions.append("reviews.country IS NULL")
+        for condition, value in (("country = ?", country), ("asin = ?", asin),
+                                 ("review_date >= ?", since), ("review_date <= ?", until),
+                                 ("rating >= ?", min_rating), ("rating <= ?", max_rating)):
+            if value is not None:
+                conditions.append(f"reviews.{condition}")
+                params.append(value.isoformat() if isinstance(value, date) else value)
+        return conditions, params
+
+    def query(self, country: str = None, asin: str = None, since: date = None, until: date = None,
+              min_rating: int = None, max_rating: int = None, limit: int = None) -> list[ReviewData]:
+        """
+        Reviews matching all the given filters, newest first.
+        E.g. the new 1-2 star reviews of an ASIN in DE this week:
+        `query(country="DE", asin="B0...", since=date.today() - timedelta(days=7), max_rating=2)`
+        """
+        conditions, params = self._filters(country, asin, since, until, min_rating, max_rating)
+        rows = self.connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM reviews"
+            + (f" WHERE {' AND '.join(conditions)}" if conditions else "")
+            + " ORDER BY review_date DESC" + (f" LIMIT {int(limit)}" if limit is not None else ""),
+            params,
+        )
+        return [_to_review(row) for row in rows]
+
+    def count(self, **filters) -> int:
+        """
+        Number of reviews matching the filters of query().
+        """
+        conditions, params = self._filters(**filters)
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM reviews" + (f" WHERE {' AND '.join(conditions)}" if conditions else ""), params
+        ).fetchone()[0]
+
+    def search(self, text: str, limit: int = 50, **filters) -> list[ReviewData]:
+        """
+        Full-text search of titles and bodies, best matches first, optionally restricted with the filters of query().
+
+        :param text: An FTS5 query: words (matched case and accent insensitively), "phrases", OR, NOT, prefix*.
+        """
+        conditions, params = self._filters(**filters)
+        rows = self.connection.execute(
+            f"SELECT {', '.join(f'reviews.{name}' for name in COLUMNS)} FROM reviews_fts "
+            f"JOIN reviews ON reviews.rowid = reviews_fts.rowid WHERE reviews_fts MATCH ?"
+            + "".join(f" AND {condition}" for condition in conditions)
+            + f" ORDER BY bm25(reviews_fts) LIMIT {int(limit)}",
+            [text] + params,
+        )
+        return [_to_review(row) for row in rows]
+
+    def close(self):
+        self.connection.close()
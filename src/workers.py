@@ -0,0 +1,314 @@
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+import logging
+import queue
+import threading
+import time
+from selenium.common.exceptions import TimeoutException
+from readiness import Readiness, marketplace_selected
+from pages import (build_page_url, build_url, get_base_url, get_num_pages, init_driver, parse_page,
+                   select_marketplace)
+
+DEFAULT_WORKERS = 4
+# Page loads per second allowed on each domain, and how many may be sent back to back
+DEFAULT_RATE_LIMIT = 2.0
+DEFAULT_BURST = 2
+DEFAULT_PAGES_PER_JOB = 5
+# Browser restarts a worker tries for one page, and times a failed page is handed out again
+DEFAULT_MAX_RESTARTS = 2
+DEFAULT_PAGE_ATTEMPTS = 2
+
+# Cookie fields accepted by WebDriver's add_cookie
+_COOKIE_FIELDS = ("name", "value", "path", "domain", "secure", "httpOnly", "expiry")
+
+# Put on the results queue by a worker thread when it stops
+_WORKER_STOPPED = object()
+
+
+@dataclass
+class ScrapeJob:
+    """
+    A range of review pages of one marketplace, with the cookies that select that marketplace.
+    """
+    marketplace: str
+    base_url: str
+    pages: list
+    cookies: list = field(default_factory=list, repr=False)
+
+
+@dataclass
+class PageResult:
+    marketplace: str
+    page_num: int
+    reviews: list = None
+    error: str = None
+
+
+class DomainRateLimiter:
+    """
+    Token bucket per domain, shared by all workers: at most `rate` requests per second on average
+    to each domain, with bursts of up to `burst` requests.
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE_LIMIT, burst: int = DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, domain: str):
+        """
+        Block until a request to `domain` is allowed.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens, last = self._buckets.get(domain, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                if tokens >= 1:
+                    self._buckets[domain] = (tokens - 1, now)
+                    return
+                self._buckets[domain] = (tokens, now)
+                delay = (1 - tokens) / self.rate
+            time.sleep(delay)
+
+
+def plan_jobs(marketplace: str, base_url: str, page_nums, cookies=None,
+              pages_per_job: int = DEFAULT_PAGES_PER_JOB) -> list[ScrapeJob]:
+    """
+    Split the pages of a marketplace into jobs of at most pages_per_job consecutive pages.
+    """
+    page_nums = list(page_nums)
+    return [
+        ScrapeJob(marketplace, base_url, page_nums[start:start + pages_per_job], cookies or [])
+        for start in range(0, len(page_nums), pages_per_job)
+    ]
+
+
+def apply_cookies(driver, base_url: str, cookies: list):
+    """
+    Load the given cookies (from driver.get_cookies() of the logged-in browser) into another browser.
+    WebDriver only accepts cookies for the current domain, so the domain is opened first.
+    """
+    driver.get(base_url)
+    driver.delete_all_cookies()
+    for cookie in cookies:
+        driver.add_cookie({key: cookie[key] for key in _COOKIE_FIELDS if key in cookie})
+
+
+def headless_driver():
+    return init_driver(headless=True)
+
+
+class DriverWorker(threading.Thread):
+    """
+    Scrapes the pages of the jobs it takes from the queue with its own browser. The browser is started
+    on first use, and restarted when a page fails, up to max_restarts times per page.
+    A page that does not show the job's marketplace (e.g. when the selection lives in the server-side session
+    rather than in the cookies) fails like any other page.
+    """
+
+    def __init__(self, name: str, jobs: queue.Queue, results: queue.Queue, rate_limiter: DomainRateLimiter,
+                 driver_factory=headless_driver, parse=None, max_restarts: int = DEFAULT_MAX_RESTARTS):
+        super().__init__(name=name, daemon=True)
+        self.jobs = jobs
+        self.results = results
+        self.rate_limiter = rate_limiter
+        self.driver_factory = driver_factory
+        self.parse = parse
+        self.max_restarts = max_restarts
+        self.readiness = Readiness()
+        self.driver = None
+        self.restarts = 0
+        self._cookies = None
+
+    def run(self):
+        try:
+            while (job := self.jobs.get()) is not None:
+                pages = list(job.pages)
+                try:
+                    while pages:
+                        self.results.put(self.scrape_page(job, pages[0]))
+                        pages.pop(0)
+                except BaseException as e:
+                    # Hand the pages left back as failed, so that the pool does not wait for them
+                    for page_num in pages:
+                        self.results.put(PageResult(job.marketplace, page_num,
+                                                    error=f"{self.name} stopped: {type(e).__name__}: {e}"))
+                    raise
+        finally:
+            self._quit()
+            self.results.put(_WORKER_STOPPED)
+
+    def scrape_page(self, job: ScrapeJob, page_num: int) -> PageResult:
+        url = build_page_url(job.base_url, page_num)
+        error = None
+        for attempt in range(self.max_restarts + 1):
+            try:
+                if self.driver is None:
+                    self.driver = self.driver_factory()
+                if self._cookies is not job.cookies:
+                    # Switching marketplace: the selection lives in the cookies
+                    apply_cookies(self.driver, job.base_url, job.cookies)
+                    self._cookies = job.cookies
+                self.rate_limiter.acquire(urlsplit(job.base_url).netloc)
+                self.driver.get(url)
+                self.readiness.wait_for_reviews(self.driver, job.marketplace, page_num)
+                if not marketplace_selected(job.marketplace)(self.driver):
+                    raise RuntimeError(f"the page does not show marketplace {job.marketplace}")
+                reviews = self.parse(self.driver.page_source, job.marketplace, page_num)
+                return PageResult(job.marketplace, page_num, reviews)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                logging.warning(f"{self.name}: page {page_num} of {job.marketplace} failed ({error}). "
+                                f"Restarting the browser ({self.max_restarts - attempt} restarts left)")
+                self._quit()
+                self.restarts += 1
+        return PageResult(job.marketplace, page_num, error=error)
+
+    def _quit(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception as e:
+                logging.debug(f"{self.name}: could not quit the browser: {e}")
+        self.driver = None
+        self._cookies = None
+
+
+class WorkerPool:
+    """
+    Pool of browser workers scraping review pages in parallel. Jobs go through a shared queue; pages
+    that still fail after their worker's restarts are handed out again, up to page_attempts times.
+    Requests to each domain are throttled by a DomainRateLimiter shared by all workers, so throughput
+    grows with the number of workers until it reaches the rate limit.
+    """
+
+    def __init__(self, num_workers: int = DEFAULT_WORKERS, driver_factory=headless_driver,
+                 rate_limit: float = DEFAULT_RATE_LIMIT, burst: int = DEFAULT_BURST,
+                 max_restarts: int = DEFAULT_MAX_RESTARTS, page_attempts: int = DEFAULT_PAGE_ATTEMPTS,
+                 page_store=None, parse_cache=None, checkpoint=None):
+        self.num_workers = num_workers
+        self.driver_factory = driver_factory
+        self.rate_limiter = DomainRateLimiter(rate_limit, burst)
+        self.max_restarts = max_restarts
+        self.page_attempts = page_attempts
+        self.page_store = page_store
+        self.parse_cache = parse_cache
+        self.checkpoint = checkpoint
+
+    def parse(self, html_content, marketplace, page_num):
+        return parse_page(html_content, marketplace, page_num, self.page_store, self.parse_cache)
+
+    def run(self, jobs) -> dict:
+        """
+        Scrape every page of the given jobs.
+
+        :return: A dict marketplace -> list of reviews, in page order. Pages that could not be scraped are logged
+                 and left out, as well as the pages left once every worker has stopped.
+        """
+        jobs = list(jobs)
+        job_queue, results = queue.Queue(), queue.Queue()
+        for job in jobs:
+            job_queue.put(job)
+        workers = [
+            DriverWorker(f"worker-{index}", job_queue, results, self.rate_limiter, self.driver_factory,
+                         self.parse, self.max_restarts)
+            for index in range(self.num_workers)
+        ]
+        for worker in workers:
+            worker.start()
+
+        job_of_page = {(job.marketplace, page_num): job for job in jobs for page_num in job.pages}
+        pending = len(job_of_page)
+        running = len(workers)
+        attempts = {}
+        pages = {}
+        start = time.perf_counter()
+        try:
+            while pending:
+                result = results.get()
+                if result is _WORKER_STOPPED:
+                    running -= 1
+                    if not running:
+                        print(f"Every worker stopped. Giving up on the {pending} pages left.")
+                        break
+                    continue
+                key = (result.marketplace, result.page_num)
+                attempts[key] = attempts.get(key, 0) + 1
+                if result.error is None:
+                    pending -= 1
+                    pages[key] = result.reviews
+                    if self.checkpoint is not None:
+                        self.checkpoint.record(result.marketplace, result.page_num, result.reviews)
+                    print(f"Scraped page {result.page_num} of {result.marketplace} ({len(result.reviews)} reviews)")
+                elif attempts[key] < self.page_attempts:
+                    job = job_of_page[key]
+                    job_queue.put(ScrapeJob(job.marketplace, job.base_url, [result.page_num], job.cookies))
+                else:
+                    pending -= 1
+                    print(f"Giving up on page {result.page_num} of {result.marketplace}: {result.error}")
+        finally:
+            for _ in workers:
+                job_queue.put(None)
+            for worker in workers:
+                worker.join()
+            if self.checkpoint is not None:
+                self.checkpoint.sync()
+        elapsed = time.perf_counter() - start
+        logging.info(
+            f"{len(pages)} pages scraped by {self.num_workers} workers in {elapsed:.1f}s "
+            f"({len(pages) / elapsed if elapsed else 0:.2f} pages/s, "
+            f"{sum(worker.restarts for worker in workers)} browser restarts)"
+        )
+        reviews = {}
+        for (marketplace, _), page_reviews in sorted(pages.items()):
+            reviews.setdefault(marketplace, []).extend(page_reviews)
+        return reviews
+
+
+def prepare_jobs(driver, marketplaces: dict, account: str = "Zenement", skip_pages: dict = None,
+                 pages_per_job: int = DEFAULT_PAGES_PER_JOB, readiness: Readiness = None) -> list[ScrapeJob]:
+    """
+    Switch the logged-in browser to each marketplace in turn, and plan the jobs of its review pages
+    with a snapshot of the cookies that select it.
+
+    :param skip_pages: Optional dict marketplace -> page numbers not to scrape (e.g. checkpointed pages).
+    Marketplaces whose review pages do not load (no reviews, failed switch) are skipped.
+    """
+    readiness = readiness or Readiness()
+    skip_pages = skip_pages or {}
+    jobs = []
+    for marketplace, marketplace_name in marketplaces.items():
+        select_marketplace(driver, account, marketplace_name)
+        try:
+            readiness.wait_for_marketplace(driver, marketplace, marketplace_name)
+        except TimeoutException:
+            print(f"Could not confirm the switch to {marketplace_name}. Continuing anyway...")
+        try:
+            driver.get(build_url(driver))
+            readiness.wait_for_reviews(driver, marketplace)
+            total_pages, current_page = get_num_pages(driver)
+            base_url, cookies = get_base_url(driver), driver.get_cookies()
+        except Exception as e:
+            print(f"Error preparing the pages of marketplace {marketplace}, skipping it: {e}")
+            continue
+        page_nums = [
+            page_num for page_num in range(current_page, total_pages + 1)
+            if page_num not in skip_pages.get(marketplace, ())
+        ]
+        marketplace_jobs = plan_jobs(marketplace, base_url, page_nums, cookies, pages_per_job)
+        print(f"Queued {len(page_nums)} pages of {marketplace} in {len(marketplace_jobs)} jobs.")
+        jobs.extend(marketplace_jobs)
+    return jobs
+
+
+def scrape_marketplaces(driver, marketplaces: dict, num_workers: int = DEFAULT_WORKERS, skip_pages: dict = None,
+                        **pool_kwargs) -> dict:
+    """
+    Scrape all marketplaces with a WorkerPool, the logged-in driver being only used to plan the jobs.
+
+    :return: A dict marketplace -> list of reviews.
+    """
+    jobs = prepare_jobs(driver, marketplaces, skip_pages=skip_pages)
+    return WorkerPool(num_workers, **pool_kwargs).run(jobs)
@@ -0,0 +1,73 @@
+from datetime import date
+
+import pytest
+
+from archive import ParseCache
+from review import ReviewData, generate_review_id
+
+
+def test_parse_cache_is_keyed_on_review_id_scheme(tmp_path):
+    review = ReviewData(review_id=generate_review_id("Ana", "Great", None, "sha256-v1"), author="Ana", title="Great")
+    ParseCache(str(tmp_path), review_id_scheme="sha256-v1").put("ab" * 32, [review])
+
+    assert ParseCache(str(tmp_path), review_id_scheme="sha256-v1").get("ab" * 32)[0].review_id == review.review_id
+    assert ParseCache(str(tmp_path), review_id_scheme="blake2b128-v1").get("ab" * 32) is None
+
+
+def test_parse_cache_hits_are_scraped_today(tmp_path):
+    cache = ParseCache(str(tmp_path))
+    cache.put("cd" * 32, [ReviewData(author="Ana", scraped_on=date(2020, 1, 1))])
+
+    (review,) = cache.get("cd" * 32)
+    assert review.author == "Ana" and review.scraped_on == date.today()
+
+
+def test_lru_directory_evicts_least_recently_used(tmp_path, monkeypatch):
+    from archive import _LRUDirectory
+
+    root = tmp_path / "cache"
+    files = _LRUDirectory(str(root), max_bytes=30)
+    for name in "abc":
+        files.write(str(root / name[0] / name), b"x" * 10)
+    files.touch(str(root / "a" / "a"))
+    assert files.size() == 30
+
+    # Past the index built on first use, writes never walk the directory
+    monkeypatch.setattr(files, "_iter_files", lambda: pytest.fail("directory walked on write"))
+    files.write(str(root / "d" / "d"), b"x" * 10)
+    assert files.size() == 30
+    assert sorted(path.name for path in root.rglob("*") if path.is_file()) == ["a", "c", "d"]
+    files.write(str(root / "a" / "a"), b"x" * 25)
+    assert files.size() == 25
+    assert [path.name for path in root.rglob("*") if path.is_file()] == ["a"]
+
+
+def test_lru_directory_loads_the_order_from_disk(tmp_path):
+    import os
+    from archive import _LRUDirectory
+
+    for index, name in enumerate("cab"):
+        path = tmp_path / name
+        path.write_bytes(b"x" * 10)
+        os.utime(path, (1000 + index, 1000 + index))
+    files = _LRUDirectory(str(tmp_path), max_bytes=20)
+    files.write(str(tmp_path / "d" / "d"), b"x" * 5)
+    assert sorted(path.name for path in tmp_path.rglob("*") if path.is_file()) == ["b", "d"]
+
+
+def test_archived_reviews_are_looked_up_once(tmp_path, monkeypatch):
+    from archive import PageStore, iter_archived_reviews
+    import archive
+
+    html_content = "<html></html>"
+    page_store = PageStore(str(tmp_path / "pages"))
+    html_hash = page_store.save("ES", 1, html_content)
+    cache = ParseCache(str(tmp_path / "cache"))
+    cache.put(html_hash, [ReviewData(author="Ana")])
+    lookups = []
+    get = cache.get
+    monkeypatch.setattr(cache, "get", lambda html_hash: lookups.append(html_hash) or get(html_hash))
+    monkeypatch.setattr(archive, "parse_html", lambda html_content, backend=None: pytest.fail("parsed a cached page"))
+
+    assert [review.author for review in iter_archived_reviews(page_store, cache)] == ["Ana"]
+    assert lookups == [html_hash]
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+import batch_parse
+from review import DEFAULT_STORE_FILE, iter_saved_reviews
+
+SAMPLE_HTML = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resources", "sample.html")
+
+
+@pytest.fixture
+def captures(tmp_path):
+    """
+    An Italian capture, a broken .mhtml, the Italian capture relabelled as Spanish, and files that are not captures.
+    """
+    with open(SAMPLE_HTML, "r", encoding="utf-8") as f:
+        html_content = f.read()
+    (tmp_path / "a_it.html").write_text(html_content, encoding="utf-8")
+    (tmp_path / "b_broken.mhtml").write_bytes(b"not a MIME message")
+    (tmp_path / "c_es.HTML").write_text(html_content.replace("| Italia</span>", "| España</span>"), encoding="utf-8")
+    (tmp_path / "notes.txt").write_text("not a capture")
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "d_it.html").write_text(html_content, encoding="utf-8")
+    return tmp_path
+
+
+def test_expand_paths(captures):
+    top_level = [str(captures / name) for name in ("a_it.html", "b_broken.mhtml", "c_es.HTML")]
+    assert batch_parse.expand_paths(str(captures)) == top_level
+    assert batch_parse.expand_paths(str(captures / "**" / "*.html")) == sorted(
+        [str(captures / "a_it.html"), str(captures / "nested" / "d_it.html")]
+    )
+    assert batch_parse.expand_paths([str(captures / "nested"), str(captures / "a_it.html"),
+                                     str(captures / "notes.txt")]) == [
+        str(captures / "nested" / "d_it.html"), str(captures / "a_it.html")
+    ]
+    assert batch_parse.expand_paths(str(captures / "missing")) == []
+
+
+def test_reviews_keep_input_order_and_skip_failed_files(captures):
+    failures = []
+    reviews = list(batch_parse.parse_files(str(captures), max_workers=2, failures=failures))
+    countries = [review.country for review in reviews]
+    assert countries and countries == ["IT"] * (len(countries) // 2) + ["ES"] * (len(countries) // 2)
+    assert [failure.path for failure in failures] == [str(captures / "b_broken.mhtml")]
+    assert failures[0].error.startswith("ValueError")
+
+
+def test_main_does_not_overwrite_the_failed_upload_store(captures, monkeypatch):
+    monkeypatch.chdir(captures)
+    batch_parse.main([str(captures / "a_it.html"), "--workers", "1"])
+    assert batch_parse.DEFAULT_OUTPUT_FILE != DEFAULT_STORE_FILE
+    assert not os.path.exists(DEFAULT_STORE_FILE)
+    assert len(list(iter_saved_reviews(batch_parse.DEFAULT_OUTPUT_FILE))) == 50
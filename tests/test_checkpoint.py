@@ -0,0 +1,121 @@
+import os
+
+from checkpoint import CheckpointLog
+import main
+from review import ReviewData
+
+
+def make_review(review_id):
+    return ReviewData(review_id=review_id, author="author", rating=5)
+
+
+def review_ids(pages):
+    return {key: [review.review_id for review in reviews] for key, reviews in pages.items()}
+
+
+def test_replay_keeps_the_last_record_of_a_page(tmp_path):
+    filename = str(tmp_path / "checkpoint.ndjson")
+    with CheckpointLog(filename, fsync_every=1) as checkpoint:
+        checkpoint.record("ES", 1, [make_review("a")])
+        checkpoint.record("ES", 2, [make_review("b")])
+        checkpoint.record("ES", 1, [make_review("c")])
+    pages = CheckpointLog(filename).replay()
+    assert review_ids(pages) == {("ES", 2): ["b"], ("ES", 1): ["c"]}
+    assert list(pages) == [("ES", 2), ("ES", 1)]
+    assert CheckpointLog(str(tmp_path / "missing.ndjson")).replay() == {}
+
+
+def test_replay_drops_a_torn_last_line(tmp_path, caplog):
+    filename = str(tmp_path / "checkpoint.ndjson")
+    with CheckpointLog(filename) as checkpoint:
+        checkpoint.record("ES", 1, [make_review("a")])
+        checkpoint.record("ES", 2, [make_review("b")])
+    size = os.path.getsize(filename)
+    with open(filename, 'ab') as f:
+        f.write(b'{"marketplace": "ES", "page": 3, "revi')
+
+    checkpoint = CheckpointLog(filename)
+    assert review_ids(checkpoint.replay()) == {("ES", 1): ["a"], ("ES", 2): ["b"]}
+    assert "torn last line" in caplog.text
+    # The torn line is truncated away, so that the next page starts on a line of its own
+    assert os.path.getsize(filename) == size
+    checkpoint.record("ES", 3, [make_review("c")])
+    assert review_ids(checkpoint.replay()) == {("ES", 1): ["a"], ("ES", 2): ["b"], ("ES", 3): ["c"]}
+
+
+def test_replay_skips_an_unreadable_line_in_the_middle(tmp_path, caplog):
+    filename = str(tmp_path / "checkpoint.ndjson")
+    with CheckpointLog(filename) as checkpoint:
+        checkpoint.record("ES", 1, [make_review("a")])
+    with open(filename, 'ab') as f:
+        f.write(b'{"marketplace": "ES"}\n')
+    with CheckpointLog(filename) as checkpoint:
+        checkpoint.record("ES", 2, [make_review("b")])
+    assert review_ids(CheckpointLog(filename).replay()) == {("ES", 1): ["a"], ("ES", 2): ["b"]}
+    assert "Skipping unreadable line 2" in caplog.text
+
+
+def test_clear(tmp_path):
+    filename = str(tmp_path / "checkpoint.ndjson")
+    checkpoint = CheckpointLog(filename)
+    checkpoint.clear()
+    checkpoint.record("ES", 1, [make_review("a")])
+    checkpoint.clear()
+    assert not os.path.exists(filename) and checkpoint.replay() == {}
+    # Recording again after clear() starts a new log
+    checkpoint.record("ES", 2, [make_review("b")])
+    assert review_ids(checkpoint.replay()) == {("ES", 2): ["b"]}
+
+
+class FakeReadiness:
+    class tracker:
+        @staticmethod
+        def summary(marketplace):
+            return marketplace
+
+    def wait_for_reviews(self, driver, marketplace, page_num=None, timer=None):
+        pass
+
+
+class FakeDriver:
+    def __init__(self):
+        self.visited = []
+        self.page_source = None
+
+    def get(self, url):
+        self.visited.append(url)
+        self.page_source = url
+
+
+def test_resuming_mid_marketplace(tmp_path, monkeypatch):
+    # Four pages of two reviews each, the review ids of page n being n-0 and n-1
+    monkeypatch.setattr(main, "get_num_pages", lambda driver: (4, 1))
+    monkeypatch.setattr(main, "build_url", lambda driver, page_num=1: page_num)
+    monkeypatch.setattr(main, "iter_reviews_html",
+                        lambda page_num: iter([make_review(f"{page_num}-{index}") for index in range(2)]))
+    filename = str(tmp_path / "checkpoint.ndjson")
+
+    # Interrupted while reading page 3: pages 1 and 2 are complete
+    driver = FakeDriver()
+    driver.get(1)
+    checkpoint = CheckpointLog(filename)
+    reviews = main.iter_paginate(driver, "ES", readiness=FakeReadiness(), checkpoint=checkpoint)
+    assert [next(reviews).review_id for _ in range(5)] == ["1-0", "1-1", "2-0", "2-1", "3-0"]
+    reviews.close()
+    checkpoint.close()
+
+    driver = FakeDriver()
+    driver.get(1)
+    checkpoint = CheckpointLog(filename)
+    resumed_pages = checkpoint.replay()
+    assert review_ids(resumed_pages) == {("ES", 1): ["1-0", "1-1"], ("ES", 2): ["2-0", "2-1"]}
+    skip_pages = {page for marketplace, page in resumed_pages if marketplace == "ES"}
+    reviews = [review.review_id for page_reviews in resumed_pages.values() for review in page_reviews] + [
+        review.review_id
+        for review in main.iter_paginate(driver, "ES", readiness=FakeReadiness(), checkpoint=checkpoint,
+                                         skip_pages=skip_pages)
+    ]
+    assert reviews == [f"{page}-{index}" for page in range(1, 5) for index in range(2)]
+    # Page 3 is scraped again from its start, and no completed page is fetched again
+    assert driver.visited == [1, 3, 4]
+    assert list(checkpoint.replay()) == [("ES", page) for page in range(1, 5)]
@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+import cli
+import load
+import main
+from review import ReviewData
+from warehouse import DEFAULT_WAREHOUSE_FILE
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    """
+    Replace every subcommand handler with one recording the arguments it was called with.
+    """
+    calls = []
+    for name in ("scrape_command", "parse_files_command", "upload_command", "retry_upload_command", "query_command",
+                 "mirror_command", "bench_command"):
+        monkeypatch.setattr(cli, name, lambda args, name=name: calls.append((name, args)))
+    return calls
+
+
+@pytest.mark.parametrize("argv, handler", [
+    (["scrape"], "scrape_command"),
+    (["parse-files", "captures"], "parse_files_command"),
+    (["upload"], "upload_command"),
+    (["retry-upload"], "retry_upload_command"),
+    (["query"], "query_command"),
+    (["mirror", "reviews.ndjson"], "mirror_command"),
+    (["bench"], "bench_command"),
+])
+def test_subcommands_dispatch_to_their_handler(handlers, argv, handler):
+    assert cli.run(argv) == 0
+    assert [name for name, _ in handlers] == [handler]
+
+
+def test_arguments_are_forwarded_to_parse_files_and_bench(handlers):
+    cli.run(["parse-files", "captures", "--workers", "2", "--help"])
+    cli.run(["bench", "--scales", "1,10"])
+    assert [(name, args.forwarded) for name, args in handlers] == [
+        ("parse_files_command", ["captures", "--workers", "2", "--help"]),
+        ("bench_command", ["--scales", "1,10"]),
+    ]
+
+
+def test_unknown_arguments_of_other_commands_are_rejected(handlers, capsys):
+    with pytest.raises(SystemExit) as exc_info:
+        cli.run(["upload", "reviews.ndjson", "--scales", "1,10"])
+    assert exc_info.value.code == 2
+    assert "unrecognized arguments: --scales 1,10" in capsys.readouterr().err
+    assert handlers == []
+
+
+def test_upload_arguments(handlers):
+    cli.run(["upload", "reviews.ndjson", "--mode", "full"])
+    ((_, args),) = handlers
+    assert args.file == "reviews.ndjson" and args.mode == "full" and args.forwarded == []
+
+
+def test_scrape_flags_set_the_switches_of_main(monkeypatch):
+    for name in ("REVIEW_FETCH_MODE", "REVIEW_WORKERS", "REVIEW_PIPELINE"):
+        monkeypatch.setenv(name, "")
+    monkeypatch.setattr(main, "main", lambda: None)
+    assert cli.run(["scrape", "--fetch-mode", "http", "--workers", "3", "--pipeline"]) == 0
+    assert [cli.os.environ[name] for name in ("REVIEW_FETCH_MODE", "REVIEW_WORKERS", "REVIEW_PIPELINE")] == \
+        ["http", "3", "1"]
+
+
+def test_failed_upload_returns_1(monkeypatch, tmp_path, capsys):
+    def upload_saved_reviews(filename=None, mode=None):
+        raise RuntimeError("MERGE failed")
+
+    monkeypatch.setattr(load, "upload_saved_reviews", upload_saved_reviews)
+    filename = tmp_path / "reviews.ndjson"
+    filename.write_text("")
+    assert cli.run(["upload", str(filename)]) == 1
+    assert cli.run(["retry-upload"]) == 1
+    assert capsys.readouterr().out.count("Error uploading data to GBQ: MERGE failed") == 2
+    assert cli.run(["upload", str(tmp_path / "missing.ndjson")]) == 1
+
+
+def test_mirror_and_query_default_to_the_warehouse_file(monkeypatch, tmp_path, capsys):
+    monkeypatch.delenv("REVIEW_WAREHOUSE", raising=False)
+    monkeypatch.chdir(tmp_path)
+    with open("reviews.ndjson", "w", encoding="utf-8") as f:
+        f.write(ReviewData(review_id="a", country="ES", author="Ana", rating=5).model_dump_json() + "\n")
+    assert cli.run(["mirror", "reviews.ndjson"]) == 0
+    assert (tmp_path / DEFAULT_WAREHOUSE_FILE).exists()
+    capsys.readouterr()
+    assert cli.run(["query", "--country", "ES"]) == 0
+    assert [json.loads(line)["review_id"] for line in capsys.readouterr().out.splitlines()] == ["a"]
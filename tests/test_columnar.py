@@ -0,0 +1,55 @@
+from datetime import date
+import io
+import json
+
+from pydantic import ValidationError
+import pytest
+
+import columnar
+from columnar import ReviewBatch
+from review import ReviewData, iter_reviews_from_ndjson, save_reviews_to_ndjson
+
+
+def make_reviews():
+    return [
+        ReviewData(review_id="a", country="ES", asin="B01", brand="Zenement", review_date=date(2024, 5, 1),
+                   author="Ana", verified=True, helpful=False, title="Bien", body="Muy bien", rating=5,
+                   url="https://amazon.es/r/a"),
+        ReviewData(review_id="b", country=None, title="Sin país", rating=None, scraped_on=date(2024, 6, 2)),
+        ReviewData(review_id="c", country="ES", asin="B02", review_date=date(2023, 1, 31), body="Regular", rating=3),
+    ]
+
+
+@pytest.mark.parametrize("filename", ["reviews.ndjson", "reviews.ndjson.gz"])
+def test_from_ndjson_matches_model_validation(tmp_path, filename):
+    path = str(tmp_path / filename)
+    save_reviews_to_ndjson(make_reviews() * 3, path)
+    batch = ReviewBatch.from_ndjson(path, batch_size=4)
+    assert len(batch) == 9
+    assert list(batch.iter_dicts()) == list(ReviewBatch.from_reviews(iter_reviews_from_ndjson(path)).iter_dicts())
+
+
+def test_from_ndjson_validates_unusual_rows(tmp_path):
+    path = tmp_path / "reviews.ndjson"
+    rows = [review.model_dump() for review in make_reviews()]
+    rows[1]["rating"] = "4"  # Coerced by pydantic, as when loading models
+    del rows[2]["url"]
+    path.write_text("\n".join(json.dumps(row) for row in rows) + "\n\n", encoding="utf-8")
+    batch = ReviewBatch.from_ndjson(str(path))
+    assert batch.column("rating") == [5, 4, 3] and batch.column("url")[2] is None
+
+    rows[0]["review_date"] = "2024-13-01"
+    path.write_text("\n".join(json.dumps(row) for row in rows), encoding="utf-8")
+    with pytest.raises(ValidationError):
+        ReviewBatch.from_ndjson(str(path))
+
+
+def test_iter_lines_across_blocks():
+    data = b'{"a": 1}\n{"b": 22}\n\n{"c": 333}'
+    assert list(columnar._iter_lines(io.BytesIO(data), block_size=3)) == data.split(b"\n")
+
+
+def test_parquet_without_pyarrow(tmp_path, monkeypatch):
+    monkeypatch.setattr(columnar, "pyarrow", None)
+    with pytest.raises(ImportError, match="pyarrow"):
+        ReviewBatch.from_reviews(make_reviews()).to_parquet(str(tmp_path / "reviews.parquet"))
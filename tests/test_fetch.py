@@ -0,0 +1,103 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+
+import pytest
+import requests
+
+import fetch
+
+SAMPLE_HTML = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resources", "sample.html")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Serves sample.html. /flaky-<n> answers 503 to its first n requests, /missing always 404.
+    """
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] = server.hits.get(self.path, 0) + 1
+            hits = server.hits[self.path]
+        if self.path == "/missing":
+            self.send_response(404)
+            self.end_headers()
+        elif self.path.startswith("/flaky-") and hits <= int(self.path.rsplit("-", 1)[1]):
+            self.send_response(503)
+            self.send_header("Retry-After", "2")
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.end_headers()
+            self.wfile.write(server.page)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.hits = {}
+    server.lock = threading.Lock()
+    with open(SAMPLE_HTML, "rb") as f:
+        server.page = f.read()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(fetch.time, "sleep", delays.append)
+    monkeypatch.setattr(fetch.random, "uniform", lambda low, high: 1.0)
+    return delays
+
+
+def url(server, path):
+    return f"http://127.0.0.1:{server.server_port}{path}"
+
+
+def test_fetch_pages_in_order(server, sleeps):
+    paths = [f"/page-{page}" for page in range(8)]
+    with fetch.build_session(4) as session:
+        results = list(fetch.fetch_pages(session, [url(server, path) for path in paths], 4))
+    assert [result_url for result_url, _ in results] == [url(server, path) for path in paths]
+    assert all(html_content == server.page.decode("utf-8") for _, html_content in results)
+    assert sleeps == []
+
+
+def test_fetch_page_retries_with_backoff(server, sleeps):
+    with fetch.build_session() as session:
+        html_content = fetch.fetch_page(session, url(server, "/flaky-2"), backoff=0.5)
+    assert html_content == server.page.decode("utf-8")
+    assert server.hits["/flaky-2"] == 3
+    # Retry-After wins over the exponential backoff
+    assert sleeps == [2.0, 2.0]
+
+
+def test_fetch_page_gives_up_after_retries(server, sleeps):
+    with fetch.build_session() as session:
+        with pytest.raises(requests.RequestException, match="after 3 attempts"):
+            fetch.fetch_page(session, url(server, "/flaky-5"), retries=2)
+    assert server.hits["/flaky-5"] == 3 and len(sleeps) == 2
+
+
+def test_fetch_pages_returns_errors_without_retrying_client_errors(server, sleeps):
+    with fetch.build_session() as session:
+        (_, error), (_, html_content) = fetch.fetch_pages(session, [url(server, "/missing"), url(server, "/page")])
+    assert isinstance(error, requests.HTTPError) and server.hits["/missing"] == 1
+    assert html_content == server.page.decode("utf-8")
+    assert sleeps == []
+
+
+def test_connection_errors_back_off_exponentially(sleeps):
+    with fetch.build_session() as session:
+        with pytest.raises(requests.RequestException):
+            fetch.fetch_page(session, "http://127.0.0.1:9/", timeout=1, retries=3, backoff=0.5)
+    assert sleeps == [0.5, 1.0, 2.0]
@@ -0,0 +1,70 @@
+from datetime import date
+
+from fingerprint import FingerprintIndex, content_hash, fingerprint_reviews, minhash, shingle_hashes, similarity
+from main import select_changed_reviews
+from review import CONTENT_COLUMNS, ReviewData
+from warehouse import ReviewWarehouse
+
+BODY = "this blender is powerful and quiet and it crushes ice in a few seconds without any trouble at all"
+
+
+def make_review(review_id, country, body=BODY, title="Great blender", author="Ana"):
+    return ReviewData(review_id=review_id, country=country, asin="B0TEST", author=author, title=title, body=body,
+                      rating=5)
+
+
+def test_minhash_keeps_the_smallest_hash_of_every_bin():
+    hashes = {1, 65, 2, 130, 63}
+    signature = minhash(hashes)
+    assert signature[1] == 1 and signature[2] == 2 and signature[63] == 63 and signature[0] is None
+
+
+def test_similarity_of_near_duplicates():
+    tokens = BODY.encode().split()
+    signature = minhash(shingle_hashes(tokens))
+    assert similarity(signature, signature) == 1.0
+    assert similarity(signature, minhash(shingle_hashes(tokens[:-1]))) > 0.8
+    assert similarity(signature, minhash(shingle_hashes(b"a completely different review text here".split()))) < 0.3
+
+
+def test_classify():
+    index = FingerprintIndex.from_reviews([make_review("a", "ES"), make_review("b", "ES", body="short one")])
+    report = index.classify([
+        make_review("a", "ES"),
+        make_review("b", "ES", body="short one, edited"),
+        make_review("c", "ES", title="Great blender!"),
+        make_review("d", "FR", body="an entirely new review about a kettle that boils water quickly and quietly"),
+    ])
+    assert report.unchanged == ["a"] and report.changed == ["b"] and report.edited == {"c": "a"} and report.new == ["d"]
+
+
+def test_select_changed_reviews_with_missing_countries(tmp_path):
+    with ReviewWarehouse(str(tmp_path / "reviews.sqlite")) as warehouse:
+        warehouse.upsert([make_review("a", "ES"), make_review("b", None, author="Bo")])
+        reviews = [make_review("a", "ES"), make_review("b", None, author="Bo"), make_review("c", None, author="Cy")]
+        assert [fingerprint.review_id for fingerprint in fingerprint_reviews(reviews)] == ["a", "b", "c"]
+        assert [review.review_id for review in select_changed_reviews(warehouse, reviews)] == ["c"]
+
+
+def test_content_hash_covers_every_content_column():
+    review = make_review("a", "ES").model_copy(update={"brand": "Zenement", "url": "https://amazon.es/r/a",
+                                                       "review_date": date(2024, 5, 1)})
+    digest = content_hash(review)
+    assert content_hash(review.model_dump()) == digest
+    changes = {"country": "FR", "asin": "B0OTHER", "brand": "Other", "review_date": date(2024, 5, 2),
+               "author": "Bo", "title": "Bad blender", "body": BODY + " not", "rating": 1, "url": "https://x"}
+    assert set(changes) == set(CONTENT_COLUMNS)
+    for name, value in changes.items():
+        assert content_hash(review.model_copy(update={name: value})) != digest, name
+    # Case and whitespace edits of the text, and the columns the MERGE does not compare, are not changes
+    assert content_hash(review.model_copy(update={"title": "GREAT  blender", "verified": True})) == digest
+
+
+def test_brand_and_url_changes_are_loaded(tmp_path):
+    with ReviewWarehouse(str(tmp_path / "reviews.sqlite")) as warehouse:
+        stored = [make_review(review_id, "ES").model_copy(update={"review_date": date(2024, 5, 1)})
+                  for review_id in "abc"]
+        warehouse.upsert(stored)
+        reviews = [stored[0], stored[1].model_copy(update={"brand": "Other"}),
+                   stored[2].model_copy(update={"url": "https://amazon.es/r/c"})]
+        assert [review.review_id for review in select_changed_reviews(warehouse, reviews)] == ["b", "c"]
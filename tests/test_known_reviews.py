@@ -0,0 +1,103 @@
+import pytest
+
+from checkpoint import CheckpointLog
+from known_reviews import KnownReviewIndex
+import main
+from review import ReviewData
+
+
+def make_review(review_id):
+    return ReviewData(review_id=review_id, author="author", rating=5)
+
+
+def test_index_round_trip(tmp_path):
+    filename = str(tmp_path / "known_reviews.txt")
+    index = KnownReviewIndex(filename)
+    assert len(index) == 0
+    index.add([make_review("a"), make_review("b"), make_review("a")])
+    assert "a" in index and "b" in index and "c" not in index
+    assert index.is_known(make_review("a")) and not index.is_known(make_review("c"))
+    assert [review.review_id for review in index.filter_new([make_review("c"), make_review("b")])] == ["c"]
+    # Nothing is persisted before save()
+    assert len(KnownReviewIndex(filename)) == 0
+
+    index.save()
+    index.add([make_review("b"), make_review("c")])
+    index.save()
+    index.save()
+    with open(filename, encoding="utf-8") as f:
+        assert f.read().splitlines() == ["a", "b", "c"]
+    reloaded = KnownReviewIndex(filename)
+    assert len(reloaded) == 3 and all(review_id in reloaded for review_id in "abc")
+
+
+class FakeReadiness:
+    class tracker:
+        @staticmethod
+        def summary(marketplace):
+            return marketplace
+
+    def wait_for_reviews(self, driver, marketplace, page_num=None, timer=None):
+        pass
+
+
+class FakeDriver:
+    def __init__(self):
+        self.visited = []
+        self.page_source = None
+
+    def get(self, url):
+        self.visited.append(url)
+        self.page_source = url
+
+
+@pytest.fixture
+def site(monkeypatch):
+    """
+    Five pages of two reviews each, the review ids of page n being n-0 and n-1.
+    """
+    monkeypatch.setattr(main, "get_num_pages", lambda driver: (5, 1))
+    monkeypatch.setattr(main, "build_url", lambda driver, page_num=1: page_num)
+    monkeypatch.setattr(main, "iter_reviews_html",
+                        lambda page_num: iter([make_review(f"{page_num}-{index}") for index in range(2)]))
+    recorded = []
+    monkeypatch.setattr(main.telemetry, "increment",
+                        lambda name, amount=1, **labels: recorded.append((name, labels["marketplace"])))
+    driver = FakeDriver()
+    driver.get(1)
+    return driver, recorded
+
+
+def paginate(driver, known_index, checkpoint, skip_pages=()):
+    return [review.review_id for review in main.iter_paginate(
+        driver, "ES", readiness=FakeReadiness(), known_index=known_index, checkpoint=checkpoint, skip_pages=skip_pages
+    )]
+
+
+def test_pagination_stops_at_the_first_known_page(site, tmp_path):
+    driver, recorded = site
+    known_index = KnownReviewIndex(str(tmp_path / "known_reviews.txt"))
+    known_index.add([make_review(f"{page}-{index}") for page in (3, 4, 5) for index in range(2)])
+    checkpoint = CheckpointLog(str(tmp_path / "checkpoint.ndjson"))
+
+    assert paginate(driver, known_index, checkpoint) == ["1-0", "1-1", "2-0", "2-1"]
+    assert driver.visited == [1, 2, 3]
+    # The page where pagination stopped is counted, but not checkpointed
+    assert recorded == [("pages_scraped", "ES")] * 3
+    resumed_pages = checkpoint.replay()
+    assert list(resumed_pages) == [("ES", 1), ("ES", 2)]
+
+    # Resuming visits the stopping page again, and stops there again
+    driver.visited.clear()
+    driver.get(1)
+    skip_pages = {page for _, page in resumed_pages}
+    assert paginate(driver, known_index, checkpoint, skip_pages) == []
+    assert driver.visited == [1, 3]
+
+
+def test_pagination_keeps_the_new_reviews_of_a_partly_known_page(site, tmp_path):
+    driver, _ = site
+    known_index = KnownReviewIndex(str(tmp_path / "known_reviews.txt"))
+    known_index.add([make_review("2-0")] + [make_review(f"{page}-{index}") for page in (3, 4) for index in range(2)])
+    assert paginate(driver, known_index, None) == ["1-0", "1-1", "2-1"]
+    assert driver.visited == [1, 2, 3]
@@ -0,0 +1,153 @@
+import json
+import os
+
+from google.cloud import bigquery
+import pytest
+
+from bench import FakeBigQueryClient
+from columnar import ReviewBatch
+import load
+from review import ReviewData
+
+
+class RecordingClient(FakeBigQueryClient):
+    """
+    Records the rows and write disposition of every load job, and fails the load calls listed in `fail_calls`.
+    """
+
+    def __init__(self, fail_calls=()):
+        self.fail_calls = set(fail_calls)
+        self.calls = 0
+        self.loads = []
+        self.queries = []
+
+    def load_table_from_file(self, file_obj, table_id, job_config=None, rewind=False):
+        call, self.calls = self.calls, self.calls + 1
+        if call in self.fail_calls:
+            raise RuntimeError("load job failed")
+        rows = [json.loads(line) for line in file_obj.read().splitlines()]
+        self.loads.append((job_config.write_disposition, [row["review_id"] for row in rows]))
+        return super().load_table_from_file(file_obj, table_id, job_config, rewind)
+
+    def query(self, query, job_config=None):
+        self.queries.append(query)
+        return super().query(query, job_config)
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(load.time, "sleep", lambda seconds: None)
+
+
+def make_reviews(count):
+    return [ReviewData(review_id=f"id-{index:02d}", author=f"author {index}", rating=5) for index in range(count)]
+
+
+@pytest.mark.parametrize("as_batch", [False, True])
+def test_chunks_truncate_then_append(as_batch):
+    reviews = make_reviews(25)
+    client = RecordingClient()
+    rows = load.upload_chunks_to_staging_table(ReviewBatch.from_reviews(reviews) if as_batch else iter(reviews),
+                                               chunk_size=10, client=client)
+    assert rows == 25
+    assert [disposition for disposition, _ in client.loads] == [
+        bigquery.WriteDisposition.WRITE_TRUNCATE, bigquery.WriteDisposition.WRITE_APPEND,
+        bigquery.WriteDisposition.WRITE_APPEND,
+    ]
+    assert [len(review_ids) for _, review_ids in client.loads] == [10, 10, 5]
+    assert [review_id for _, review_ids in client.loads for review_id in review_ids] == [
+        review.review_id for review in reviews
+    ]
+    assert client.queries == []
+
+
+def test_append_never_truncates():
+    client = RecordingClient()
+    load.upload_chunks_to_staging_table(make_reviews(15), chunk_size=10, append=True, client=client)
+    assert {disposition for disposition, _ in client.loads} == {bigquery.WriteDisposition.WRITE_APPEND}
+
+
+def test_failed_chunk_is_retried_alone():
+    client = RecordingClient(fail_calls={1})
+    rows = load.upload_chunks_to_staging_table(make_reviews(25), chunk_size=10, client=client)
+    assert rows == 25
+    assert [len(review_ids) for _, review_ids in client.loads] == [10, 10, 5]
+    assert client.calls == 4
+
+
+def test_chunk_failing_every_retry_is_kept(tmp_path):
+    client = RecordingClient(fail_calls={1, 2, 3})
+    with pytest.raises(RuntimeError):
+        load.upload_chunks_to_staging_table(make_reviews(25), chunk_size=10, retries=2, client=client,
+                                            work_dir=str(tmp_path))
+    assert len(client.loads) == 1
+    assert os.listdir(tmp_path) == ["chunk-00001.json"]
+
+
+def test_empty_upload_truncates_staging_table():
+    client = RecordingClient()
+    assert load.upload_chunks_to_staging_table([], client=client) == 0
+    assert client.loads == [] and client.queries == [f"TRUNCATE TABLE `{load.STAGING_TABLE_ID}`"]
+
+    client = RecordingClient()
+    load.upload_chunks_to_staging_table([], append=True, client=client)
+    assert client.queries == []
+
+
+class BilledJob:
+    total_bytes_processed = 3 * 1024 ** 2
+    total_bytes_billed = 10 * 1024 ** 2
+
+    def result(self):
+        return self
+
+
+class BillingClient(RecordingClient):
+    def query(self, query, job_config=None):
+        self.queries.append(query)
+        return BilledJob()
+
+
+def test_merge_stats_are_kept_on_the_session():
+    session = load.LoaderSession(client=BillingClient())
+    assert session.merge_summary() == "no merge run"
+    reviews = make_reviews(3) + make_reviews(1)
+    stats = session.merge_incremental(reviews)
+    assert session.merge_stats is stats
+    assert session.merge_summary() == "3 rows (1 duplicates dropped), 3.0 MiB processed, 10.0 MiB billed"
+
+    session.merge()
+    assert session.merge_summary() == "3.0 MiB processed, 10.0 MiB billed"
+
+
+class FailingMergeClient(RecordingClient):
+    def query(self, query, job_config=None):
+        self.queries.append(query)
+        raise RuntimeError("merge failed")
+
+
+def test_failed_full_merge_is_raised(monkeypatch):
+    session = load.LoaderSession(client=FailingMergeClient())
+    monkeypatch.setattr(load, "_loader_session", session)
+    monkeypatch.setattr(session, "verify", lambda expected_rows=None: {})
+    with pytest.raises(RuntimeError, match="merge failed"):
+        load.upload_and_merge(make_reviews(3), mode="full")
+    assert session.merge_stats is None
+
+
+def test_failed_chunk_of_a_temporary_directory_is_kept(tmp_path, monkeypatch):
+    failed_dir = tmp_path / "failed"
+    monkeypatch.setattr(load, "FAILED_CHUNKS_DIR", str(failed_dir))
+    client = RecordingClient(fail_calls={1, 2})
+    with pytest.raises(RuntimeError):
+        load.upload_chunks_to_staging_table(make_reviews(25), chunk_size=10, retries=1, client=client)
+    assert os.listdir(failed_dir) == ["chunk-00001.json"]
+    with open(failed_dir / "chunk-00001.json", encoding="utf-8") as f:
+        assert [json.loads(line)["review_id"] for line in f] == [f"id-{index:02d}" for index in range(10, 20)]
+
+
+def test_incremental_merge_dedupes_its_source():
+    # A retried append load job may have committed, staging the same rows twice
+    query = load.build_incremental_merge_query()
+    assert "ROW_NUMBER() OVER (PARTITION BY review_id ORDER BY scraped_on DESC)" in query
+    assert "WHERE rn = 1" in query
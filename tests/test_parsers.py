@@ -0,0 +1,102 @@
+from datetime import date
+import os
+
+import pytest
+
+from streaming import iter_reviews_from_file, iter_reviews_html
+from transform import parse_html, parse_review_date_and_author
+
+SAMPLE_HTML = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resources", "sample.html")
+
+
+def sample_page():
+    with open(SAMPLE_HTML, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def dump(reviews):
+    return [review.model_dump() for review in reviews]
+
+
+def test_backends_give_identical_reviews():
+    html_content = sample_page()
+    reviews = dump(parse_html(html_content, backend="bs4"))
+    assert reviews
+    assert dump(parse_html(html_content, backend="lxml")) == reviews
+    assert dump(iter_reviews_html(html_content)) == reviews
+
+
+def test_streaming_is_independent_of_chunking():
+    html_content = sample_page()
+    reviews = dump(parse_html(html_content, backend="bs4"))
+    # Chunk boundaries falling inside tags, attributes and entities must not change the output
+    chunks = (html_content[start:start + 97] for start in range(0, len(html_content), 97))
+    assert dump(iter_reviews_html(chunks)) == reviews
+    assert dump(iter_reviews_from_file(SAMPLE_HTML, chunk_size=4096)) == reviews
+
+
+def test_country_names_in_every_ui_language():
+    from transform import country_code_from_text
+
+    names = {
+        "DE": ["Germany", "Alemania", "Allemagne", "Deutschland", "Germania", "Duitsland", "Tyskland", "Niemcy"],
+        "UK": ["United Kingdom", "Reino Unido", "Royaume-Uni", "Vereinigtes Königreich", "Regno Unito",
+               "Verenigd Koninkrijk", "Storbritannien", "Wielka Brytania"],
+        "PL": ["Poland", "Polonia", "Pologne", "Polen", "Polska"],
+    }
+    for code, country_names in names.items():
+        for name in country_names:
+            assert country_code_from_text(f"Zenement | {name}") == code
+    assert country_code_from_text("Zenement | Atlantis") is None
+
+
+
+@pytest.mark.parametrize("text, expected_date, expected_author", [
+    # English, month first and day first
+    ("Review by John Smith on October 14, 2024", date(2024, 10, 14), "John Smith"),
+    ("Reviewed by John Smith on 14 October 2024", date(2024, 10, 14), "John Smith"),
+    # Spanish, with a multi-word author holding the "de" of the date
+    ("Revisado por Juan de la Cruz el 14 de octubre de 2024", date(2024, 10, 14), "Juan de la Cruz"),
+    ("Revisado por María el 1 de enero de 2023", date(2023, 1, 1), "María"),
+    # French
+    ("Commentaire de Marie Curie le 3 mars 2024", date(2024, 3, 3), "Marie Curie"),
+    ("Avis de Jean le 25 décembre 2022", date(2022, 12, 25), "Jean"),
+    # German
+    ("Rezension von Hans Müller am 14. Oktober 2024", date(2024, 10, 14), "Hans Müller"),
+    ("Rezension von Hans am 1. März 2024", date(2024, 3, 1), "Hans"),
+    # Italian
+    ("Recensione di antonello il 14 ottobre 2024", date(2024, 10, 14), "antonello"),
+    ("Recensito da Anna Maria il 2 febbraio 2021", date(2021, 2, 2), "Anna Maria"),
+    # Dutch
+    ("Beoordeling door Jan de Vries op 14 oktober 2024", date(2024, 10, 14), "Jan de Vries"),
+    ("Beoordeeld door Piet op 30 mei 2024", date(2024, 5, 30), "Piet"),
+    # Swedish
+    ("Recension av Anna Svensson den 14 oktober 2024", date(2024, 10, 14), "Anna Svensson"),
+    ("Recenserad av Lars den 6 augusti 2024", date(2024, 8, 6), "Lars"),
+    # Polish, with genitive month names
+    ("Recenzja od Jan Kowalski dnia 14 października 2024", date(2024, 10, 14), "Jan Kowalski"),
+    ("Opinia przez Ewa w dniu 3 września 2024", date(2024, 9, 3), "Ewa"),
+    # Abbreviated months, with or without a dot
+    ("Review by Jane Doe on Sept 3, 2024", date(2024, 9, 3), "Jane Doe"),
+    ("Review by Jane Doe on Sept. 3, 2024", date(2024, 9, 3), "Jane Doe"),
+    ("Review by Jane on Oct. 14, 2024", date(2024, 10, 14), "Jane"),
+    ("Rezension von Hans am 14. Okt. 2024", date(2024, 10, 14), "Hans"),
+    ("Avis de Jean le 14 déc. 2024", date(2024, 12, 14), "Jean"),
+    # Line breaks and runs of spaces of the page source
+    ("Review by\n    John   Smith\n    on October 14, 2024  ", date(2024, 10, 14), "John Smith"),
+])
+def test_date_and_author_in_every_language(text, expected_date, expected_author):
+    assert parse_review_date_and_author(text) == (expected_date, expected_author)
+
+
+@pytest.mark.parametrize("text", [
+    "Review by Jane on 31 February 2024",
+    "Review by Jane on February 30, 2024",
+    "Review by Jane on Smarch 3, 2024",
+    "Review by Jane on 2024-10-14",
+    "Jane wrote this",
+    "",
+    None,
+])
+def test_invalid_date_and_author(text):
+    assert parse_review_date_and_author(text) == (None, None)
@@ -0,0 +1,123 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+
+import pipeline
+import review
+
+
+def parse_page_number(html_content):
+    return [f"{html_content}-{index}" for index in range(5)]
+
+
+class FailingUploads:
+    def __init__(self, fail_on=(0,)):
+        self.fail_on = set(fail_on)
+        self.calls = 0
+        self.uploaded = []
+
+    def __call__(self, batch):
+        call, self.calls = self.calls, self.calls + 1
+        if call in self.fail_on:
+            raise RuntimeError("staging table unavailable")
+        self.uploaded.extend(batch)
+
+
+def run(jobs, upload, **kwargs):
+    with ThreadPoolExecutor(2) as executor:
+        return asyncio.run(pipeline.run_pipeline(
+            jobs, fetch=str, parse=parse_page_number, upload=upload, fetch_concurrency=2, parse_concurrency=2,
+            upload_concurrency=1, batch_size=5, parse_executor=executor, **kwargs
+        ))
+
+
+def test_failed_upload_batches_are_kept():
+    upload = FailingUploads()
+    stats = run(range(4), upload)
+    assert stats.reviews == 20
+    assert stats.upload.items == 3 and stats.upload.errors == 1
+    assert len(stats.failed_batches) == 1
+    assert sorted(stats.failed_reviews + upload.uploaded) == sorted(f"{page}-{index}" for page in range(4)
+                                                                    for index in range(5))
+
+
+class StubLoader:
+    def __init__(self):
+        self.verified = None
+        self.merged = False
+
+    def truncate_staging(self):
+        pass
+
+    def upload(self, batch, append=False):
+        raise RuntimeError("staging table unavailable")
+
+    def verify(self, expected_rows=None):
+        self.verified = expected_rows
+
+    def merge(self):
+        self.merged = True
+
+    def timing_summary(self):
+        return ""
+
+    def merge_summary(self):
+        return ""
+
+
+def test_scrape_and_upload_saves_failed_batches(monkeypatch, tmp_path):
+    import load
+
+    loader = StubLoader()
+    saved = {}
+    monkeypatch.setattr(load, "get_loader_session", lambda: loader)
+    monkeypatch.setattr(pipeline, "iter_marketplace_jobs", lambda driver, marketplaces: range(2))
+    monkeypatch.setattr(review, "save_reviews_to_ndjson", lambda reviews, filename: saved.update({filename: reviews}))
+
+    with ThreadPoolExecutor(2) as executor:
+        stats = pipeline.scrape_and_upload(None, {}, fetch=str, parse=parse_page_number, batch_size=5,
+                                           parse_executor=executor)
+    assert len(saved[review.DEFAULT_STORE_FILE]) == stats.reviews == 10
+    assert loader.verified == 0 and loader.merged
+
+
+class FakeReadiness:
+    def __init__(self, unconfirmed=()):
+        self.unconfirmed = set(unconfirmed)
+        self.confirmed = []
+
+    def wait_for_marketplace(self, driver, marketplace, marketplace_name):
+        if marketplace in self.unconfirmed:
+            raise TimeoutError(f"still on the previous marketplace, not {marketplace_name}")
+        self.confirmed.append(marketplace)
+
+    def wait_for_reviews(self, driver, marketplace, page_num=None, timer=None):
+        pass
+
+
+class FakeDriver:
+    def get(self, url):
+        pass
+
+    def get_cookies(self):
+        return []
+
+    def execute_script(self, script):
+        return "test-agent"
+
+
+def test_marketplace_jobs_skip_unconfirmed_marketplaces(monkeypatch):
+    import pages
+
+    monkeypatch.setattr(pages, "select_marketplace", lambda driver, account, name: None)
+    monkeypatch.setattr(pages, "get_num_pages", lambda driver: (2, 1))
+    monkeypatch.setattr(pages, "build_url", lambda driver, page_num=1: f"page-{page_num}")
+    readiness = FakeReadiness(unconfirmed={"FR"})
+
+    async def collect():
+        return [job async for job in pipeline.iter_marketplace_jobs(
+            FakeDriver(), {"ES": "Spain", "FR": "France", "DE": "Germany"}, readiness=readiness
+        )]
+
+    jobs = asyncio.run(collect())
+    assert [(job.marketplace, job.page_num) for job in jobs] == [("ES", 1), ("ES", 2), ("DE", 1), ("DE", 2)]
+    assert readiness.confirmed == ["ES", "DE"]
@@ -0,0 +1,19 @@
+from types import SimpleNamespace
+
+import pytest
+
+from readiness import marketplace_selected
+
+
+class HeaderDriver:
+    def __init__(self, text):
+        self.text = text
+
+    def find_elements(self, by, value):
+        return [SimpleNamespace(text=self.text)]
+
+
+@pytest.mark.parametrize("text", ["Zenement | Spain", "Zenement | España"])
+def test_marketplace_selected_in_any_language(text):
+    assert marketplace_selected("ES")(HeaderDriver(text))
+    assert not marketplace_selected("FR")(HeaderDriver(text))
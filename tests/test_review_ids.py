@@ -0,0 +1,76 @@
+from datetime import date
+import hashlib
+import re
+
+import pytest
+
+from columnar import ReviewBatch
+import review
+from review import ReviewData, generate_review_id, generate_review_ids, rekey_review_ids
+
+ROWS = [
+    ("antonello", "Integratore aglio", date(2024, 10, 14)),
+    (None, None, None),
+    ("Jürgen", "Très bien ✓", date(2024, 5, 1)),
+]
+
+
+def baseline_review_id(author, title, review_date):
+    # generate_review_id before review_id schemes existed: every id already in BigQuery was made this way
+    unique_string = f"{author}_{title}_{review_date}"
+    return hashlib.sha256(unique_string.encode('utf-8')).hexdigest()
+
+
+@pytest.fixture
+def fresh_hashers():
+    review._review_id_hasher.cache_clear()
+    yield
+    review._review_id_hasher.cache_clear()
+
+
+def columns(rows):
+    return [list(column) for column in zip(*rows)]
+
+
+def test_sha256_v1_matches_the_baseline_ids():
+    assert generate_review_id(*ROWS[0], scheme="sha256-v1") == \
+        "ee649137eba12f73079381a6b97b5301ecfc174cb6813d6897ea56dfb5db8f85"
+    assert generate_review_id(*ROWS[1], scheme="sha256-v1") == \
+        "ef0090b06033a9c191acbba84ae410a9fb6d400f89d9c2ddc7e10599cfb581a9"
+    for row in ROWS:
+        assert generate_review_id(*row, scheme="sha256-v1") == baseline_review_id(*row)
+    assert generate_review_ids(*columns(ROWS), scheme="sha256-v1") == [baseline_review_id(*row) for row in ROWS]
+
+
+def test_blake2b128_v1_ids_are_32_hex_chars():
+    review_ids = generate_review_ids(*columns(ROWS), scheme="blake2b128-v1")
+    assert all(re.fullmatch(r"[0-9a-f]{32}", review_id) for review_id in review_ids)
+    assert len(set(review_ids)) == len(ROWS)
+    assert review_ids == [generate_review_id(*row, scheme="blake2b128-v1") for row in ROWS]
+
+
+def test_unknown_scheme_raises(fresh_hashers):
+    with pytest.raises(ValueError, match="Unknown review_id scheme 'md5-v1'"):
+        generate_review_id(*ROWS[0], scheme="md5-v1")
+
+
+def test_xxh3_scheme_requires_xxhash(fresh_hashers, monkeypatch):
+    monkeypatch.setattr(review, "xxhash", None)
+    with pytest.raises(ImportError, match="xxhash"):
+        generate_review_ids(*columns(ROWS), scheme="xxh3-128-v1")
+
+
+def test_rekeying_agrees_with_generate_review_ids():
+    authors, titles, review_dates = columns(ROWS)
+    old_ids = generate_review_ids(authors, titles, review_dates, "sha256-v1")
+    new_ids = generate_review_ids(authors, titles, review_dates, "blake2b128-v1")
+    assert rekey_review_ids(authors, titles, review_dates, "sha256-v1", "blake2b128-v1") == list(zip(old_ids, new_ids))
+
+    batch = ReviewBatch.from_reviews(
+        ReviewData(review_id=old_id, author=author, title=title, review_date=review_date)
+        for old_id, (author, title, review_date) in zip(old_ids, ROWS)
+    )
+    batch.rekey("blake2b128-v1")
+    assert batch.column("review_id") == new_ids
+    batch.rekey("sha256-v1")
+    assert batch.column("review_id") == old_ids
@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+def test_service_does_not_import_selenium():
+    code = "import sys, service; print(sorted(name for name in sys.modules if name.split('.')[0] == 'selenium'))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=SRC_DIR, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "[]"
+
+
+def test_metrics_report_latency_percentiles(tmp_path):
+    from service import IngestionService, LATENCY_STEPS
+
+    service = IngestionService(upload_dir=str(tmp_path))
+    for seconds in (0.1, 0.2, 0.3):
+        service.latencies["parse"].observe(seconds)
+    latency = service.metrics()["latency"]
+    assert set(latency) == set(LATENCY_STEPS)
+    assert 0.1 <= latency["parse"]["p50"] <= 0.3 and latency["load"]["p95"] is None
+
+
+class FakeRequest:
+    def __init__(self, *chunks):
+        self.chunks = chunks
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def upload(monkeypatch, tmp_path, filename, *chunks):
+    import asyncio
+    import service
+
+    monkeypatch.setattr(service, "service", service.IngestionService(upload_dir=str(tmp_path)))
+    monkeypatch.setattr(service, "MAX_UPLOAD_BYTES", 10)
+    return asyncio.run(service.upload_capture(filename, FakeRequest(*chunks)))
+
+
+def test_oversized_uploads_are_rejected_with_413(monkeypatch, tmp_path):
+    from fastapi import HTTPException
+
+    with pytest.raises(HTTPException) as exc_info:
+        upload(monkeypatch, tmp_path, "page.html", b"x" * 6, b"x" * 6)
+    assert exc_info.value.status_code == 413
+    assert os.listdir(tmp_path) == []
+
+    with pytest.raises(HTTPException) as exc_info:
+        upload(monkeypatch, tmp_path, "page.txt", b"x")
+    assert exc_info.value.status_code == 400
+
+
+def test_failed_open_is_not_masked(monkeypatch, tmp_path):
+    # The upload directory is only created by IngestionService.start
+    with pytest.raises(FileNotFoundError, match="missing"):
+        upload(monkeypatch, tmp_path / "missing", "page.html", b"x")
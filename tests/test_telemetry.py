@@ -0,0 +1,61 @@
+import json
+import threading
+import time
+
+from telemetry import Telemetry
+
+
+def test_export_with_missing_label_values(tmp_path):
+    telemetry = Telemetry()
+    telemetry.increment("reviews_parsed", country=None)
+    telemetry.increment("reviews_parsed", country="ES")
+    telemetry.observe("parse", 0.01, country=None)
+    telemetry.observe("parse", 0.02, country="ES")
+
+    counters = {counter["labels"]["country"]: counter["value"] for counter in telemetry.to_dict()["counters"]}
+    assert counters == {"None": 1, "ES": 1}
+    assert 'review_reviews_parsed_total{country="None"} 1' in telemetry.to_prometheus()
+
+    telemetry.export(str(tmp_path / "telemetry.json"))
+    telemetry.export(str(tmp_path / "telemetry.prom"))
+    assert len(json.loads((tmp_path / "telemetry.json").read_text())["histograms"]) == 2
+
+
+def test_disabled_records_nothing():
+    telemetry = Telemetry(enabled=False)
+    telemetry.increment("reviews_parsed", country="ES")
+    with telemetry.span("parse", country="ES"):
+        pass
+    assert telemetry.to_dict()["counters"] == [] and telemetry.spans == []
+
+
+def test_profiler_export_while_sampling(tmp_path):
+    telemetry = Telemetry(profile=True)
+    profiler = telemetry.profiler
+    profiler.interval = 0.0005
+    stop = threading.Event()
+
+    def busy():
+        with telemetry.profiled("parse"):
+            while not stop.is_set():
+                sum(range(1000))
+
+    thread = threading.Thread(target=busy)
+    thread.start()
+    try:
+        # Reading the samples while the sampler adds new stacks must not fail
+        deadline = time.monotonic() + 10
+        while not profiler.snapshot() and time.monotonic() < deadline:
+            telemetry.to_dict()
+            profiler.folded()
+        for _ in range(200):
+            telemetry.to_dict()
+            profiler.folded()
+    finally:
+        stop.set()
+        thread.join()
+    telemetry.export(str(tmp_path / "telemetry.json"))
+    assert profiler._thread is None
+    assert (tmp_path / "telemetry.json.folded").read_text().startswith("parse;")
+    assert json.loads((tmp_path / "telemetry.json").read_text())["profile"]["parse"]
+
@@ -0,0 +1,88 @@
+from datetime import date
+
+import pytest
+
+from columnar import ReviewBatch
+from review import ReviewData
+from warehouse import ReviewWarehouse
+
+
+def make_review(review_id, country="ES", asin="B0TEST", review_date=date(2024, 5, 1), rating=5,
+                title="Great blender", body="Powerful and quiet", scraped_on=date(2024, 6, 1), **values):
+    return ReviewData(review_id=review_id, country=country, asin=asin, review_date=review_date, rating=rating,
+                      title=title, body=body, scraped_on=scraped_on, **values)
+
+
+@pytest.fixture
+def warehouse(tmp_path):
+    with ReviewWarehouse(str(tmp_path / "reviews.sqlite")) as warehouse:
+        yield warehouse
+
+
+def test_upsert_keeps_the_latest_scrape(warehouse):
+    assert warehouse.upsert([make_review("a"), make_review("b")]) == 2
+    # Unchanged rows are not rewritten, even by a newer scrape
+    assert warehouse.upsert([make_review("a", scraped_on=date(2024, 7, 1))]) == 0
+    assert warehouse.get("a").scraped_on == date(2024, 6, 1)
+    # An older scrape does not overwrite a newer one
+    assert warehouse.upsert([make_review("a", rating=1, scraped_on=date(2024, 5, 1))]) == 0
+    assert warehouse.get("a").rating == 5
+    # A newer scrape with changed content does
+    assert warehouse.upsert(ReviewBatch.from_reviews([make_review("a", rating=1, scraped_on=date(2024, 7, 1))])) == 1
+    review = warehouse.get("a")
+    assert review.rating == 1 and review.scraped_on == date(2024, 7, 1)
+    assert len(warehouse) == 2 and "b" in warehouse and "c" not in warehouse and warehouse.get("c") is None
+
+
+def test_full_text_index_follows_updates(warehouse):
+    warehouse.upsert([make_review("a", title="Great blender", body="Crushes ice"), make_review("b", body="Noisy")])
+    assert {review.review_id for review in warehouse.search("blender")} == {"a", "b"}
+    warehouse.upsert([make_review("a", title="Broken kettle", body="Leaks", scraped_on=date(2024, 7, 1))])
+    assert [review.review_id for review in warehouse.search("blender")] == ["b"]
+    assert [review.review_id for review in warehouse.search("kettle")] == ["a"]
+    assert warehouse.search("ice") == []
+
+
+def test_search_with_filters(warehouse):
+    warehouse.upsert([
+        make_review("a", country="ES", rating=5, body="Crème brûlée maker"),
+        make_review("b", country="FR", rating=2, body="Creme brulee maker, broke quickly"),
+        make_review("c", country="FR", rating=5, body="Kettle"),
+    ])
+    # Matched case and accent insensitively
+    assert {review.review_id for review in warehouse.search("CREME")} == {"a", "b"}
+    assert [review.review_id for review in warehouse.search("creme", country="FR")] == ["b"]
+    assert [review.review_id for review in warehouse.search("creme", min_rating=4)] == ["a"]
+    assert [review.review_id for review in warehouse.search("creme", limit=1, country="ES")] == ["a"]
+
+
+def test_filters(warehouse):
+    warehouse.upsert([
+        make_review("a", country="ES", asin="B01", review_date=date(2024, 5, 1), rating=5),
+        make_review("b", country="ES", asin="B02", review_date=date(2024, 5, 3), rating=1),
+        make_review("c", country="DE", asin="B01", review_date=date(2024, 5, 2), rating=3),
+        make_review("d", country=None, asin="B01", review_date=None, rating=2),
+    ])
+    assert [review.review_id for review in warehouse.query()] == ["b", "c", "a", "d"]
+    assert [review.review_id for review in warehouse.query(limit=2)] == ["b", "c"]
+    assert [review.review_id for review in warehouse.query(country="ES")] == ["b", "a"]
+    assert [review.review_id for review in warehouse.query(asin="B01", max_rating=3)] == ["c", "d"]
+    assert [review.review_id for review in warehouse.query(since=date(2024, 5, 2), until=date(2024, 5, 2))] == ["c"]
+    assert [review.review_id for review in warehouse.query(min_rating=2, max_rating=4)] == ["c", "d"]
+
+    assert warehouse.count() == 4 and warehouse.count(country="ES", min_rating=2) == 1
+    assert warehouse.count(missing_country=True) == 1
+    assert warehouse.count(missing_country=True, asin="B02") == 0
+    assert warehouse.fetch_columns(["review_id", "rating"], missing_country=True) == {"review_id": ["d"],
+                                                                                       "rating": [2]}
+    assert warehouse.fetch_columns(["review_date"], country="DE") == {"review_date": ["2024-05-02"]}
+    assert warehouse.fetch_columns(["review_id"], country="IT") == {"review_id": []}
+    with pytest.raises(ValueError, match="Unknown columns: nope"):
+        warehouse.fetch_columns(["review_id", "nope"])
+
+
+def test_known_ids_of_more_ids_than_sqlite_parameters(warehouse):
+    warehouse.upsert(make_review(f"stored-{index}") for index in range(1000))
+    review_ids = [f"stored-{index}" for index in range(0, 2000, 2)] + [f"new-{index}" for index in range(1500)]
+    assert warehouse.known_ids(iter(review_ids)) == {f"stored-{index}" for index in range(0, 1000, 2)}
+    assert warehouse.known_ids([]) == set()
@@ -0,0 +1,211 @@
+import threading
+
+import pytest
+from selenium.common.exceptions import TimeoutException
+
+from pages import markeplace_names
+import workers
+
+
+class FakeElement:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeDriver:
+    """
+    Records the pages it opens, and fails the urls listed in `fail_urls` (shared by every driver of a pool).
+    Its header shows the marketplace of its "marketplace" cookie, or always `selected` if given.
+    """
+
+    def __init__(self, fail_urls=None, cookies=None, selected=None):
+        self.fail_urls = fail_urls if fail_urls is not None else {}
+        self.current_url = None
+        self.cookies = list(cookies or [])
+        self.selected = selected
+        self.visited = []
+        self.quit_called = False
+
+    def get(self, url):
+        self.current_url = url
+        self.visited.append(url)
+        remaining = self.fail_urls.get(url, 0)
+        if remaining:
+            self.fail_urls[url] = remaining - 1
+            raise RuntimeError(f"browser crashed on {url}")
+
+    def delete_all_cookies(self):
+        self.cookies = []
+
+    def add_cookie(self, cookie):
+        self.cookies.append(cookie)
+
+    def get_cookies(self):
+        return self.cookies
+
+    def find_elements(self, by, value):
+        selected = self.selected or next(
+            (cookie["value"] for cookie in self.cookies if cookie["name"] == "marketplace"), None
+        )
+        return [FakeElement(f"Brand | {markeplace_names[selected]}")] if selected else []
+
+    @property
+    def page_source(self):
+        return self.current_url
+
+    def quit(self):
+        self.quit_called = True
+
+
+class FakeDriverFactory:
+    def __init__(self, fail_urls=None, selected=None):
+        self.fail_urls = fail_urls if fail_urls is not None else {}
+        self.selected = selected
+        self.drivers = []
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        driver = FakeDriver(self.fail_urls, selected=self.selected)
+        with self.lock:
+            self.drivers.append(driver)
+        return driver
+
+
+@pytest.fixture(autouse=True)
+def pages_ready(monkeypatch):
+    # The fake pages are ready as soon as they are opened
+    monkeypatch.setattr(workers.Readiness, "wait_for_reviews", lambda self, driver, marketplace, page_num=None: None)
+    monkeypatch.setattr(workers.WorkerPool, "parse",
+                        lambda self, html_content, marketplace, page_num: [f"{marketplace}:{page_num}"])
+
+
+def page_url(base_url, page_num):
+    return workers.build_page_url(base_url, page_num)
+
+
+def make_jobs(marketplaces=("ES", "FR"), num_pages=7):
+    jobs = []
+    for marketplace in marketplaces:
+        cookies = [{"name": "marketplace", "value": marketplace, "sameSite": "Lax"}]
+        jobs.extend(workers.plan_jobs(marketplace, f"https://{marketplace.lower()}.example", range(1, num_pages + 1),
+                                      cookies, pages_per_job=3))
+    return jobs
+
+
+def test_plan_jobs():
+    jobs = workers.plan_jobs("ES", "https://es.example", range(1, 8), pages_per_job=3)
+    assert [job.pages for job in jobs] == [[1, 2, 3], [4, 5, 6], [7]]
+
+
+def test_pool_scrapes_every_page_in_order():
+    factory = FakeDriverFactory()
+    pool = workers.WorkerPool(3, factory, rate_limit=1000, burst=1000)
+    reviews = pool.run(make_jobs())
+    assert reviews == {marketplace: [f"{marketplace}:{page}" for page in range(1, 8)] for marketplace in ("ES", "FR")}
+    assert 1 <= len(factory.drivers) <= 3
+    assert all(driver.quit_called for driver in factory.drivers)
+    # Cookies are applied with the fields WebDriver accepts only
+    assert all(set(cookie) <= set(workers._COOKIE_FIELDS) for driver in factory.drivers for cookie in driver.cookies)
+
+
+def test_worker_restarts_browser_after_a_failure():
+    failing_url = page_url("https://es.example", 2)
+    factory = FakeDriverFactory({failing_url: 1})
+    pool = workers.WorkerPool(1, factory, rate_limit=1000, burst=1000)
+    reviews = pool.run(make_jobs(("ES",), 3))
+    assert reviews == {"ES": ["ES:1", "ES:2", "ES:3"]}
+    assert len(factory.drivers) == 2 and factory.drivers[0].quit_called
+
+
+def test_failing_page_is_handed_out_again_then_given_up():
+    failing_url = page_url("https://es.example", 2)
+    # Fails the first worker's attempt and its restarts, then the retry of the page as well
+    factory = FakeDriverFactory({failing_url: 100})
+    pool = workers.WorkerPool(2, factory, rate_limit=1000, burst=1000, max_restarts=1, page_attempts=2)
+    reviews = pool.run(make_jobs(("ES",), 3))
+    assert reviews == {"ES": ["ES:1", "ES:3"]}
+    assert sum(driver.visited.count(failing_url) for driver in factory.drivers) == 4
+
+
+def test_pages_of_another_marketplace_are_rejected():
+    # The selection lives in the server-side session: every browser shows the last marketplace selected
+    factory = FakeDriverFactory(selected="FR")
+    pool = workers.WorkerPool(2, factory, rate_limit=1000, burst=1000, max_restarts=0, page_attempts=2)
+    reviews = pool.run(make_jobs(num_pages=3))
+    assert reviews == {"FR": ["FR:1", "FR:2", "FR:3"]}
+
+
+class WorkerKilled(BaseException):
+    pass
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_pool_does_not_wait_for_stopped_workers():
+    def killed():
+        raise WorkerKilled("browser process killed")
+
+    reviews = workers.WorkerPool(2, killed, rate_limit=1000, burst=1000).run(make_jobs())
+    assert reviews == {}
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_pages_of_a_stopped_worker_are_handed_out_again():
+    factory = FakeDriverFactory()
+    calls = []
+
+    def kill_first_browser():
+        calls.append(None)
+        if len(calls) == 1:
+            raise WorkerKilled("browser process killed")
+        return factory()
+
+    reviews = workers.WorkerPool(2, kill_first_browser, rate_limit=1000, burst=1000).run(make_jobs(("ES",), 3))
+    assert reviews == {"ES": ["ES:1", "ES:2", "ES:3"]}
+
+
+def test_checkpoint_records_every_page():
+    class Checkpoint:
+        def __init__(self):
+            self.pages = []
+            self.synced = False
+
+        def record(self, marketplace, page_num, reviews):
+            self.pages.append((marketplace, page_num))
+
+        def sync(self):
+            self.synced = True
+
+    checkpoint = Checkpoint()
+    workers.WorkerPool(2, FakeDriverFactory(), rate_limit=1000, burst=1000, checkpoint=checkpoint).run(make_jobs())
+    assert sorted(checkpoint.pages) == [(marketplace, page) for marketplace in ("ES", "FR") for page in range(1, 8)]
+    assert checkpoint.synced
+
+
+def test_rate_limiter_spaces_requests(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(workers.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(workers.time, "sleep", lambda seconds: clock.__setitem__(0, clock[0] + seconds))
+    limiter = workers.DomainRateLimiter(rate=2.0, burst=2)
+    for _ in range(6):
+        limiter.acquire("es.example")
+    limiter.acquire("fr.example")
+    # Two requests in a burst, then one every half second; other domains are not slowed down
+    assert clock[0] == pytest.approx(2.0)
+
+
+def test_prepare_jobs_skips_marketplaces_that_fail_to_load(monkeypatch):
+    driver = FakeDriver(cookies=[{"name": "session", "value": "1"}])
+    driver.current_url = "https://es.example/home"
+
+    def wait_for_reviews(self, driver, marketplace, page_num=None):
+        if marketplace == "FR":
+            raise TimeoutException("no reviews")
+
+    monkeypatch.setattr(workers, "select_marketplace", lambda driver, account, marketplace_name: None)
+    monkeypatch.setattr(workers.Readiness, "wait_for_marketplace", lambda self, driver, marketplace, name: None)
+    monkeypatch.setattr(workers.Readiness, "wait_for_reviews", wait_for_reviews)
+    monkeypatch.setattr(workers, "get_num_pages", lambda driver: (4, 1))
+
+    jobs = workers.prepare_jobs(driver, {"ES": "Spain", "FR": "France", "DE": "Germany"}, skip_pages={"DE": {1, 2}},
+                                pages_per_job=3)
+    assert [(job.marketplace, job.pages) for job in jobs] == [("ES", [1, 2, 3]), ("ES", [4]), ("DE", [3, 4])]